@@ -57,7 +57,7 @@ class ToolBase(object):
         self.caching = False
         self.dryrun = False
 
-    @memoize(add_invalidate=True)
+    @memoize(add_invalidate=True, keep_open=True)
     def _cached_GET(self, url):
         return self.retried_GET(url).read()
 
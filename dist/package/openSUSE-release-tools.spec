@@ -37,6 +37,8 @@ BuildRequires:  python-lxml
 BuildRequires:  python-pycurl
 BuildRequires:  python-python-dateutil
 BuildRequires:  python-pyxdg
+BuildRequires:  python-rpm
+BuildRequires:  python-solv
 BuildRequires:  python-urlgrabber
 %if 0%{?is_opensuse}
 # Testing only requirements installed for `make check`.
@@ -173,9 +175,8 @@ Group:          Development/Tools/Other
 BuildArch:      noarch
 # TODO Update requirements.
 Requires:       osclib = %{version}
-# repo_checker.pl
-Requires:       build
-Requires:       perl-XML-Simple
+Requires:       python-rpm
+Requires:       python-solv
 Requires(pre):  shadow
 
 %description repo-checker
@@ -213,6 +214,7 @@ BuildArch:      noarch
 Requires:       obs-service-product_converter
 Requires:       osclib = %{version}
 Requires:       python-requests
+Requires:       python-rpm
 Requires:       python-solv
 # we use the same user as repo-checker
 PreReq:         openSUSE-release-tools-repo-checker
@@ -402,7 +404,6 @@ fi
 %exclude %{_datadir}/%{source_dir}/metrics_release.py
 %exclude %{_bindir}/osrt-openqa-comments
 %exclude %{_datadir}/%{source_dir}/pkglistgen.py
-%exclude %{_datadir}/%{source_dir}/repo_checker.pl
 %exclude %{_datadir}/%{source_dir}/repo_checker.py
 %exclude %{_datadir}/%{source_dir}/suppkg_rebuild.py
 %exclude %{_datadir}/%{source_dir}/totest-manager.py
@@ -490,7 +491,6 @@ fi
 %files repo-checker
 %defattr(-,root,root,-)
 %{_bindir}/osrt-repo_checker
-%{_datadir}/%{source_dir}/repo_checker.pl
 %{_datadir}/%{source_dir}/repo_checker.py
 %{_unitdir}/osrt-repo-checker.service
 %{_unitdir}/osrt-repo-checker.timer
@@ -1,14 +1,21 @@
 #!/usr/bin/python
 
 import argparse
+import bisect
+import calendar
+from collections import deque
 from collections import namedtuple
 from datetime import datetime
 from dateutil.parser import parse as date_parse
+import heapq
 from influxdb import InfluxDBClient
+import marshal
 from lxml import etree as ET
+from multiprocessing.pool import ThreadPool
 import os
 import subprocess
 import sys
+import tempfile
 import yaml
 
 import metrics_release
@@ -21,6 +28,9 @@ from osclib.conf import Config
 from osclib.stagingapi import StagingAPI
 
 SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
+# Number of requests per search result page and pages fetched ahead.
+SEARCH_PAGE_SIZE = 1000
+SEARCH_PREFETCH = 4
 Point = namedtuple('Point', ['measurement', 'tags', 'fields', 'time', 'delta'])
 
 # Duplicate Leap config to handle 13.2 without issue.
@@ -30,212 +40,456 @@ osclib.conf.DEFAULT[
 
 # Provide osc.core.get_request_list() that swaps out search() implementation to
 # capture the generated query, paginate over and yield each request to avoid
-# loading all requests at the same time. Additionally, use lxml ET to avoid
-# having to re-parse to perform complex xpaths.
+# loading all requests at the same time.
 def get_request_list(*args, **kwargs):
+    since = kwargs.pop('since', None)
+
     osc.core._search = osc.core.search
     osc.core.search = search_capture
-    osc.core._ET = osc.core.ET
-    osc.core.ET = ET
 
     osc.core.get_request_list(*args, **kwargs)
 
     osc.core.search = osc.core._search
 
     query = search_capture.query
-    for request in search_paginated_generator(query[0], query[1], **query[2]):
+    for request in search_paginated_generator(query[0], query[1], since=since, **query[2]):
         # Python 3 yield from.
         yield request
 
-    osc.core.ET = osc.core._ET
-
 def search_capture(apiurl, queries=None, **kwargs):
     search_capture.query = (apiurl, queries, kwargs)
     return {'request': ET.fromstring('<collection matches="0"></collection>')}
 
 # Provides a osc.core.search() implementation for use with get_request_list()
-# that paginates in sets of 1000 and yields each request.
-def search_paginated_generator(apiurl, queries=None, **kwargs):
+# that paginates in sets of 1000 and yields a RequestRecord for each request. If
+# since is given only requests changed after that time are included. Once the
+# number of matches is known from the first page, the following pages are
+# fetched by a pool of threads keeping up to prefetch pages in flight while
+# earlier pages are being processed. Pages are still yielded in order.
+def search_paginated_generator(apiurl, queries=None, since=None, prefetch=SEARCH_PREFETCH, **kwargs):
     if "submit/target/@project='openSUSE:Factory'" in kwargs['request']:
         kwargs['request'] = osc.core.xpath_join(kwargs['request'], '@id>250000', op='and')
+    if since:
+        kwargs['request'] = osc.core.xpath_join(
+            kwargs['request'], "state/@when>'{}'".format(since), op='and')
+
+    def search_page(offset):
+        query = dict(queries['request'], match=kwargs['request'], limit=SEARCH_PAGE_SIZE, offset=offset)
+        url = osc.core.makeurl(apiurl, ['search', 'request'], query)
+        return request_records_parse(osc.core.http_GET(url))
+
+    matches, records = search_page(0)
+    print('processing {:,} requests'.format(matches))
+
+    offsets = deque(range(SEARCH_PAGE_SIZE, matches, SEARCH_PAGE_SIZE))
+    pending = deque()
+    pool = ThreadPool(prefetch) if prefetch > 1 and len(offsets) else None
+    try:
+        while True:
+            while pool and len(offsets) and len(pending) < prefetch:
+                pending.append(pool.apply_async(search_page, (offsets.popleft(),)))
+
+            for request in records:
+                yield request
+
+            if len(pending):
+                _, records = pending.popleft().get()
+            elif len(offsets):
+                _, records = search_page(offsets.popleft())
+            else:
+                break
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+# Compact representation of the parts of a request used to generate points with
+# times pre-parsed into epoch seconds (at) next to the original strings (when).
+RequestRecord = namedtuple('RequestRecord', ['id', 'type', 'when', 'at', 'priority', 'history', 'reviews'])
+ReviewRecord = namedtuple('ReviewRecord', ['state', 'when', 'at', 'who', 'by_project', 'by_group', 'by', 'history'])
+HistoryRecord = namedtuple('HistoryRecord', ['when', 'at', 'who', 'description', 'comment'])
+
+# Parse a request search result from a file-like object into a RequestRecord per
+# request in a single pass. Each request element is discarded once converted so
+# that the complete tree is never held in memory. Returns the number of matches
+# and the list of records.
+def request_records_parse(f):
+    matches = None
+    records = []
+    for event, element in ET.iterparse(f, events=('start', 'end'), tag=('collection', 'request')):
+        if element.tag == 'collection':
+            if event == 'start':
+                matches = int(element.get('matches'))
+            continue
+        if event == 'start':
+            continue
 
-    request_count = 0
-    queries['request']['limit'] = 1000
-    queries['request']['offset'] = 0
-    while True:
-        collection = osc.core.search(apiurl, queries, **kwargs)['request']
-        if not request_count:
-            print('processing {:,} requests'.format(int(collection.get('matches'))))
-
-        for request in collection.findall('request'):
-            yield request
-            request_count += 1
-
-        if request_count == int(collection.get('matches')):
-            # Stop paging once the expected number of items has been returned.
-            break
-
-        # Release memory as otherwise ET seems to hold onto it.
-        collection.clear()
-        queries['request']['offset'] += queries['request']['limit']
-
-points = []
-
-def point(measurement, fields, datetime, tags={}, delta=False):
+        records.append(request_record(element))
+
+        # Release the parsed request and any previous siblings.
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    return matches, records
+
+def request_record(element):
+    request_type = None
+    state = None
+    priority = None
+    history = []
+    reviews = []
+    for child in element:
+        if child.tag == 'action':
+            if request_type is None:
+                request_type = child.get('type')
+        elif child.tag == 'state':
+            state = child.get('when')
+        elif child.tag == 'history':
+            history.append(history_record(child))
+        elif child.tag == 'review':
+            reviews.append(ReviewRecord(
+                child.get('state'), child.get('when'), epoch(child.get('when')), child.get('who'),
+                child.get('by_project', ''), child.get('by_group', ''),
+                tuple(sorted((item for item in child.items() if item[0].startswith('by_')), reverse=True)),
+                tuple(history_record(h) for h in child.iterchildren('history'))))
+        elif child.tag == 'priority':
+            priority = child.text
+
+    return RequestRecord(element.get('id'), request_type, state, epoch(state), priority,
+                         tuple(history), tuple(reviews))
+
+def history_record(element):
+    description = element.find('description')
+    comment = element.find('comment')
+    return HistoryRecord(
+        element.get('when'), epoch(element.get('when')), element.get('who'),
+        description.text if description is not None else None,
+        comment.text if comment is not None else None)
+
+# OBS times are UTC in the form 2017-01-31T12:34:56 which is converted directly
+# as it is much faster than a generic date parser used for anything else.
+def epoch(when):
+    if when is None:
+        return None
+    if len(when) == 19 and when[10] == 'T':
+        return calendar.timegm((int(when[0:4]), int(when[5:7]), int(when[8:10]),
+                                int(when[11:13]), int(when[14:16]), int(when[17:19])))
+    return calendar.timegm(date_parse(when).utctimetuple())
+
+# Points are sorted in memory in runs of this size which are spilled to disk.
+POINTS_RUN_SIZE = 100000
+
+class PointRuns(object):
+    """Points to be walked in order by time kept in bounded memory.
+
+    Once run_size points have been added they are sorted and spilled to a
+    temporary file. The runs are merged when walked in order so that at most
+    one run and a point per spilled run are held in memory. Points at the same
+    time are kept in the order they were added.
+
+    """
+
+    def __init__(self, run_size=POINTS_RUN_SIZE):
+        self.run_size = run_size
+        self.run = []
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, point):
+        self.run.append((point.time, self.count, point))
+        self.count += 1
+        if len(self.run) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        self.run.sort()
+        f = tempfile.TemporaryFile()
+        for time, index, point in self.run:
+            # Points only contain builtin types for which marshal is fastest.
+            marshal.dump((time, index, tuple(point)), f)
+        f.seek(0)
+        self.runs.append(f)
+        self.run = []
+
+    @staticmethod
+    def run_load(f):
+        while True:
+            try:
+                time, index, point = marshal.load(f)
+            except EOFError:
+                break
+            yield time, index, Point(*point)
+
+    def sorted(self):
+        """Generate all points ordered by time."""
+        self.run.sort()
+        try:
+            runs = [self.run_load(f) for f in self.runs]
+            for time, index, point in heapq.merge(self.run, *runs):
+                yield point
+        finally:
+            for f in self.runs:
+                f.close()
+            self.runs = []
+            self.run = []
+
+points = PointRuns()
+
+def point(measurement, fields, time, tags={}, delta=False):
     global points
-    points.append(Point(measurement, tags, fields, timestamp(datetime), delta))
+    points.append(Point(measurement, tags, fields, time, delta))
 
+# Naive datetimes, as parsed from OBS and the commit log, are UTC like epoch().
 def timestamp(datetime):
-    return int(datetime.strftime('%s'))
+    return calendar.timegm(datetime.utctimetuple())
+
+def ingest_requests(api, project, incremental=False):
+    since, counters = ingest_requests_state_get() if incremental else (None, None)
+    if since:
+        print('processing requests changed after {}'.format(since))
 
-def ingest_requests(api, project):
     requests = get_request_list(api.apiurl, project,
                                 req_state=('accepted', 'revoked', 'superseded'),
                                 exclude_target_projects=[project],
-                                withfullhistory=True)
+                                withfullhistory=True, since=since)
+    final_last = since
     for request in requests:
-        if request.find('action').get('type') not in ('submit', 'delete'):
+        if request.type not in ('submit', 'delete'):
             # TODO Handle non-stageable requests via different flow.
             continue
 
-        created_at = date_parse(request.find('history').get('when'))
-        final_at = date_parse(request.find('state').get('when'))
-        final_at_history = date_parse(request.find('history[last()]').get('when'))
-        if final_at_history > final_at:
-            # Workaround for invalid dates: openSUSE/open-build-service#3858.
-            final_at = final_at_history
-
-        # TODO Track requests in psuedo-ignore state.
-        point('total', {'backlog': 1, 'open': 1}, created_at, {'event': 'create'}, True)
-        point('total', {'backlog': -1, 'open': -1}, final_at, {'event': 'close'}, True)
-
-        request_tags = {}
-        request_fields = {
-            'total': (final_at - created_at).total_seconds(),
-            'staged_count': len(request.findall('review[@by_group="factory-staging"]/history')),
-        }
-        # TODO Total time spent in backlog (ie factory-staging, but excluding when staged).
-
-        staged_first_review = request.xpath('review[contains(@by_project, "{}:Staging:")]'.format(project))
-        if len(staged_first_review):
-            by_project = staged_first_review[0].get('by_project')
-            request_tags['type'] = 'adi' if api.is_adi_project(by_project) else 'letter'
-
-            # TODO Determine current whitelists state based on dashboard revisions.
-            if project.startswith('openSUSE:Factory'):
-                splitter_whitelist = 'B C D E F G H I J'.split()
-                if splitter_whitelist:
-                    short = api.extract_staging_short(by_project)
-                    request_tags['whitelisted'] = short in splitter_whitelist
-            else:
-                # All letter where whitelisted since no restriction.
-                request_tags['whitelisted'] = request_tags['type'] == 'letter'
-
-        ready_to_accept = request.xpath('review[contains(@by_project, "{}:Staging:adi:") and @state="accepted"]/history[comment[text() = "ready to accept"]]/@when'.format(project))
-        if len(ready_to_accept):
-            ready_to_accept = date_parse(ready_to_accept[0])
-            request_fields['ready'] = (final_at - ready_to_accept).total_seconds()
-
-            # TODO Points with indentical timestamps are merged so this can be placed in total
-            # measurement, but may make sense to keep this separate and make the others follow.
-            point('ready', {'count': 1}, ready_to_accept, delta=True)
-            point('ready', {'count': -1}, final_at, delta=True)
-
-        staged_first = request.xpath('review[@by_group="factory-staging"]/history/@when')
-        if len(staged_first):
-            staged_first = date_parse(staged_first[0])
-            request_fields['staged_first'] = (staged_first - created_at).total_seconds()
-
-            # TODO Decide if better to break out all measurements by time most relevant to event,
-            # time request was created, or time request was finalized. It may also make sense to
-            # keep separate measurement by different times like this one.
-            point('request_staged_first', {'value': request_fields['staged_first']}, staged_first, request_tags)
-
-        point('request', request_fields, final_at, request_tags)
-
-        # Staging related reviews.
-        for number, review in enumerate(
-            request.xpath('review[contains(@by_project, "{}:Staging:")]'.format(project)), start=1):
-            staged_at = date_parse(review.get('when'))
-
-            project_type = 'adi' if api.is_adi_project(review.get('by_project')) else 'letter'
-            short = api.extract_staging_short(review.get('by_project'))
-            point('staging', {'count': 1}, staged_at,
-                  {'id': short, 'type': project_type, 'event': 'select'}, True)
-            point('total', {'backlog': -1, 'staged': 1}, staged_at, {'event': 'select'}, True)
-
-            who = who_workaround(request, review)
-            review_tags = {'event': 'select', 'user': who, 'number': number}
-            review_tags.update(request_tags)
-            point('user', {'count': 1}, staged_at, review_tags)
-
-            history = review.find('history')
-            if history is not None:
-                unselected_at = date_parse(history.get('when'))
-            else:
-                unselected_at = final_at
-
-            # If a request is declined and re-opened it must be repaired before being re-staged. At
-            # which point the only possible open review should be the final one.
-            point('staging', {'count': -1}, unselected_at,
-                  {'id': short, 'type': project_type, 'event': 'unselect'}, True)
-            point('total', {'backlog': 1, 'staged': -1}, unselected_at, {'event': 'unselect'}, True)
-
-        # No-staging related reviews.
-        for review in request.xpath('review[not(contains(@by_project, "{}:Staging:"))]'.format(project)):
-            tags = {
-                # who_added is non-trivial due to openSUSE/open-build-service#3898.
-                'state': review.get('state'),
-            }
-
-            opened_at = date_parse(review.get('when'))
-            history = review.find('history')
-            if history is not None:
-                completed_at = date_parse(history.get('when'))
-                tags['who_completed'] = history.get('who')
-            else:
-                completed_at = final_at
-                # Does not seem to make sense to mirror user responsible for making final state
-                # change as the user who completed the review.
-
-            tags['key'] = []
-            tags['type'] = []
-            for name, value in sorted(review.items(), reverse=True):
-                if name.startswith('by_'):
-                    tags[name] = value
-                    tags['key'].append(value)
-                    tags['type'].append(name[3:])
-            tags['type'] = '_'.join(tags['type'])
-
-            point('review', {'open_for': (completed_at - opened_at).total_seconds()}, completed_at, tags)
-            point('review_count', {'count':  1}, opened_at, tags, True)
-            point('review_count', {'count': -1}, completed_at, tags, True)
-
-        found = []
-        for set_priority in request.xpath('history[description[contains(text(), "Request got a new priority:")]]'):
-            parts = set_priority.find('description').text.rsplit(' ', 3)
-            priority_previous = parts[1]
-            priority = parts[3]
-            if priority == priority_previous:
-                continue
+        if since and request.when <= since:
+            # Changed after being finalized and thus already ingested.
+            continue
+        final_last = max(final_last, request.when)
 
-            changed_at = date_parse(set_priority.get('when'))
-            if priority_previous != 'moderate':
-                point('priority', {'count': -1}, changed_at, {'level': priority_previous}, True)
-            if priority != 'moderate':
-                point('priority', {'count': 1}, changed_at, {'level': priority}, True)
-                found.append(priority)
-
-        # Ensure a final removal entry is created when request is finalized.
-        priority = request.find('priority')
-        if priority is not None and priority.text != 'moderate':
-            if priority.text in found:
-                point('priority', {'count': -1}, final_at, {'level': priority.text}, True)
-            else:
-                print('unable to find priority history entry for {} to {}'.format(request.get('id'), priority.text))
+        if since and request_final_before(request, since):
+            # Reopened after being finalized and thus already ingested. The
+            # changes since are left to the next complete run as ingesting the
+            # request again would count it twice.
+            print('skipping request {} reopened after being ingested'.format(request.id))
+            continue
+
+        ingest_request(api, project, request)
 
     print('finalizing {:,} points'.format(len(points)))
-    return walk_points(points, project)
+    counters = counters_load(counters) if incremental else {}
+    wrote = walk_points(points, project, counters, epoch(since) if since else None)
+
+    # The state is also recorded by complete runs for incremental runs to follow.
+    if final_last:
+        ingest_requests_state_set(final_last, counters)
+    return wrote
+
+# History descriptions of the final states included by ingest_requests().
+REQUEST_FINAL_DESCRIPTIONS = (
+    'Request got accepted',
+    'Request got revoked',
+    'Request got superseded',
+)
+
+def request_final_before(request, since):
+    for history in request.history:
+        if history.when <= since and history.description in REQUEST_FINAL_DESCRIPTIONS:
+            return True
+    return False
+
+def ingest_request(api, project, request):
+    staging = '{}:Staging:'.format(project)
+    staging_adi = '{}:Staging:adi:'.format(project)
+
+    created_at = request.history[0].at
+    final_at = request.at
+    final_at_history = request.history[-1].at
+    if final_at_history > final_at:
+        # Workaround for invalid dates: openSUSE/open-build-service#3858.
+        final_at = final_at_history
+
+    # TODO Track requests in psuedo-ignore state.
+    point('total', {'backlog': 1, 'open': 1}, created_at, {'event': 'create'}, True)
+    point('total', {'backlog': -1, 'open': -1}, final_at, {'event': 'close'}, True)
+
+    reviews_staging = [review for review in request.reviews if staging in review.by_project]
+    reviews_factory_staging = [review for review in request.reviews if review.by_group == 'factory-staging']
+
+    request_tags = {}
+    request_fields = {
+        'total': float(final_at - created_at),
+        'staged_count': sum(len(review.history) for review in reviews_factory_staging),
+    }
+    # TODO Total time spent in backlog (ie factory-staging, but excluding when staged).
+
+    if len(reviews_staging):
+        by_project = reviews_staging[0].by_project
+        request_tags['type'] = 'adi' if api.is_adi_project(by_project) else 'letter'
+
+        # TODO Determine current whitelists state based on dashboard revisions.
+        if project.startswith('openSUSE:Factory'):
+            splitter_whitelist = 'B C D E F G H I J'.split()
+            if splitter_whitelist:
+                short = api.extract_staging_short(by_project)
+                request_tags['whitelisted'] = short in splitter_whitelist
+        else:
+            # All letter where whitelisted since no restriction.
+            request_tags['whitelisted'] = request_tags['type'] == 'letter'
+
+    ready_to_accept = [history.at for review in reviews_staging
+                       if staging_adi in review.by_project and review.state == 'accepted'
+                       for history in review.history if history.comment == 'ready to accept']
+    if len(ready_to_accept):
+        ready_to_accept = ready_to_accept[0]
+        request_fields['ready'] = float(final_at - ready_to_accept)
+
+        # TODO Points with indentical timestamps are merged so this can be placed in total
+        # measurement, but may make sense to keep this separate and make the others follow.
+        point('ready', {'count': 1}, ready_to_accept, delta=True)
+        point('ready', {'count': -1}, final_at, delta=True)
+
+    staged_first = [history.at for review in reviews_factory_staging for history in review.history]
+    if len(staged_first):
+        staged_first = staged_first[0]
+        request_fields['staged_first'] = float(staged_first - created_at)
+
+        # TODO Decide if better to break out all measurements by time most relevant to event,
+        # time request was created, or time request was finalized. It may also make sense to
+        # keep separate measurement by different times like this one.
+        point('request_staged_first', {'value': request_fields['staged_first']}, staged_first, request_tags)
+
+    point('request', request_fields, final_at, request_tags)
+
+    # Staging related reviews.
+    for number, review in enumerate(reviews_staging, start=1):
+        staged_at = review.at
+
+        project_type = 'adi' if api.is_adi_project(review.by_project) else 'letter'
+        short = api.extract_staging_short(review.by_project)
+        point('staging', {'count': 1}, staged_at,
+              {'id': short, 'type': project_type, 'event': 'select'}, True)
+        point('total', {'backlog': -1, 'staged': 1}, staged_at, {'event': 'select'}, True)
+
+        who = who_workaround(request, review)
+        review_tags = {'event': 'select', 'user': who, 'number': number}
+        review_tags.update(request_tags)
+        point('user', {'count': 1}, staged_at, review_tags)
+
+        if len(review.history):
+            unselected_at = review.history[0].at
+        else:
+            unselected_at = final_at
+
+        # If a request is declined and re-opened it must be repaired before being re-staged. At
+        # which point the only possible open review should be the final one.
+        point('staging', {'count': -1}, unselected_at,
+              {'id': short, 'type': project_type, 'event': 'unselect'}, True)
+        point('total', {'backlog': 1, 'staged': -1}, unselected_at, {'event': 'unselect'}, True)
+
+    # No-staging related reviews.
+    for review in request.reviews:
+        if staging in review.by_project:
+            continue
+
+        tags = {
+            # who_added is non-trivial due to openSUSE/open-build-service#3898.
+            'state': review.state,
+        }
+
+        opened_at = review.at
+        if len(review.history):
+            completed_at = review.history[0].at
+            tags['who_completed'] = review.history[0].who
+        else:
+            completed_at = final_at
+            # Does not seem to make sense to mirror user responsible for making final state
+            # change as the user who completed the review.
+
+        tags['key'] = []
+        tags['type'] = []
+        for name, value in review.by:
+            tags[name] = value
+            tags['key'].append(value)
+            tags['type'].append(name[3:])
+        tags['type'] = '_'.join(tags['type'])
+
+        point('review', {'open_for': float(completed_at - opened_at)}, completed_at, tags)
+        point('review_count', {'count':  1}, opened_at, tags, True)
+        point('review_count', {'count': -1}, completed_at, tags, True)
+
+    found = []
+    for set_priority in request.history:
+        if not set_priority.description or 'Request got a new priority:' not in set_priority.description:
+            continue
+
+        parts = set_priority.description.rsplit(' ', 3)
+        priority_previous = parts[1]
+        priority = parts[3]
+        if priority == priority_previous:
+            continue
+
+        changed_at = set_priority.at
+        if priority_previous != 'moderate':
+            point('priority', {'count': -1}, changed_at, {'level': priority_previous}, True)
+        if priority != 'moderate':
+            point('priority', {'count': 1}, changed_at, {'level': priority}, True)
+            found.append(priority)
+
+    # Ensure a final removal entry is created when request is finalized.
+    if request.priority is not None and request.priority != 'moderate':
+        if request.priority in found:
+            point('priority', {'count': -1}, final_at, {'level': request.priority}, True)
+        else:
+            print('unable to find priority history entry for {} to {}'.format(request.id, request.priority))
+
+def ingest_requests_state_get():
+    """Time of the last state change ingested and the counters at that time."""
+    result = client.query('SELECT * FROM ingest_requests_state ORDER BY time DESC LIMIT 1')
+    if not result:
+        return None, {}
+
+    point = next(result.get_points())
+    counters = {}
+    result = client.query("SELECT * FROM ingest_requests_counters WHERE time = '{}'".format(point['time']))
+    for counter in result.get_points():
+        counters[counter['counter']] = dict((key, value) for key, value in counter.items()
+                                            if key not in ('time', 'counter') and value is not None)
+
+    return point['when'], counters
+
+# The counters are written as a point per counter at the time of the state since
+# there are too many, one per review_count key, to fit in a single field.
+def ingest_requests_state_set(when, counters):
+    time = timestamp(datetime.utcnow())
+    state = [{
+        'measurement': 'ingest_requests_state',
+        'fields': {
+            'when': when,
+        },
+        'time': time,
+    }]
+    for key, counter in counters.items():
+        if not counter['values']:
+            continue
+
+        state.append({
+            'measurement': 'ingest_requests_counters',
+            'tags': {'counter': key},
+            'fields': counter['values'],
+            'time': time,
+        })
+
+    # Write the state last so it is only found once the counters are complete.
+    state.append(state.pop(0))
+    for i in range(0, len(state), 1000):
+        client.write_points(state[i:i + 1000], 's')
+
+    # Only the counters of the latest state are read.
+    client.query('DELETE FROM ingest_requests_counters WHERE time < {}s'.format(time))
+
+def counters_load(values):
+    return dict((key, {'last': None, 'values': values}) for key, values in values.items())
 
 def who_workaround(request, review, relax=False):
     # Super ugly workaround for incorrect and missing data:
@@ -243,39 +497,43 @@ def who_workaround(request, review, relax=False):
     # - openSUSE/open-build-service#3898
     global who_workaround_swap, who_workaround_miss
 
-    who = review.get('who') # All that should be required (used as fallback).
-    when = review.get('when')
+    who = review.who # All that should be required (used as fallback).
+    when = review.when
     if relax:
         # Super hack, chop off seconds to relax in hopes of finding potential.
         when = when[:-2]
 
-    who_real = request.xpath(
-        'history[contains(@when, "{}") and comment[contains(text(), "{}")]]/@who'.format(
-            when, review.get('by_project')))
-    if len(who_real):
-        who = who_real[0]
-        who_workaround_swap += 1
-    elif not relax:
+    for history in request.history:
+        if when in history.when and history.comment and review.by_project in history.comment:
+            who_workaround_swap += 1
+            return history.who
+
+    if not relax:
         return who_workaround(request, review, True)
-    else:
-        who_workaround_miss += 1
 
+    who_workaround_miss += 1
     return who
 
 # Walk data points in order by time, adding up deltas and merging points at
 # the same time. Data is converted to dict() and written to influx batches to
 # avoid extra memory usage required for all data in dict() and avoid influxdb
-# allocating memory for entire incoming data set at once.
-def walk_points(points, target):
+# allocating memory for entire incoming data set at once. Points are merged from
+# the sorted runs of PointRuns so memory use does not grow with their number.
+#
+# When continuing from the counters of a previous run, the measurements are
+# kept and deltas before since are only added to the counters as the points
+# written by the previous run cannot be changed without a complete run.
+def walk_points(points, target, counters=None, since=None):
     global client
 
+    if counters is None:
+        counters = {}
     measurements = set()
-    counters = {}
     final = []
     time_last = None
     wrote = 0
-    for point in sorted(points, key=lambda l: l.time):
-        if point.measurement not in measurements:
+    for point in points.sorted():
+        if since is None and point.measurement not in measurements:
             # Wait until just before writing to drop measurement.
             client.drop_measurement(point.measurement)
             measurements.add(point.measurement)
@@ -307,6 +565,9 @@ def walk_points(points, target):
         for key, value in point.fields.items():
             values[key] = values.setdefault(key, 0) + value
 
+        if since is not None and point.time < since:
+            continue
+
         if counters_tag['last'] and point.time == counters_tag['last']['time']:
             point = counters_tag['last']
         else:
@@ -358,16 +619,25 @@ def revision_index(api):
             date = date_parse(logentry.find('date').text)
             revision_index.index[date] = logentry.get('revision')
 
+        # Parallel lists ordered by date for bisecting in revision_at().
+        revision_index.made = sorted(revision_index.index)
+        revision_index.revisions = [revision_index.index[made] for made in revision_index.made]
+
     return revision_index.index
 
 def revision_at(api, datetime):
-    index = revision_index(api)
-    for made, revision in sorted(index.items(), reverse=True):
-        if made <= datetime:
-            return revision
+    revision_index(api)
+    position = bisect.bisect_right(revision_index.made, datetime)
+    if position:
+        return revision_index.revisions[position - 1]
 
     return None
 
+def revision_files(api, revision):
+    """Determine the md5 of each file in the dashboard package at revision."""
+    files = osc.core.meta_get_filelist(api.apiurl, api.cstaging, 'dashboard', verbose=True, revision=revision)
+    return dict((f.name, f.md5) for f in files)
+
 def dashboard_at(api, filename, datetime=None, revision=None):
     if datetime:
         revision = revision_at(api, datetime)
@@ -477,15 +747,30 @@ def ingest_dashboard(api):
 
     count = 0
     points = []
-    for made, revision in sorted(index.items()):
+    md5_previous = {}
+    for made, revision in zip(revision_index.made, revision_index.revisions):
         if not past:
             if revision == revision_last:
                 past = True
             continue
 
+        # Most revisions only change a single file so compare the md5 of each
+        # file against the previous revision and only load those that changed.
         time = timestamp(made)
+        md5s = revision_files(api, revision)
         for filename in filenames:
-            content = dashboard_at_changed(api, filename, revision)
+            filename_load = filename
+            if (filename == 'repo_checker' and filename not in md5s and
+                    api.project == 'openSUSE:Factory'):
+                # Special case to fallback to installcheck pre repo_checker file.
+                filename_load = 'installcheck'
+
+            md5 = md5s.get(filename_load)
+            if md5 is None or md5 == md5_previous.get(filename):
+                continue
+            md5_previous[filename] = md5
+
+            content = dashboard_at_changed(api, filename_load, revision)
             if content:
                 map_func = globals()['ingest_dashboard_{}'.format(filename)]
                 fields = map_func(content)
@@ -535,12 +820,15 @@ def main(args):
 
     # Use separate cache since it is persistent.
     Cache.CACHE_DIR = Cache.CACHE_DIR + '-metrics'
+    if args.cache_backend:
+        osc.conf.config['osrt-cache-backend'] = args.cache_backend
     if args.wipe_cache:
         Cache.delete_all()
     if args.heavy_cache:
         Cache.PATTERNS['/search/request'] = sys.maxint
         Cache.PATTERNS['/source/[^/]+/dashboard/_history'] = sys.maxint
     Cache.PATTERNS['/source/[^/]+/dashboard/[^/]+\?rev=.*'] = sys.maxint
+    Cache.PATTERNS['/source/[^/]+/dashboard\?rev=.*'] = sys.maxint
     Cache.init()
 
     Config(args.project)
@@ -551,7 +839,7 @@ def main(args):
     global who_workaround_swap, who_workaround_miss
     who_workaround_swap = who_workaround_miss = 0
 
-    points_requests = ingest_requests(api, args.project)
+    points_requests = ingest_requests(api, args.project, args.incremental)
     points_schedule = ingest_release_schedule(args.project)
 
     print('who_workaround_swap', who_workaround_swap)
@@ -572,9 +860,13 @@ if __name__ == '__main__':
     parser.add_argument('--user', default='root', help='InfluxDB user')
     parser.add_argument('--password', default='root', help='InfluxDB password')
     parser.add_argument('--wipe-cache', action='store_true', help='wipe GET request cache before executing')
+    parser.add_argument('--cache-backend', choices=sorted(Cache.BACKENDS),
+                        help='GET request cache storage (sqlite recommended for large caches)')
     parser.add_argument('--heavy-cache', action='store_true',
                         help='cache ephemeral queries indefinitely (useful for development)')
     parser.add_argument('--release-only', action='store_true', help='ingest release metrics only')
+    parser.add_argument('--incremental', action='store_true',
+                        help='ingest only requests changed since the previous run continuing its counters')
     args = parser.parse_args()
 
     sys.exit(main(args))
@@ -1,5 +1,4 @@
 from dateutil.parser import parse as date_parse
-from metrics import timestamp
 import requests
 from urlparse import urljoin
 import yaml
@@ -15,6 +14,9 @@ def data_write(client, measurement, points):
     client.write_points(points, 's')
 
 def ingest_data(client, name):
+    # Imported here since metrics imports this module.
+    from metrics import timestamp
+
     data = data_load(name)
 
     measurement = 'release_{}'.format(name)
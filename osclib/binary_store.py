@@ -0,0 +1,59 @@
+import fcntl
+import os
+
+from osclib.memoize import CACHEDIR
+
+# Binaries mirrored by bs_mirrorfull --store are hard linked into this
+# directory as <hdrmd5[:2]>/<hdrmd5>-<name>.rpm so that each binary is only
+# downloaded once regardless of how many repositories contain it.
+STORE_DIR = os.path.join(CACHEDIR, 'store')
+
+
+def binary_store_populated(store=STORE_DIR):
+    """Determine if the store contains any binaries."""
+    if not os.path.isdir(store):
+        return False
+
+    for prefix in os.listdir(store):
+        directory = os.path.join(store, prefix)
+        if os.path.isdir(directory) and len(os.listdir(directory)):
+            return True
+
+    return False
+
+
+def binary_store_gc(store=STORE_DIR):
+    """Remove binaries from the store that are no longer part of a mirror.
+
+    The link count of a stored binary is one plus the number of mirrored
+    repositories containing it, so a count of one means it is unreferenced.
+    Returns the number of binaries and bytes removed.
+
+    """
+    count = size = 0
+    if not os.path.isdir(store):
+        return count, size
+
+    # Hold the lock bs_mirrorfull takes while populating the store, otherwise
+    # a prefix directory may be removed between it being made and linked into.
+    with open(os.path.join(store, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        for prefix in os.listdir(store):
+            directory = os.path.join(store, prefix)
+            if not os.path.isdir(directory):
+                # Lock file held by bs_mirrorfull while populating the store.
+                continue
+
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                stat = os.lstat(path)
+                if stat.st_nlink == 1:
+                    os.unlink(path)
+                    count += 1
+                    size += stat.st_size
+
+            if not os.listdir(directory):
+                os.rmdir(directory)
+
+    return count, size
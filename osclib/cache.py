@@ -1,12 +1,20 @@
 from __future__ import print_function
 
+import atexit
+from collections import OrderedDict
 import datetime
+import errno
 import hashlib
+import json
 import os
 import osc.core
 import re
 import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import urllib2
 import urlparse
 import urllib
 from StringIO import StringIO
@@ -25,17 +33,29 @@ def http_request(method, url, headers={}, data=None, file=None):
     Wrapper for osc.core.http_request() to provide GET request caching.
     """
 
+    conditional = {}
     if method == 'GET':
         ret = Cache.get(url)
         if ret:
             return ret
+
+        # Revalidate an expired entry instead of fetching the whole body.
+        conditional = Cache.conditional_headers(url)
+        if conditional:
+            headers = dict(headers)
+            headers.update(conditional)
     else:
         # Logically, seems to make more sense after real call, but practically
         # it should not matter and makes the apitests happy when dealing with
         # request acceptance which causes a GET to determine target project.
         Cache.delete(url)
 
-    ret = osc.core._http_request(method, url, headers, data, file)
+    try:
+        ret = osc.core._http_request(method, url, headers, data, file)
+    except urllib2.HTTPError as e:
+        if conditional and e.code == 304:
+            return Cache.revalidated(urllib.unquote(url))
+        raise
 
     if method == 'GET':
         ret = Cache.put(url, ret)
@@ -43,6 +63,414 @@ def http_request(method, url, headers={}, data=None, file=None):
     return ret
 
 
+def http_GET_root(url, parse=ET.fromstring):
+    """
+    Perform a GET request and return the root element parsed using parse.
+
+    While the response is held by the in-memory tier the root is only parsed
+    once and shared between callers. As such it must not be modified.
+    """
+    data = osc.core.http_GET(url)
+    return Cache.memory.root(urllib.unquote(url), parse, data)
+
+
+class CacheBackendFile(object):
+    """
+    Store each cached response as a separate file.
+
+    Files are named by the SHA1 digest of the url and placed in a directory per
+    host and project which allows a project to be expired by removing the
+    directory.
+    """
+
+    name = 'file'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, url, project, include_file=False, makedirs=False):
+        parts = [self.directory]
+
+        o = urlparse.urlsplit(url)
+        parts.append(o.hostname)
+
+        if project:
+            parts.append(project)
+
+        directory = os.path.join(*parts)
+        if makedirs and not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                # Another thread or process may have created it meanwhile.
+                if e.errno != errno.EEXIST:
+                    raise
+
+        if include_file:
+            parts.append(hashlib.sha1(url).hexdigest())
+            return os.path.join(*parts)
+
+        return directory
+
+    def mtime(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+        return None
+
+    def project_mtime(self, url, project):
+        directory = self.path(url, project)
+        if os.path.exists(directory):
+            return os.path.getmtime(directory)
+        return None
+
+    def load(self, url, project):
+        return urlopen('file://' + self.path(url, project, include_file=True))
+
+    def validators(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path + '.validators'):
+            with open(path + '.validators', 'r') as f:
+                return json.load(f)
+        return {}
+
+    def save(self, url, project, pattern, text, validators={}):
+        path = self.path(url, project, include_file=True, makedirs=True)
+        # Replacing an entry through a rename changes the directory mtime used
+        # by project_mtime() as if it was a new entry, so restore it after.
+        directory_stat = os.stat(os.path.dirname(path)) if os.path.exists(path) else None
+        self.write(path, text)
+
+        # Validators are kept alongside the body only when the server provided
+        # any in order to avoid doubling the number of files.
+        if validators:
+            self.write(path + '.validators', json.dumps(validators))
+        elif os.path.exists(path + '.validators'):
+            try:
+                os.remove(path + '.validators')
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        if directory_stat:
+            os.utime(os.path.dirname(path), (directory_stat.st_atime, directory_stat.st_mtime))
+
+    def write(self, path, text):
+        # Write to a temporary file renamed into place so that concurrent
+        # writers and readers never see a partially written file.
+        fd, path_tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+            os.rename(path_tmp, path)
+        except:
+            os.remove(path_tmp)
+            raise
+
+    def touch(self, url, project):
+        os.utime(self.path(url, project, include_file=True), None)
+
+    def remove(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path):
+            os.remove(path)
+            if os.path.exists(path + '.validators'):
+                os.remove(path + '.validators')
+            return True
+        return False
+
+    def remove_project(self, apiurl, project):
+        path = self.path(apiurl, project)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class CacheBackendSQLite(object):
+    """
+    Store all cached responses in a single SQLite database.
+
+    Entries are keyed by the SHA1 digest of the url and indexed by host and
+    project so that expiring a project is a single indexed delete instead of
+    removing a directory of small files. The database is opened in WAL mode to
+    allow readers in other processes while one process is writing.
+    """
+
+    name = 'sqlite'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entry (
+            key TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            project TEXT NOT NULL,
+            pattern TEXT NOT NULL,
+            mtime REAL NOT NULL,
+            body BLOB NOT NULL,
+            validators TEXT
+        );
+        CREATE INDEX IF NOT EXISTS entry_project ON entry (host, project, mtime);
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filename = os.path.join(directory, 'cache.db')
+        # Connections are per thread since they cannot be shared between them.
+        self._local = threading.local()
+
+    def connection(self):
+        local = self._local
+
+        # A connection must not be used across fork() so forked processes,
+        # like worker pools, open their own while leaving the parent's alone.
+        if getattr(local, 'connection', None) and local.pid != os.getpid():
+            local.connection = None
+
+        # Open lazily to avoid creating the database for unused backends.
+        if not getattr(local, 'connection', None):
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            # Autocommit since every statement stands on its own.
+            connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self.SCHEMA)
+
+            # Databases created before validators were stored lack the column.
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(entry)')]
+            if 'validators' not in columns:
+                connection.execute('ALTER TABLE entry ADD COLUMN validators TEXT')
+
+            local.connection = connection
+            local.pid = os.getpid()
+
+        return local.connection
+
+    def key(self, url):
+        return hashlib.sha1(url).hexdigest()
+
+    def host_project(self, url, project):
+        return (urlparse.urlsplit(url).hostname or '', project or '')
+
+    def mtime(self, url, project):
+        row = self.connection().execute(
+            'SELECT mtime FROM entry WHERE key = ?', (self.key(url),)).fetchone()
+        return row[0] if row else None
+
+    def project_mtime(self, url, project):
+        # Closest equivalent to the directory mtime used by the file backend.
+        row = self.connection().execute(
+            'SELECT MAX(mtime) FROM entry WHERE host = ? AND project = ?',
+            self.host_project(url, project)).fetchone()
+        return row[0] if row else None
+
+    def load(self, url, project):
+        row = self.connection().execute(
+            'SELECT body FROM entry WHERE key = ?', (self.key(url),)).fetchone()
+        return StringIO(str(row[0]) if row else '')
+
+    def validators(self, url, project):
+        row = self.connection().execute(
+            'SELECT validators FROM entry WHERE key = ?', (self.key(url),)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def save(self, url, project, pattern, text, validators={}):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO entry (key, host, project, pattern, mtime, body, validators) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.key(url),) + self.host_project(url, project) +
+            (pattern, time(), sqlite3.Binary(text), json.dumps(validators) if validators else None))
+
+    def touch(self, url, project):
+        self.connection().execute(
+            'UPDATE entry SET mtime = ? WHERE key = ?', (time(), self.key(url)))
+
+    def remove(self, url, project):
+        cursor = self.connection().execute(
+            'DELETE FROM entry WHERE key = ?', (self.key(url),))
+        return cursor.rowcount > 0
+
+    def remove_project(self, apiurl, project):
+        cursor = self.connection().execute(
+            'DELETE FROM entry WHERE host = ? AND project = ?',
+            self.host_project(apiurl, project))
+        return cursor.rowcount > 0
+
+    def close(self):
+        local = self._local
+        if getattr(local, 'connection', None):
+            if local.pid == os.getpid():
+                local.connection.close()
+            local.connection = None
+
+
+class CacheMemory(object):
+    """
+    Bounded in-memory tier holding recently used response bodies.
+
+    Entries are evicted in least recently used order once the combined size of
+    the bodies exceeds size_max which avoids re-reading and re-opening the same
+    entries from the backend when a url is requested many times within a run.
+    The root parsed from a body may also be kept with an entry, see root(), and
+    is accounted for by the size of the body.
+    """
+
+    def __init__(self, size_max):
+        # OrderedDict is not safe to be modified by multiple threads.
+        self.lock = threading.RLock()
+        self.clear()
+        self.size_max = size_max
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size_max(self):
+        return self._size_max
+
+    @size_max.setter
+    def size_max(self, size_max):
+        with self.lock:
+            self._size_max = size_max
+            self.evict()
+
+    def get(self, url, ttl):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or time() - entry[1] > ttl:
+                if entry is not None:
+                    self.remove(url)
+                self.misses += 1
+                return None
+
+            # Reinsert to mark as most recently used.
+            self.entries[url] = self.entries.pop(url)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, url, project, mtime, text):
+        with self.lock:
+            self.remove(url)
+            if len(text) > self.size_max:
+                return
+
+            self.entries[url] = (project, mtime, text)
+            self.size += len(text)
+            self.evict()
+
+    def root(self, url, parse, data):
+        """
+        Return the root parsed from the entry for url using parse, otherwise
+        parse data. Roots are kept per parse function as long as the entry.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return parse(data.read())
+
+            roots = self.roots.setdefault(url, {})
+            if parse not in roots:
+                roots[parse] = parse(entry[2])
+                self.size += len(entry[2])
+                self.evict()
+            return roots[parse]
+
+    def evict(self):
+        with self.lock:
+            while self.size > self.size_max:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.size -= len(entry[2]) * (1 + len(self.roots.pop(url, {})))
+
+    def remove_project(self, apiurl, project):
+        with self.lock:
+            for url, entry in self.entries.items():
+                if entry[0] == project and url.startswith(apiurl):
+                    self.remove(url)
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.roots = {}
+            self.size = 0
+
+
+class CacheMatcher(object):
+    """
+    Match url paths against cache patterns dispatching on the first segment.
+
+    Patterns are grouped by their literal leading path segment (ex. /source or
+    /search) and each group is combined into a single regular expression. As
+    such a path is only evaluated against the patterns that can possibly match
+    and in one pass. Patterns without a literal leading segment are included in
+    every group. Within a group the patterns retain their relative order so the
+    first matching pattern wins just like evaluating them in sequence.
+    """
+
+    SEGMENT_REGEX = re.compile(r'^/([\w:-]+)(?:/|\$|\\\?|$)')
+
+    def __init__(self, patterns):
+        patterns = list(patterns)
+
+        segments = set()
+        for pattern in patterns:
+            segment = self.segment_pattern(pattern)
+            if segment is not None:
+                segments.add(segment)
+
+        self.combined = {}
+        for segment in segments:
+            self.combined[segment] = self.combine(
+                [p for p in patterns if self.segment_pattern(p) in (segment, None)])
+        self.fallback = self.combine([p for p in patterns if self.segment_pattern(p) is None])
+
+    def segment_pattern(self, pattern):
+        if '|' in pattern:
+            # Alternation may span segments so no single segment applies.
+            return None
+
+        match = self.SEGMENT_REGEX.match(pattern)
+        return match.group(1) if match else None
+
+    def combine(self, patterns):
+        if not len(patterns):
+            return None
+
+        # Wrap each pattern in a group and record the index of the wrapping
+        # group along with the pattern and whether it has a group of its own.
+        alternatives = []
+        lookup = {}
+        index = 1
+        for pattern in patterns:
+            alternatives.append('({})'.format(pattern))
+            groups = re.compile(pattern).groups
+            lookup[index] = (pattern, groups > 0)
+            index += 1 + groups
+
+        return (re.compile('|'.join(alternatives)), lookup)
+
+    def match(self, path):
+        segment = path[1:].split('/', 1)[0].split('?', 1)[0]
+        combined = self.combined.get(segment, self.fallback)
+        if combined is None:
+            return (False, None)
+
+        regex, lookup = combined
+        match = regex.match(path)
+        if not match:
+            return (False, None)
+
+        # The last group to close is the wrapping group of matched pattern.
+        pattern, grouped = lookup[match.lastindex]
+        return (pattern, match.group(match.lastindex + 1) if grouped else None)
+
+
 class Cache(object):
     """
     Provide a cache implementation for osc.core.http_request().
@@ -98,12 +526,46 @@ class Cache(object):
     }
 
     last_updated = {}
+    # Parsed timestamps from last_updated keyed by the original string.
+    last_updated_parsed = {}
+
+    # Storage backend which may also be set via osrt-cache-backend in the
+    # general section of oscrc. See CacheBackendFile and CacheBackendSQLite.
+    BACKEND = 'file'
+    BACKENDS = {
+        CacheBackendFile.name: CacheBackendFile,
+        CacheBackendSQLite.name: CacheBackendSQLite,
+    }
+    _backend = None
+
+    # Response headers stored with an entry and the request headers used to
+    # revalidate the entry once expired.
+    VALIDATORS = {
+        'ETag': 'If-None-Match',
+        'Last-Modified': 'If-Modified-Since',
+    }
+    revalidated_count = 0
+    revalidated_bytes = 0
+
+    # Package directory listings expose the srcmd5 of the sources which is kept
+    # as a validator of the listing and of the files of the package cached
+    # while the listing was current. An expired file is still valid while the
+    # current listing has the same srcmd5 so it is refreshed without a request.
+    SRCMD5_REGEX = re.compile(r'<directory [^>]*srcmd5="([0-9a-f]+)"')
+
+    # Total size of response bodies to keep in memory.
+    MEMORY_SIZE = 64 * 1024 * 1024
+    memory = CacheMemory(MEMORY_SIZE)
 
     @staticmethod
     def init():
-        Cache.patterns = []
-        for pattern in Cache.PATTERNS:
-            Cache.patterns.append(re.compile(pattern))
+        Cache.matcher = CacheMatcher(Cache.PATTERNS)
+
+        Cache.memory.size_max = Cache.MEMORY_SIZE
+
+        if not hasattr(Cache, '_atexit'):
+            Cache._atexit = True
+            atexit.register(Cache.print_stats)
 
         # Replace http_request with wrapper function which needs a stored
         # version of the original function to call.
@@ -116,7 +578,6 @@ class Cache(object):
         url = urllib.unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
             ttl = Cache.PATTERNS[match]
 
             if project:
@@ -133,16 +594,22 @@ class Cache(object):
                 else:
                     unchanged_since = Cache.last_updated[apiurl]['__oldest']
 
+                # Parsing is relatively expensive and the same few timestamps
+                # are evaluated for every request.
+                if unchanged_since not in Cache.last_updated_parsed:
+                    Cache.last_updated_parsed[unchanged_since] = datetime.datetime.strptime(
+                        unchanged_since, '%Y-%m-%dT%H:%M:%SZ')
+                unchanged_since = Cache.last_updated_parsed[unchanged_since]
+
                 now = datetime.datetime.utcnow()
-                unchanged_since = datetime.datetime.strptime(unchanged_since, '%Y-%m-%dT%H:%M:%SZ')
                 history_span = now - unchanged_since
 
                 # Treat non-existant cache as brand new for the sake of history
                 # span check since it behaves as desired.
                 age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
+                project_mtime = Cache.backend().project_mtime(url, project)
+                if project_mtime is not None:
+                    age = time() - project_mtime
 
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
@@ -156,11 +623,21 @@ class Cache(object):
                 if history_span < ttl_delta and age_delta > history_span:
                     Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+            text = Cache.memory.get(url, ttl)
+            if text is not None:
+                if conf.config['debug']: print('CACHE_GET_MEMORY', url, file=sys.stderr)
+                return StringIO(text)
+
+            mtime = Cache.backend().mtime(url, project)
+            if mtime is not None and time() - mtime <= ttl:
                 if conf.config['debug']: print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                text = Cache.backend().load(url, project).read()
+                Cache.memory.put(url, project, mtime, text)
+                return StringIO(text)
+            elif mtime is not None and Cache.srcmd5_valid(url, project):
+                return Cache.revalidated(url)
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                reason = '(' + ('expired' if mtime is not None else 'does not exist') + ')'
                 if conf.config['debug']: print('CACHE_MISS', url, reason, file=sys.stderr)
 
         return None
@@ -170,7 +647,6 @@ class Cache(object):
         url = urllib.unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
             ttl = Cache.PATTERNS[match]
             if ttl == 0:
                 return data
@@ -179,22 +655,149 @@ class Cache(object):
             # after writing to cache. As such a wrapper must be used. This could
             # be replaced with urlopen('file://...') to be consistent, but until
             # the need arrises StringIO has less overhead.
+            data_original = data
             text = data.read()
             data = StringIO(text)
 
+            validators = Cache.validators_extract(data_original)
+            srcmd5 = Cache.srcmd5(url, text)
+            if srcmd5:
+                validators['srcmd5'] = srcmd5
+
             if conf.config['debug']: print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path, 'w')
-            f.write(text)
-            f.close()
+            Cache.backend().save(url, project, match, text, validators)
+            Cache.memory.put(url, project, time(), text)
 
         return data
 
+    @staticmethod
+    def validators_extract(data):
+        validators = {}
+        if hasattr(data, 'info'):
+            info = data.info()
+            for header in Cache.VALIDATORS:
+                value = info.getheader(header)
+                if value:
+                    validators[header] = value
+
+        return validators
+
+    @staticmethod
+    def conditional_headers(url):
+        """
+        Determine headers for a conditional request to revalidate an expired
+        entry or an empty dict if the entry cannot be revalidated.
+        """
+        url = urllib.unquote(url)
+        match, project = Cache.match(url)
+        if not match or Cache.PATTERNS[match] == 0:
+            return {}
+
+        headers = {}
+        for header, value in Cache.backend().validators(url, project).items():
+            if header in Cache.VALIDATORS:
+                headers[Cache.VALIDATORS[header]] = value
+
+        return headers
+
+    @staticmethod
+    def srcmd5(url, text):
+        """
+        Determine the srcmd5 of a package directory listing from its text or
+        the srcmd5 of the current listing containing a package file.
+        """
+        if text.startswith('<directory '):
+            match = Cache.SRCMD5_REGEX.match(text[:1024])
+            if match:
+                return match.group(1)
+
+        listing = Cache.srcmd5_listing(url)
+        if listing:
+            return Cache.srcmd5_current(listing)
+
+        return None
+
+    @staticmethod
+    def srcmd5_listing(url):
+        """
+        Determine the url of the package listing with the same query as the url
+        of a package file or None if not a package file.
+        """
+        o = urlparse.urlsplit(url)
+        parts = o.path.split('/')
+        # Files prefixed by an underscore, like _meta, are not part of srcmd5.
+        if len(parts) != 5 or parts[1] != 'source' or parts[4].startswith('_'):
+            return None
+
+        path = '/'.join(parts[:4])
+        return urlparse.SplitResult(o.scheme, o.netloc, path, o.query, '').geturl()
+
+    @staticmethod
+    def srcmd5_current(url):
+        """
+        Determine the srcmd5 of the package listing at url if cached and not
+        expired, otherwise None.
+        """
+        match, project = Cache.match(url)
+        if not match:
+            return None
+
+        mtime = Cache.backend().mtime(url, project)
+        if mtime is None or time() - mtime > Cache.PATTERNS[match]:
+            return None
+
+        return Cache.backend().validators(url, project).get('srcmd5')
+
+    @staticmethod
+    def srcmd5_valid(url, project):
+        """
+        Determine if an expired package file is unchanged according to srcmd5.
+        """
+        srcmd5 = Cache.backend().validators(url, project).get('srcmd5')
+        if not srcmd5:
+            return False
+
+        listing = Cache.srcmd5_listing(url)
+        return listing is not None and Cache.srcmd5_current(listing) == srcmd5
+
+    @staticmethod
+    def revalidated(url):
+        """
+        Refresh an expired entry, given its unquoted url, after the server or
+        the srcmd5 validator indicated it is unchanged.
+        """
+        match, project = Cache.match(url)
+        Cache.backend().touch(url, project)
+        text = Cache.backend().load(url, project).read()
+        Cache.memory.put(url, project, time(), text)
+
+        Cache.revalidated_count += 1
+        Cache.revalidated_bytes += len(text)
+        if conf.config['debug']: print('CACHE_REVALIDATED', url, file=sys.stderr)
+
+        return StringIO(text)
+
+    @staticmethod
+    def print_stats():
+        if not conf.config.get('debug'):
+            return
+
+        if Cache.memory.hits or Cache.memory.misses:
+            print('CACHE_STATS memory {:,} hits, {:,} misses, {:,} entries ({:,} parsed) using {:,} bytes'.format(
+                Cache.memory.hits, Cache.memory.misses, len(Cache.memory.entries),
+                len(Cache.memory.roots), Cache.memory.size), file=sys.stderr)
+        if Cache.revalidated_count:
+            print('CACHE_STATS revalidated {:,} responses saving {:,} bytes'.format(
+                Cache.revalidated_count, Cache.revalidated_bytes), file=sys.stderr)
+
     @staticmethod
     def delete(url):
         url = urllib.unquote(url)
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
+            Cache.memory.remove(url)
+            if Cache.backend().remove(url, project):
+                if conf.config['debug']: print('CACHE_DELETE', url, file=sys.stderr)
 
             # Rather then wait for last updated statistics to expire, remove the
             # project cache if applicable.
@@ -205,10 +808,6 @@ class Cache(object):
                     project = osc.core.get_request(apiurl, project).actions[0].tgt_project
                 Cache.delete_project(apiurl, project)
 
-            if os.path.exists(path):
-                if conf.config['debug']: print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
-
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
         o = urlparse.urlsplit(url)
@@ -218,26 +817,49 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        Cache.memory.remove_project(apiurl, project)
+        if Cache.backend().remove_project(apiurl, project):
             if conf.config['debug']: print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            shutil.rmtree(path)
 
     @staticmethod
     def delete_all():
+        Cache.memory.clear()
+
+        # All backends keep their data within CACHE_DIR so simply drop any open
+        # backend and remove the directory.
+        if Cache._backend:
+            Cache._backend.close()
+            Cache._backend = None
+
         if os.path.exists(Cache.CACHE_DIR):
             shutil.rmtree(Cache.CACHE_DIR)
 
+    @staticmethod
+    def backend():
+        """
+        Return the storage backend for the current CACHE_DIR and BACKEND.
+
+        The backend is created lazily since both values are commonly changed by
+        scripts after import, but before the first request is made.
+        """
+        name = conf.config.get('osrt-cache-backend', Cache.BACKEND)
+        if (not Cache._backend or Cache._backend.name != name or
+            Cache._backend.directory != Cache.CACHE_DIR):
+            if name not in Cache.BACKENDS:
+                raise Exception('unknown cache backend {}, must be one of: {}'.format(
+                    name, ', '.join(sorted(Cache.BACKENDS))))
+
+            if Cache._backend:
+                Cache._backend.close()
+            Cache._backend = Cache.BACKENDS[name](Cache.CACHE_DIR)
+            Cache.memory.clear()
+
+        return Cache._backend
+
     @staticmethod
     def match(url):
         apiurl, path = Cache.spliturl(url)
-        for pattern in Cache.patterns:
-            match = pattern.match(path)
-            if match:
-                return (pattern.pattern,
-                        match.group(1) if len(match.groups()) > 0 else None)
-        return (False, None)
+        return Cache.matcher.match(path)
 
     @staticmethod
     def spliturl(url):
@@ -246,26 +868,6 @@ class Cache(object):
         path = urlparse.SplitResult('', '', o.path, o.query, '').geturl()
         return (apiurl, path)
 
-    @staticmethod
-    def path(url, project, include_file=False, makedirs=False):
-        parts = [Cache.CACHE_DIR]
-
-        o = urlparse.urlsplit(url)
-        parts.append(o.hostname)
-
-        if project:
-            parts.append(project)
-
-        directory = os.path.join(*parts)
-        if not os.path.exists(directory) and makedirs:
-            os.makedirs(directory)
-
-        if include_file:
-            parts.append(hashlib.sha1(url).hexdigest())
-            return os.path.join(*parts)
-
-        return directory
-
     @staticmethod
     def last_updated_load(apiurl):
         if apiurl in Cache.last_updated:
@@ -19,6 +19,7 @@ from osc.core import owner
 from osc.core import Request
 from osc.core import show_package_meta
 from osc.core import show_project_meta
+from osclib.cache import http_GET_root
 from osclib.memoize import memoize
 
 BINARY_REGEX = r'(?:.*::)?(?P<filename>(?P<name>.*)-(?P<version>[^-]+)-(?P<release>[^-]+)\.(?P<arch>[^-\.]+))'
@@ -28,7 +29,7 @@ BinaryParsed = namedtuple('BinaryParsed', ('package', 'filename', 'name', 'arch'
 @memoize(session=True)
 def group_members(apiurl, group, maintainers=False):
     url = makeurl(apiurl, ['group', group])
-    root = ETL.parse(http_GET(url)).getroot()
+    root = http_GET_root(url, ETL.fromstring)
 
     if maintainers:
         return root.xpath('maintainer/@userid')
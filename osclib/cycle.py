@@ -14,13 +14,23 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from array import array
+import cPickle
+import hashlib
+import os
 import urllib2
 from xml.etree import cElementTree as ET
 
 from osc.core import http_GET
 from osc.core import makeurl
+from osc.core import show_results_meta
 
-from .memoize import memoize
+from .memoize import CACHEDIR
+
+# The graph and cycles of a base project are stored in this directory keyed
+# by project, repository and architecture along with the build state and the
+# digest of the _builddepinfo they were generated from.
+GRAPH_CACHEDIR = os.path.join(CACHEDIR, 'builddepinfo')
 
 
 class Graph(dict):
@@ -31,6 +41,10 @@ class Graph(dict):
         #  The nodes are stored in the Graph dict itself, but the
         #  adjacent list is stored as an attribute.
         self.adj = {}
+        # Given a subpackage, the source package providing it and, given a
+        # source package, the subpackages it depends on.
+        self.subpkgs = {}
+        self.deps = {}
 
     def add_node(self, name, value):
         """Add a node in the graph."""
@@ -79,44 +93,139 @@ class Graph(dict):
         """Get the all the vertex that point to v."""
         return sorted(u for u in self.adj if v in self.adj[u])
 
-    def cycles(self):
-        """Detect cycles using Tarjan algorithm."""
-        index = [0]
-        path = []
-        cycles = []
-
-        v_index = {}
-        v_lowlink = {}
-
-        def scc(node, v):
-            v_index[v], v_lowlink[v] = index[0], index[0]
-            index[0] += 1
-            path.append(node)
-
-            for succ in self.adj.get(node, []):
-                w = self[succ]
-                if w not in v_index:
-                    scc(succ, w)
-                    v_lowlink[v] = min(v_lowlink[v], v_lowlink[w])
-                elif succ in path:
-                    v_lowlink[v] = min(v_lowlink[v], v_index[w])
-
-            if v_index[v] == v_lowlink[v]:
-                i = path.index(node)
-                path[:], cycle = path[:i], frozenset(path[i:])
-                if len(cycle) > 1:
-                    cycles.append(cycle)
-
-        for node in sorted(self):
-            v = self[node]
-            if not getattr(v, 'index', 0):
-                scc(node, v)
-        return frozenset(cycles)
+    def csr(self):
+        """Compressed sparse row representation of the adjacency list.
+
+        Returns the sorted list of nodes and the offsets and targets arrays
+        in which the successors of node i are targets[offsets[i]:offsets[i + 1]].
+
+        """
+        nodes = sorted(self)
+        index = dict((node, i) for i, node in enumerate(nodes))
+        offsets = array('i', [0])
+        targets = array('i')
+        for node in nodes:
+            targets.extend(sorted(index[v] for v in self.adj[node]))
+            offsets.append(len(targets))
+        return nodes, offsets, targets
+
+    def cycles(self, nodes=None):
+        """Detect cycles using Tarjan algorithm.
+
+        If nodes is given, only the cycles reachable from them are detected.
+
+        """
+        names, offsets, targets = self.csr()
+        if nodes is None:
+            starts = range(len(names))
+        else:
+            index = dict((node, i) for i, node in enumerate(names))
+            starts = sorted(index[node] for node in nodes)
+
+        return frozenset(frozenset(names[v] for v in component)
+                         for component in strongly_connected_components(offsets, targets, starts)
+                         if len(component) > 1)
+
+    def dump(self):
+        """Compact representation of the graph as lists of indices.
+
+        Nodes are replaced by their index in the sorted list of nodes and
+        subpackages by their index in the sorted list of names.
+
+        """
+        nodes = sorted(self)
+        index = dict((node, i) for i, node in enumerate(nodes))
+        adj = [tuple(sorted(index[v] for v in self.adj[node])) for node in nodes]
+
+        names = sorted(set(self.subpkgs).union(*self.deps.values()))
+        name_index = dict((name, i) for i, name in enumerate(names))
+        subpkgs = [(name_index[subpkg], index[node]) for subpkg, node in self.subpkgs.items()]
+        deps = [tuple(sorted(name_index[d] for d in self.deps.get(node, ()))) for node in nodes]
+        return nodes, adj, names, subpkgs, deps
+
+    @classmethod
+    def load(cls, nodes, adj, names, subpkgs, deps):
+        """Create a graph from the representation returned by dump()."""
+        graph = cls()
+        graph.add_nodes_from((node, Package(pkg=node)) for node in nodes)
+        for node, edges in zip(nodes, adj):
+            graph.adj[node].update(nodes[v] for v in edges)
+        graph.subpkgs = dict((names[subpkg], nodes[node]) for subpkg, node in subpkgs)
+        graph.deps = dict((node, set(names[d] for d in node_deps))
+                          for node, node_deps in zip(nodes, deps))
+        return graph
+
+
+def strongly_connected_components(offsets, targets, starts):
+    """Iterative Tarjan algorithm over a graph in CSR form (see Graph.csr()).
+
+    Yields the strongly connected components reachable from the starts
+    nodes as lists of node indices.
+
+    """
+    size = len(offsets) - 1
+    index = array('i', [-1]) * size
+    lowlink = array('i', [0]) * size
+    # Position of the next successor to visit for each node.
+    position = array('i', offsets)
+    on_stack = bytearray(size)
+    stack = []
+    counter = 0
+
+    for start in starts:
+        if index[start] != -1:
+            continue
+
+        index[start] = lowlink[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack[start] = 1
+        path = [start]
+
+        while path:
+            v = path[-1]
+            i = position[v]
+            end = offsets[v + 1]
+            while i < end:
+                w = targets[i]
+                i += 1
+                if index[w] == -1:
+                    break
+                elif on_stack[w] and index[w] < lowlink[v]:
+                    lowlink[v] = index[w]
+            else:
+                w = None
+            position[v] = i
+
+            if w is not None:
+                # Descend into the unvisited successor.
+                index[w] = lowlink[w] = counter
+                counter += 1
+                stack.append(w)
+                on_stack[w] = 1
+                path.append(w)
+                continue
+
+            path.pop()
+            if path and lowlink[v] < lowlink[path[-1]]:
+                lowlink[path[-1]] = lowlink[v]
+
+            if lowlink[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = 0
+                    component.append(w)
+                    if w == v:
+                        break
+                yield component
 
 
 class Package(object):
     """Simple package container. Used in a graph as a vertex."""
 
+    __slots__ = ('pkg', 'src', 'deps', 'subs')
+
     def __init__(self, pkg=None, src=None, deps=None, subs=None,
                  element=None):
         self.pkg = pkg
@@ -145,6 +254,9 @@ class Package(object):
 class CycleDetector(object):
     """Class to detect cycles in an OBS project."""
 
+    # Base project graphs and cycles by (project, repository, arch).
+    _project_graphs = {}
+
     def __init__(self, api):
         self.api = api
         # Store packages prevoiusly ignored. Don't pollute the screen.
@@ -160,7 +272,7 @@ class CycleDetector(object):
             print('ERROR in URL %s [%s]' % (url, e))
         return root
 
-    def _get_builddepinfo_graph(self, project, repository, arch):
+    def _get_builddepinfo_graph(self, project, repository, arch, builddepinfo=None):
         """Generate the buildepinfo graph for a given architecture."""
 
         # Note, by default generate the graph for all Factory /
@@ -168,10 +280,11 @@ class CycleDetector(object):
         #   project = 'Base:System'
         #   repository = 'openSUSE_Factory'
 
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
+        if builddepinfo is None:
+            builddepinfo = self._builddepinfo(project, repository, arch)
         # Reset the subpackages dict here, so for every graph is a
         # different object.
-        packages = [Package(element=e) for e in root.findall('package')]
+        packages = self._builddepinfo_packages(builddepinfo)
 
         graph = Graph()
         graph.add_nodes_from((p.pkg, p) for p in packages)
@@ -200,17 +313,162 @@ class CycleDetector(object):
 
         # Store the subpkgs dict in the graph. It will be used later.
         graph.subpkgs = subpkgs
+        graph.deps = dict((p.pkg, p.deps) for p in packages)
         return graph
 
-    def cycles(self, staging, project=None, repository='standard', arch='x86_64'):
-        """Detect cycles in a specific repository."""
+    def _builddepinfo_packages(self, builddepinfo):
+        root = ET.fromstring(builddepinfo)
+        return [Package(element=e) for e in root.findall('package')]
+
+    def _overlay_graph(self, project_graph, packages):
+        """Overlay packages onto the project graph.
+
+        Only the edges of the packages whose dependencies or subpackages
+        differ from the project, and of project packages depending on
+        subpackages that are now provided by another package, are calculated.
+        The adjacency of the remaining packages is shared with the project
+        graph. Returns the graph and the set of packages with new edges.
+
+        """
+        subs = {}
+        for subpkg, pkg in project_graph.subpkgs.items():
+            subs.setdefault(pkg, set()).add(subpkg)
+        packages = [p for p in packages
+                    if set(p.deps) != set(project_graph.deps.get(p.pkg, ())) or
+                    set(p.subs) != subs.get(p.pkg, set())]
+        changed = set(p.pkg for p in packages)
+
+        subpkgs = dict((subpkg, pkg) for subpkg, pkg in project_graph.subpkgs.items()
+                       if pkg not in changed)
+        for p in packages:
+            for subpkg in p.subs:
+                subpkgs.setdefault(subpkg, p.pkg)
+
+        # Subpackages provided by another package, or no longer provided.
+        candidates = set(subpkg for subpkg, pkg in project_graph.subpkgs.items() if pkg in changed)
+        candidates.update(subpkg for p in packages for subpkg in p.subs)
+        moved = set(subpkg for subpkg in candidates
+                    if project_graph.subpkgs.get(subpkg) != subpkgs.get(subpkg))
+
+        affected = set(changed)
+        if moved:
+            affected.update(pkg for pkg, deps in project_graph.deps.items()
+                            if not moved.isdisjoint(deps))
+
+        graph = Graph()
+        graph.update(project_graph)
+        graph.adj = dict(project_graph.adj)
+        graph.deps = dict(project_graph.deps)
+        graph.subpkgs = subpkgs
+        for p in packages:
+            graph[p.pkg] = p
+            graph.deps[p.pkg] = p.deps
+
+        for pkg in affected:
+            graph.adj[pkg] = set()
+            deps = graph.deps[pkg]
+            if any(d not in subpkgs for d in deps):
+                self._ignore_packages.add(pkg)
+                continue
+
+            graph.adj[pkg].update(subpkgs[d] for d in deps)
+
+        return graph, affected
+
+    def _build_state(self, project, repository, arch):
+        """State of the build results, which changes whenever they do."""
+        return ET.fromstringlist(show_results_meta(
+            self.api.apiurl, project, multibuild=True, repository=[repository], arch=[arch])).get('state')
+
+    def _get_project_graph(self, project, repository, arch):
+        """Graph and cycles of a base project reused while its state is unchanged.
+
+        The state is the build state of the repository, so the _builddepinfo
+        is only fetched once the project was built again. Its digest is kept
+        as well, so the graph is only parsed and the cycles only computed
+        again if the dependencies changed. Both are kept for the lifetime of
+        the process, to be shared between detectors, and persisted in
+        GRAPH_CACHEDIR for later runs.
+
+        """
+        key = (project, repository, arch)
+        build_state = self._build_state(*key)
+
+        cached = self._project_graphs.get(key)
+        if cached and build_state and cached[0] == build_state:
+            return cached[1:]
+
+        filename = os.path.join(GRAPH_CACHEDIR, '{}_{}_{}.pickle'.format(*key))
+        try:
+            with open(filename, 'rb') as f:
+                cached_build_state, cached_state, compact, cycles = cPickle.load(f)
+        except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+            cached_build_state = cached_state = None
+
+        if build_state and cached_build_state == build_state:
+            state = cached_state
+        else:
+            builddepinfo = self._builddepinfo(project, repository, arch)
+            state = hashlib.sha1(builddepinfo).hexdigest()
+
+        if cached_state == state:
+            graph = Graph.load(*compact)
+            nodes = compact[0]
+            compact_cycles = cycles
+            cycles = frozenset(frozenset(nodes[i] for i in cycle) for cycle in cycles)
+        else:
+            graph = self._get_builddepinfo_graph(project, repository, arch, builddepinfo)
+            cycles = graph.cycles()
+
+            compact = graph.dump()
+            nodes = compact[0]
+            index = dict((node, i) for i, node in enumerate(nodes))
+            compact_cycles = [tuple(sorted(index[node] for node in cycle)) for cycle in cycles]
+
+        if cached_build_state != build_state or cached_state != state:
+            if not os.path.exists(GRAPH_CACHEDIR):
+                os.makedirs(GRAPH_CACHEDIR)
+            # Write to a temporary file and rename so that concurrent runs
+            # never read a partial pickle.
+            filename_tmp = '{}.{}'.format(filename, os.getpid())
+            with open(filename_tmp, 'wb') as f:
+                cPickle.dump((build_state, state, compact, compact_cycles), f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(filename_tmp, filename)
+
+        self._project_graphs[key] = (build_state, graph, cycles)
+        return graph, cycles
+
+    def cycles(self, staging, project=None, repository='standard', arch='x86_64',
+               incremental=False):
+        """Detect cycles in a specific repository.
+
+        In incremental mode the staging packages are overlaid onto the
+        project graph and only the cycles reachable from the packages whose
+        edges changed are detected, instead of those of the staging alone.
+        Both agree on cycles between staging packages, but only incremental
+        mode also finds cycles through project packages not in the staging.
+
+        """
 
         if not project:
             project = self.api.project
 
-        # Detect cycles - We create the full graph from _builddepinfo.
-        project_graph = self._get_builddepinfo_graph(project, repository, arch)
-        current_graph = self._get_builddepinfo_graph(staging, repository, arch)
+        # Detect cycles - We create the full graph from _builddepinfo. The
+        # project graph and cycles are shared by all stagings.
+        project_graph, project_cycles = self._get_project_graph(project, repository, arch)
+        if incremental:
+            packages = self._builddepinfo_packages(self._builddepinfo(staging, repository, arch))
+            current_graph, affected = self._overlay_graph(project_graph, packages)
+            # Project cycles broken up by the changes may leave smaller
+            # cycles that are not reachable from the affected packages.
+            nodes = set(affected)
+            for cycle in project_cycles:
+                if not cycle.isdisjoint(affected):
+                    nodes.update(cycle)
+            current_cycles = current_graph.cycles(nodes)
+        else:
+            current_graph = self._get_builddepinfo_graph(staging, repository, arch)
+            current_cycles = current_graph.cycles()
 
         # Sometimes, new cycles have only new edges, but not new
         # packages.  We need to inform about this, so this can become
@@ -220,9 +478,8 @@ class CycleDetector(object):
         # project (i.e Factory) cycles as a set of packages, so we can
         # check if the new cycle (also as a set of packages) is
         # included here.
-        project_cycles = project_graph.cycles()
         project_cycles_pkgs = [set(cycle) for cycle in project_cycles]
-        for cycle in current_graph.cycles():
+        for cycle in current_cycles:
             if cycle not in project_cycles:
                 project_edges = set((u, v) for u in cycle for v in project_graph.edges(u) if v in cycle)
                 current_edges = set((u, v) for u in cycle for v in current_graph.edges(u) if v in cycle)
@@ -0,0 +1,307 @@
+from collections import namedtuple
+import os
+import stat
+
+import solv
+
+from osclib.solv_fragment import solv_build_directory
+from osclib.solv_fragment import solv_fragment_files
+
+InstallSection = namedtuple('InstallSection', ('binaries', 'text'))
+
+# File flags and types as formatted by findfileconflicts.
+RPMFILE_GHOST = 0o100
+FILE_FLAGS = ((0o2, 'd'), (0o1, 'c'), (0o10, 'm'), (0o20, 'n'), (0o100, 'g'), (0o200, 'l'), (0o400, 'r'))
+FILE_TYPES = {
+    stat.S_IFIFO: 'p',
+    stat.S_IFCHR: 'c',
+    stat.S_IFDIR: 'd',
+    stat.S_IFBLK: 'b',
+    stat.S_IFREG: '-',
+    stat.S_IFLNK: 'l',
+    stat.S_IFSOCK: 's',
+}
+# Details of a path for binaries only containing files below it.
+FILE_IMPLICIT_DIRECTORY = (stat.S_IFDIR | 0o755, 0, 'root:root', '', '')
+
+
+class InstallCheckPool(object):
+    """Pool containing the binaries of a project to be kept across checks.
+
+    The binaries to be checked are layered on top of the project binaries and
+    kept, but only considered during the checks of their directories. The
+    project binaries are thereby only loaded once and the provides are only
+    rebuilt when directories are added.
+
+    """
+
+    def __init__(self, arch, directory_project=None):
+        self.pool = solv.Pool()
+        self.pool.setarch(arch)
+        self.repo = pool_add_directory(self.pool, directory_project) if directory_project else None
+        self.repos = {}
+        self.provides = False
+
+    def add(self, directories):
+        """Layer the binaries in directories unless already loaded.
+
+        Adding all directories to be checked up front avoids rebuilding the
+        provides during the checks.
+
+        """
+        for directory in directories:
+            # Reload directories changed by mirroring.
+            mtime = os.path.getmtime(directory)
+            loaded = self.repos.get(directory)
+            if loaded and loaded[0] == mtime:
+                continue
+            if loaded:
+                loaded[1].free(True)
+
+            self.repos[directory] = (mtime, pool_add_directory(self.pool, directory))
+            self.provides = False
+
+        if not self.provides:
+            self.pool.addfileprovides()
+            self.pool.createwhatprovides()
+            self.provides = True
+
+    def check(self, directories, ignore=[], whitelist=[]):
+        """Check that the binaries in directories are installable and free of
+        file conflicts.
+
+        Project binaries named in ignore are left out in favor of those in
+        directories and binaries named in whitelist are not checked. Returns a
+        list of InstallSection formatted like the output of the installcheck
+        and findfileconflicts tools.
+
+        """
+        self.add(directories)
+
+        pool = self.pool
+        considered = []
+        if self.repo:
+            considered.extend(s for s in self.repo.solvables_iter() if s.name not in ignore)
+
+        targets = []
+        for directory in directories:
+            for s in self.repos[directory][1].solvables_iter():
+                considered.append(s)
+                if s.name not in whitelist:
+                    targets.append(s)
+
+        jobs = []
+        if hasattr(pool, 'set_considered_list'):
+            pool.set_considered_list([s.id for s in considered])
+        else:
+            # Prevent ignored and other layered binaries from being installed instead.
+            considered_ids = set(s.id for s in considered)
+            for s in pool.solvables_iter():
+                if s.id not in considered_ids:
+                    jobs.append(pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, s.id))
+
+        sections = list(uninstallable(pool, targets, jobs))
+        sections.extend(file_conflicts(pool, considered, targets))
+        return sections
+
+
+def install_check(arch, directories, directory_project=None, ignore=[], whitelist=[]):
+    """Check binaries in directories using directory_project as a base.
+
+    See InstallCheckPool.check() for details.
+
+    """
+    return InstallCheckPool(arch, directory_project).check(directories, ignore, whitelist)
+
+
+def pool_add_directory(pool, directory):
+    # Rebuild an unreadable solv file once.
+    for rebuild in (False, True):
+        repo = pool.add_repo(directory)
+        if repo.add_solv(solv_build_directory(directory, rebuild)):
+            return repo
+        repo.free(True)
+
+    raise Exception('failed to add repo {}'.format(directory))
+
+
+def uninstallable(pool, targets, jobs=[]):
+    """Generate a section for each target that cannot be installed.
+
+    Like installcheck all targets are first checked in one pass. They are
+    installed together as weak jobs, which the solver drops instead of
+    failing, and each target installed is installable. The pass is repeated
+    for the rest until no more are installed, which leaves those conflicting
+    with each other or uninstallable to be solved one at a time.
+
+    """
+    solver = pool.Solver()
+    solver.set_flag(solv.Solver.SOLVER_FLAG_IGNORE_RECOMMENDED, 1)
+
+    remaining = list(targets)
+    while len(remaining):
+        solver.solve(jobs + [pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_INSTALL | solv.Job.SOLVER_WEAK, s.id)
+                             for s in remaining])
+        installed = set(s.id for s in solver.transaction().newsolvables())
+        remaining_next = [s for s in remaining if s.id not in installed]
+        if len(remaining_next) == len(remaining):
+            break
+        remaining = remaining_next
+
+    for s in remaining:
+        problems = solver.solve(jobs + [pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_INSTALL, s.id)])
+        if not problems:
+            continue
+
+        text = ["can't install {}:\n".format(s)]
+        for problem in problems:
+            text.append('  {}\n'.format(problem.findproblemrule().info().problemstr()))
+        yield InstallSection([str(s)], ''.join(text))
+
+
+def file_conflicts(pool, solvables, targets, files=None):
+    """Generate a section for each pair of binaries, of which at least one is
+    a target, that contain the same file without conflicting otherwise.
+
+    The rules of findfileconflicts are applied to the file details returned
+    by files(solvable), see solv_fragment_files(). Both binaries having the
+    path as directory, ghost or symlink of identical mode is not a conflict,
+    nor is, as rpm allows, an identical file. Binaries containing files below
+    a path have it as an implicit directory.
+
+    """
+    files = files or solvable_files
+    owners = {}
+    for s in targets:
+        paths = list(filelist(s))
+        owners.update((path, []) for path in paths)
+        owners.update((path, []) for path in directories_walk(paths))
+
+    below = {}
+    for s in solvables:
+        paths = []
+        for path in filelist(s):
+            if path in owners:
+                owners[path].append(s)
+            paths.append(path)
+        for directory in directories_walk(paths):
+            if directory in owners:
+                below.setdefault(directory, []).append(s)
+
+    details = {}
+
+    def file_details(s, path):
+        if s.id not in details:
+            details[s.id] = files(s)
+        return details[s.id][path]
+
+    target_ids = set(s.id for s in targets)
+    conflicts = {}
+    for path, binaries in owners.items():
+        owner_ids = set(s.id for s in binaries)
+        implicit = [s for s in below.get(path, []) if s.id not in owner_ids]
+        implicit_targets = [s for s in implicit if s.id in target_ids]
+
+        pairs = [(a, b) for i, a in enumerate(binaries) for b in binaries[i + 1:]]
+        for a in binaries:
+            # An implicit directory only conflicts with anything but a directory.
+            others = implicit if a.id in target_ids else implicit_targets
+            if len(others) and not stat.S_ISDIR(file_details(a, path)[0]):
+                pairs.extend((a, b) for b in others)
+
+        for a, b in pairs:
+            if (a.id not in target_ids and b.id not in target_ids) or a.name == b.name:
+                continue
+            info = file_conflict(file_details(a, path),
+                                 file_details(b, path) if b.id in owner_ids else FILE_IMPLICIT_DIRECTORY)
+            if info is None or conflicting(pool, a, b):
+                continue
+            conflicts.setdefault(tuple(sorted((a, b), key=str)), []).append(path + info)
+
+    for (a, b), paths in sorted(conflicts.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+        text = ['found conflict of {} with {}:\n'.format(a, b)]
+        text.extend('  - {}\n'.format(path) for path in sorted(paths))
+        yield InstallSection([str(a), str(b)], ''.join(text))
+
+
+def directories_walk(paths):
+    """Determine all directories containing paths."""
+    directories = set()
+    for directory in set(os.path.dirname(path) for path in paths):
+        # Walk up until reaching a directory already seen.
+        while directory not in directories:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+    return directories
+
+
+def file_conflict(x, y):
+    """Determine if the details of a path in two binaries are in conflict.
+
+    Returns None if not, otherwise the note to add to the path.
+
+    """
+    mode_x, mode_y = file_mode(x), file_mode(y)
+    if mode_x == mode_y:
+        mode, flags = mode_x[:2]
+        if stat.S_ISDIR(mode) or stat.S_ISLNK(mode) or flags & RPMFILE_GHOST:
+            return None
+        # Compare digests of otherwise identical files.
+        return None if x[4] == y[4] else ''
+
+    # Mismatching modes are only noted if not both files or symlinks.
+    for mode, flags in (mode_x[:2], mode_y[:2]):
+        if not (stat.S_ISREG(mode) or stat.S_ISLNK(mode)) or flags & RPMFILE_GHOST:
+            return ' [mode mismatch: {}, {}]'.format(mode_format(mode_x), mode_format(mode_y))
+    return ''
+
+
+def file_mode(details):
+    """Mode, flags, owner and link target of file details ignoring the link
+    target and permissions of ghosts like findfileconflicts."""
+    mode, flags, owner, target = details[:4]
+    if flags & RPMFILE_GHOST:
+        target = ''
+        if mode == stat.S_IFREG:
+            mode |= 0o644
+    return mode, flags, owner, target
+
+
+def mode_format(mode):
+    """Format result of file_mode() like findfileconflicts."""
+    mode, flags, owner, target = mode
+    names = ''.join(name for flag, name in FILE_FLAGS if flags & flag)
+    if flags & ~0o733:
+        names += '{:o}'.format(flags & ~0o733)
+    return '{}{}{}{:03o} {}{}'.format(
+        names, ' ' if names else '', FILE_TYPES.get(stat.S_IFMT(mode), '?'),
+        mode & 0o7777, owner, ' -> ' + target if target else '')
+
+
+def solvable_files(s):
+    """File details of a solvable loaded from the directory named by its repo."""
+    rpm_file = os.path.basename(s.lookup_location()[0])
+    return solv_fragment_files(os.path.join(s.repo.name, rpm_file))
+
+
+def filelist(s):
+    for match in s.Dataiterator(solv.SOLVABLE_FILELIST, None,
+                                solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST):
+        yield match.str
+
+
+def conflicting(pool, a, b):
+    """Determine if either binary conflicts with or obsoletes the other."""
+    for x, y in ((a, b), (b, a)):
+        for dep in x.lookup_deparray(solv.SOLVABLE_CONFLICTS):
+            if y.id in [p.id for p in pool.whatprovides(dep)]:
+                return True
+        for dep in x.lookup_deparray(solv.SOLVABLE_OBSOLETES):
+            if str(dep).split(' ', 1)[0] == y.name:
+                return True
+
+        # Let 32bit binaries conflict with the i586 version.
+        if x.name == y.name + '-32bit' and y.arch in ('i586', 'i686'):
+            return True
+
+    return False
@@ -14,11 +14,12 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from datetime import datetime
-import fcntl
+import atexit
 from functools import wraps
+import hashlib
 import os
-import shelve
+import sqlite3
+import time
 try:
     import cPickle as pickle
 except:
@@ -40,59 +41,214 @@ except ImportError:
 CACHEDIR = save_cache_path('opensuse-repo-checker')
 
 
-def memoize(ttl=None, session=False, add_invalidate=False):
-    """Decorator function to implement a persistent cache.
+class MemoizeStore(object):
+    """Persistent memoize cache backed by a SQLite database.
 
-    >>> @memoize()
-    ... def test_func(a):
-    ...     return a
+    The database is opened in WAL mode so that any number of processes can
+    read while one process writes. Entries are indexed by timestamp which
+    allows expired and oldest entries to be removed without loading and
+    sorting the whole cache.
 
-    Internally, the memoized function has a cache:
+    The store provides the subset of the dict interface used by memoize() and
+    keys are expected to already be canonical strings.
 
-    >>> cache = [c.cell_contents for c in test_func.func_closure if 'sync' in dir(c.cell_contents)][0]
-    >>> 'sync' in dir(cache)
-    True
+    When batch is enabled writes are kept in memory, visible to this process
+    only, until flush() or close() writes them in a single transaction. At most
+    nclean writes are kept pending.
 
-    There is a limit of the size of the cache
-
-    >>> for k in cache:
-    ...     del cache[k]
-    >>> len(cache)
-    0
+    """
 
-    >>> for i in range(4095):
-    ...     test_func(i)
-    ... len(cache)
-    4095
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS memo (
+            key TEXT PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            value BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS memo_timestamp ON memo (timestamp);
+    """
 
-    >>> test_func(0)
-    0
+    # Number of entries per database, determined once needed and kept up to
+    # date after, shared by the stores opened on every call.
+    counts = {}
+
+    def __init__(self, filename, slots, nclean, ttl, batch=False):
+        self.filename = filename
+        self.slots = slots
+        self.nclean = nclean
+        self.ttl = ttl
+        self.batch = batch
+        self.pending = {}
+        self.connection = None
+        self.pid = None
+
+    def open(self):
+        # Autocommit since every statement stands on its own.
+        self.connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+        self.pid = os.getpid()
+
+    def forked(self):
+        """Reopen when used by a forked process.
+
+        A connection must not be used across fork() and pending writes are
+        left for the parent to flush instead of being written by every child.
+
+        """
+        if self.connection is not None and self.pid != os.getpid():
+            self.pending = {}
+            self.open()
+
+    def close(self):
+        self.forked()
+        self.flush()
+        self.connection.close()
+        self.connection = None
+
+    def flush(self):
+        """Write pending entries in a single transaction."""
+        self.forked()
+        if not self.pending:
+            return
+
+        rows = [(key, timestamp, sqlite3.Binary(pickle.dumps(value, protocol=-1)))
+                for key, (timestamp, value) in self.pending.items()]
+        self.connection.execute('BEGIN')
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO memo (key, timestamp, value) VALUES (?, ?, ?)', rows)
+        self.connection.execute('COMMIT')
+        self.count_add(len(rows))
+        self.clean(max(row[1] for row in rows))
+        self.pending = {}
+
+    def __contains__(self, key):
+        self.forked()
+        if key in self.pending:
+            return True
+        return self.connection.execute(
+            'SELECT 1 FROM memo WHERE key = ?', (key,)).fetchone() is not None
+
+    def __getitem__(self, key):
+        self.forked()
+        if key in self.pending:
+            return self.pending[key]
+        row = self.connection.execute(
+            'SELECT timestamp, value FROM memo WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return (row[0], pickle.loads(str(row[1])))
+
+    def __setitem__(self, key, item):
+        self.forked()
+        timestamp, value = item
+        if self.batch:
+            self.pending[key] = (timestamp, value)
+            if len(self.pending) >= self.nclean:
+                self.flush()
+            return
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO memo (key, timestamp, value) VALUES (?, ?, ?)',
+            (key, timestamp, sqlite3.Binary(pickle.dumps(value, protocol=-1))))
+        self.count_add(1)
+        self.clean(timestamp)
+
+    def __delitem__(self, key):
+        self.forked()
+        self.pending.pop(key, None)
+        cursor = self.connection.execute('DELETE FROM memo WHERE key = ?', (key,))
+        self.count_add(-cursor.rowcount)
+
+    def __len__(self):
+        self.forked()
+        return self.connection.execute('SELECT COUNT(*) FROM memo').fetchone()[0]
+
+    def clear(self):
+        self.forked()
+        self.pending = {}
+        self.connection.execute('DELETE FROM memo')
+        self.count = 0
+
+    @property
+    def count(self):
+        return MemoizeStore.counts.get(self.filename)
+
+    @count.setter
+    def count(self, count):
+        MemoizeStore.counts[self.filename] = count
+
+    def count_add(self, count):
+        # Replaced entries are counted as added while entries written by other
+        # processes are not, so the count is an estimate that is verified by
+        # clean() before removing the oldest entries.
+        if self.count is not None:
+            self.count += count
+
+    def clean(self, now):
+        """Remove expired entries and the oldest entries when limit reached."""
+        cursor = self.connection.execute('DELETE FROM memo WHERE timestamp < ?', (now - self.ttl,))
+        self.count_add(-cursor.rowcount)
+
+        # Only count the entries, which requires a scan, when the limit may have
+        # been reached or upon first use.
+        if self.count is None or self.count >= self.slots:
+            self.count = len(self)
+
+        if self.count >= self.slots:
+            nclean = self.nclean + self.count - self.slots
+            cursor = self.connection.execute(
+                'DELETE FROM memo WHERE key IN '
+                '(SELECT key FROM memo ORDER BY timestamp LIMIT ?)', (nclean,))
+            self.count_add(-cursor.rowcount)
+
+
+def _canonical(obj):
+    """Build a canonical string representation of the arguments.
+
+    Unlike pickle, which depends on object identity for its memo and on dict
+    ordering, the same values always result in the same representation.
 
-    >>> len(cache)
-    4095
+    """
+    if isinstance(obj, (basestring, int, long, float, bool)) or obj is None:
+        return repr(obj)
+    if isinstance(obj, tuple):
+        return '(' + ','.join(_canonical(o) for o in obj) + ')'
+    if isinstance(obj, list):
+        return '[' + ','.join(_canonical(o) for o in obj) + ']'
+    if isinstance(obj, dict):
+        return '{' + ','.join(sorted(
+            _canonical(k) + ':' + _canonical(v) for k, v in obj.items())) + '}'
+    if isinstance(obj, (set, frozenset)):
+        return 'set(' + ','.join(sorted(_canonical(o) for o in obj)) + ')'
+    return pickle.dumps(obj, protocol=-1)
+
+
+def memoize(ttl=None, session=False, add_invalidate=False, keep_open=False):
+    """Decorator function to implement a persistent cache.
 
-    >>> test_func(4095)
-    4095
+    >>> @memoize()
+    ... def test_func(a):
+    ...     return a
 
-    >>> len(cache)
-    3072
+    The first call stores the result which is then returned by later calls
+    until the time to live (ttl) expires.
 
-    >>> test_func(0)
-    0
+    >>> test_func(1)
+    1
+    >>> test_func(1)
+    1
 
-    >>> len(cache)
-    3073
+    Persistent caches are stored per function in CACHEDIR using SQLite (see
+    MemoizeStore) and are limited in size. Once SLOTS entries are reached the
+    NCLEAN oldest entries are removed. Session caches are kept in memory for
+    the duration of the process or until memoize_session_reset() is called.
 
-    >>> from datetime import timedelta
-    >>> k = [k for k in cache if cPickle.loads(k) == ((0,), {})][0]
-    >>> t, v = cache[k]
-    >>> t = t - timedelta(days=10)
-    >>> cache[k] = (t, v)
-    >>> test_func(0)
-    0
-    >>> t2, v = cache[k]
-    >>> t != t2
-    True
+    With keep_open a persistent cache is opened on first use and kept open
+    for the lifetime of the process instead of being opened on every call.
+    Writes are batched and flushed by memoize_flush(), which is called by
+    memoize_session_reset() and at exit, so other processes only see them
+    afterwards.
 
     """
 
@@ -103,24 +259,16 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     memoize.session_functions = []
 
     def _memoize(fn):
-        # Implement a POSIX lock / unlock extension for shelves. Inspired
-        # on ActiveState Code recipe #576591
-        def _lock(filename):
-            lckfile = open(filename + '.lck', 'w')
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-            return lckfile
-
-        def _unlock(lckfile):
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-            lckfile.close()
-
         def _open_cache(cache_name):
-            if not session:
-                lckfile = _lock(cache_name)
-                cache = shelve.open(cache_name, protocol=-1)
-                # Store a reference to the lckfile to avoid to be
-                # closed by gc
-                cache.lckfile = lckfile
+            if not session and keep_open:
+                if not hasattr(fn, '_memoize_store'):
+                    fn._memoize_store = MemoizeStore(cache_name, SLOTS, NCLEAN, ttl, batch=True)
+                    fn._memoize_store.open()
+                    memoize.stores.append(fn._memoize_store)
+                cache = fn._memoize_store
+            elif not session:
+                cache = MemoizeStore(cache_name, SLOTS, NCLEAN, ttl)
+                cache.open()
             else:
                 if not hasattr(fn, '_memoize_session_cache'):
                     fn._memoize_session_cache = {}
@@ -129,11 +277,14 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             return cache
 
         def _close_cache(cache):
-            if not session:
+            if not session and not keep_open:
                 cache.close()
-                _unlock(cache.lckfile)
 
         def _clean_cache(cache):
+            # Persistent stores clean themselves upon insertion.
+            if not session:
+                return
+
             len_cache = len(cache)
             if len_cache >= SLOTS:
                 nclean = NCLEAN + len_cache - SLOTS
@@ -142,23 +293,19 @@ def memoize(ttl=None, session=False, add_invalidate=False):
                     del cache[key]
 
         def _key(obj):
-            # Pickle doesn't guarantee that there is a single
-            # representation for every serialization.  We can try to
-            # picke / depickle twice to have a canonical
-            # representation.
-            key = pickle.dumps(obj, protocol=-1)
-            key = pickle.dumps(pickle.loads(key), protocol=-1)
-            return key
+            return hashlib.sha1(_canonical(obj)).hexdigest()
 
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
             cache = _open_cache(cache_name)
             if key in cache:
                 del cache[key]
+            _close_cache(cache)
 
         def _invalidate_all():
             cache = _open_cache(cache_name)
             cache.clear()
+            _close_cache(cache)
 
         def _add_invalidate_method(_self):
             name = '_invalidate_%s' % fn.__name__
@@ -171,9 +318,7 @@ def memoize(ttl=None, session=False, add_invalidate=False):
 
         @wraps(fn)
         def _fn(*args, **kwargs):
-            def total_seconds(td):
-                return (td.microseconds + (td.seconds + td.days * 24 * 3600.) * 10**6) / 10**6
-            now = datetime.now()
+            now = time.time()
             if add_invalidate:
                 _self = args[0]
                 _add_invalidate_method(_self)
@@ -183,7 +328,7 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             cache = _open_cache(cache_name)
             if key in cache:
                 timestamp, value = cache[key]
-                updated = True if total_seconds(now-timestamp) < ttl else False
+                updated = True if now - timestamp < ttl else False
             if not updated:
                 value = fn(*args, **kwargs)
                 cache[key] = (now, value)
@@ -194,13 +339,25 @@ def memoize(ttl=None, session=False, add_invalidate=False):
         cache_dir = os.path.expanduser(CACHEDIR)
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
-        cache_name = os.path.join(cache_dir, fn.__name__)
+        cache_name = os.path.join(cache_dir, fn.__name__ + '.sqlite')
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
     return _memoize
 
+memoize.stores = []
+
+
+def memoize_flush():
+    """Write pending entries of all persistent caches kept open."""
+    for store in memoize.stores:
+        store.flush()
+
+atexit.register(memoize_flush)
+
+
 def memoize_session_reset():
     """Reset all session caches."""
     for i, _ in enumerate(memoize.session_functions):
         memoize.session_functions[i]._memoize_session_cache = {}
+    memoize_flush()
@@ -0,0 +1,82 @@
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import os
+import subprocess
+import threading
+import urlparse
+
+from osclib.binary_store import STORE_DIR
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'bs_mirrorfull')
+
+# Number of repositories mirrored at once and at most against the same host.
+MIRROR_WORKERS = 4
+MIRROR_PER_HOST = 2
+
+MirrorTarget = namedtuple('MirrorTarget', ('project', 'repository', 'arch', 'directory'))
+MirrorResult = namedtuple('MirrorResult', ('success', 'output'))
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(apiurl):
+    host = urlparse.urlparse(apiurl).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(MIRROR_PER_HOST)
+        return _host_semaphores[host]
+
+
+def mirror(apiurl, target):
+    """Call bs_mirrorfull script to mirror binaries of target.
+
+    The output lists the changes made, if any, and is empty when the mirror
+    was already up to date.
+
+    """
+    if not os.path.exists(target.directory):
+        os.makedirs(target.directory)
+
+    url = '{}/public/build/{}/{}/{}'.format(
+        apiurl, target.project, target.repository, target.arch)
+    args = ['perl', SCRIPT, '--nodebug', '--store', STORE_DIR, url, target.directory]
+    env = dict(os.environ, LC_ALL='C')
+
+    with _host_semaphore(apiurl):
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, env=env, close_fds=True)
+        output = p.communicate()[0]
+
+    return MirrorResult(p.returncode == 0, output)
+
+
+def mirror_parallel(apiurl, targets, logger, workers=MIRROR_WORKERS):
+    """Mirror targets concurrently reporting progress per target.
+
+    Returns a dictionary of MirrorResult keyed by target.
+
+    """
+    results = {}
+    if not len(targets):
+        return results
+
+    def _mirror(target):
+        path = '/'.join(target[:3])
+        logger.info('mirroring {}'.format(path))
+        result = mirror(apiurl, target)
+        results[target] = result
+        for line in result.output.splitlines():
+            logger.info('{}: {}'.format(path, line))
+        if result.success:
+            logger.info('mirrored {} ({}/{})'.format(path, len(results), len(targets)))
+        else:
+            logger.error('failed to mirror {}'.format(path))
+
+    pool = ThreadPool(min(workers, len(targets)))
+    try:
+        pool.map(_mirror, targets)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
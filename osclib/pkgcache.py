@@ -14,7 +14,8 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import fcntl
+from contextlib import contextmanager
+import errno
 import glob
 import hashlib
 import os.path
@@ -22,18 +23,57 @@ try:
     import cPickle as pickle
 except:
     import pickle
-import shelve
 import shutil
+import sqlite3
 import time
 from UserDict import DictMixin
 
 
 class PkgCache(DictMixin):
+    """Container of files indexed by a key like:
+
+    (project, repository, arch, package, filename, mtime)
+
+    Files are stored once per content (md5) and the index, a SQLite database,
+    keeps an explicit reference count for each of them. Entries are indexed
+    by the key without the mtime (prefix) and by mtime so that duplicates and
+    expired entries can be found without reading the whole index.
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entry (
+            key TEXT PRIMARY KEY,
+            prefix TEXT NOT NULL,
+            mtime INTEGER NOT NULL,
+            key_pickle BLOB NOT NULL,
+            md5 TEXT NOT NULL,
+            filename TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entry_prefix ON entry (prefix, mtime);
+        CREATE INDEX IF NOT EXISTS entry_mtime ON entry (mtime);
+        CREATE TABLE IF NOT EXISTS content (
+            md5 TEXT PRIMARY KEY,
+            refcount INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    # Minimum time between automatic cleanups when constructed (seconds)
+    CLEAN_INTERVAL = 60*60
+
+    # Size of the chunks read when hashing a file
+    CHUNK_SIZE = 1024*1024
+
     def __init__(self, basecachedir, force_clean=False):
         self.cachedir = os.path.join(basecachedir, 'pkgcache')
-        self.index_fn = os.path.join(self.cachedir, 'index.db')
+        self.index_fn = os.path.join(self.cachedir, 'index.sqlite')
 
-        if force_clean:
+        # Files stored by the shelve based index have no reference count.
+        if force_clean or glob.glob(os.path.join(self.cachedir, 'index.db*')):
             try:
                 shutil.rmtree(self.cachedir)
             except OSError:
@@ -42,160 +82,157 @@ class PkgCache(DictMixin):
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
 
-        self._clean_cache()
-
-    def _lock(self, filename):
-        """Get a lock for the index file."""
-        lckfile = open(filename + '.lck', 'w')
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-        return lckfile
-
-    def _unlock(self, lckfile):
-        """Release the lock for the index file."""
-        fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-        lckfile.close()
-
-    def _open_index(self):
-        """Open the index file for the cache / container."""
-        lckfile = self._lock(self.index_fn)
-        index = shelve.open(self.index_fn, protocol=-1)
-        # Store a reference to the lckfile to avoid to be closed by gc
-        index.lckfile = lckfile
-        return index
-
-    def _close_index(self, index):
-        """Close the index file for the cache / container."""
-        index.close()
-        self._unlock(index.lckfile)
-
-    def _clean_cache(self, ttl=14*24*60*60, index=None):
+        self.index = sqlite3.connect(self.index_fn, timeout=60, isolation_level=None)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.executescript(self.SCHEMA)
+
+        now = int(time.time())
+        row = self.index.execute('SELECT value FROM meta WHERE name = ?', ('cleaned',)).fetchone()
+        if row is None or now - row[0] >= self.CLEAN_INTERVAL:
+            self._clean_cache()
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the index write lock while the files are being modified."""
+        self.index.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except:
+            self.index.execute('ROLLBACK')
+            raise
+        self.index.execute('COMMIT')
+
+    def _key(self, key):
+        """Canonical string of the key and of the key without the mtime."""
+        return repr(tuple(key)), repr(tuple(key[:-1]))
+
+    def _cache_fn(self, md5):
+        return os.path.join(self.cachedir, md5[:2], md5[2:])
+
+    def _md5(self, filename):
+        """Hash the file reading it in chunks."""
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), ''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def _release(self, md5):
+        """Drop a reference to the content and remove the file (and the
+        directory if it is empty) once it is no longer referenced.
+
+        """
+        self.index.execute('UPDATE content SET refcount = refcount - 1 WHERE md5 = ?', (md5,))
+        refcount = self.index.execute(
+            'SELECT refcount FROM content WHERE md5 = ?', (md5,)).fetchone()[0]
+        if refcount > 0:
+            return
+
+        self.index.execute('DELETE FROM content WHERE md5 = ?', (md5,))
+        cache_fn = self._cache_fn(md5)
+        os.unlink(cache_fn)
+
+        dirname = os.path.dirname(cache_fn)
+        if not os.listdir(dirname):
+            os.rmdir(dirname)
+
+    def _clean_cache(self, ttl=14*24*60*60):
         """Remove elements in the cache that share the same prefix of the key
         (all except the mtime), and keep the latest one.  Also remove
         old entries based on the TTL.
 
         """
-        _i = self._open_index() if index is None else index
-
-        # Ugly hack to assure that the key is serialized always with
-        # the same pickle format.  Pickle do not guarantee that the
-        # same object is serialized always in the same string.
-        skeys = {pickle.loads(key): key for key in _i}
-        keys = sorted(skeys)
-
         now = int(time.time())
-        last = None
-        for key in keys:
-            if last and last[:-1] == key[:-1]:
-                self.__delitem__(key=skeys[last], skey=True, index=_i)
-                last = key
-            elif now - int(key[-1]) >= ttl:
-                self.__delitem__(key=skeys[key], skey=True, index=_i)
-            else:
-                last = key
-
-        if index is None:
-            self._close_index(_i)
-
-    def __getitem__(self, key, index=None):
+        with self._transaction():
+            rows = self.index.execute(
+                'SELECT key, md5 FROM entry WHERE mtime <= ? OR EXISTS '
+                '(SELECT 1 FROM entry AS newer WHERE newer.prefix = entry.prefix '
+                'AND newer.mtime > entry.mtime)', (now - ttl,)).fetchall()
+            for key, md5 in rows:
+                self.index.execute('DELETE FROM entry WHERE key = ?', (key,))
+                self._release(md5)
+
+            self.index.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                               ('cleaned', now))
+
+    def __contains__(self, key):
+        key, _ = self._key(key)
+        return self.index.execute(
+            'SELECT 1 FROM entry WHERE key = ?', (key,)).fetchone() is not None
+
+    def __getitem__(self, key):
         """Get a element in the cache.
 
         For the container perspective, the key is a tuple like this:
         (project, repository, arch, package, filename, mtime)
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-        value = pickle.loads(_i[key])
-
-        if index is None:
-            self._close_index(_i)
-
-        return value
-
-    def __setitem__(self, key, value, index=None):
+        skey, _ = self._key(key)
+        row = self.index.execute(
+            'SELECT md5, filename FROM entry WHERE key = ?', (skey,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return (str(row[0]), str(row[1]))
+
+    def __setitem__(self, key, value):
         """Add a new file in the cache. 'value' is expected to contains the
         path of file.
 
         """
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1)
-
-        original_value = value
-
-        md5 = hashlib.md5(open(value, 'rb').read()).hexdigest()
+        skey, prefix = self._key(key)
+        md5 = self._md5(value)
         filename = os.path.basename(value)
-        value = (md5, filename)
-        value = pickle.dumps(value, protocol=-1)
-        _i[key] = value
-
-        # Move the file into the container using a hard link
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        if os.path.exists(cache_fn):
-            # Manage collisions using hard links and refcount
-            collisions = sorted(glob.glob(cache_fn + '-*'))
-            next_refcount = 1
-            if collisions:
-                next_refcount = int(collisions[-1][-3:]) + 1
-            next_cache_fn = cache_fn + '-%03d' % next_refcount
-            os.link(cache_fn, next_cache_fn)
-        else:
-            dirname = os.path.dirname(cache_fn)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            os.link(original_value, cache_fn)
-
-        if index is None:
-            self._close_index(_i)
-
-    def __delitem__(self, key, skey=False, index=None):
-        """Remove a file from the cache."""
-        _i = self._open_index() if index is None else index
-
-        key = pickle.dumps(key, protocol=-1) if not skey else key
-        value = pickle.loads(_i[key])
 
-        md5, _ = value
-
-        # Remove the file (taking care of collision) and the directory
-        # if it is empty
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        collisions = sorted(glob.glob(cache_fn + '-*'))
-        if collisions:
-            os.unlink(collisions[-1])
-        else:
-            os.unlink(cache_fn)
-
-        dirname = os.path.dirname(cache_fn)
-        if not os.listdir(dirname):
-            os.rmdir(dirname)
-
-        del _i[key]
-
-        if index is None:
-            self._close_index(_i)
-
-    def keys(self, index=None):
-        _i = self._open_index() if index is None else index
-
-        keys = [pickle.loads(key) for key in _i]
+        with self._transaction():
+            row = self.index.execute('SELECT md5 FROM entry WHERE key = ?', (skey,)).fetchone()
+            if row:
+                self.index.execute('DELETE FROM entry WHERE key = ?', (skey,))
+                self._release(row[0])
+
+            self.index.execute(
+                'INSERT INTO entry (key, prefix, mtime, key_pickle, md5, filename) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (skey, prefix, int(key[-1]),
+                 sqlite3.Binary(pickle.dumps(key, protocol=-1)), md5, filename))
+
+            # Move the file into the container using a hard link
+            cursor = self.index.execute(
+                'UPDATE content SET refcount = refcount + 1 WHERE md5 = ?', (md5,))
+            if cursor.rowcount == 0:
+                cache_fn = self._cache_fn(md5)
+                dirname = os.path.dirname(cache_fn)
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                try:
+                    os.link(value, cache_fn)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    # Left behind without a content row by an interrupted
+                    # insertion, so it is not referenced and can be replaced.
+                    os.unlink(cache_fn)
+                    os.link(value, cache_fn)
+                self.index.execute('INSERT INTO content (md5, refcount) VALUES (?, 1)', (md5,))
+
+    def __delitem__(self, key):
+        """Remove a file from the cache."""
+        skey, _ = self._key(key)
+        with self._transaction():
+            row = self.index.execute('SELECT md5 FROM entry WHERE key = ?', (skey,)).fetchone()
+            if row is None:
+                raise KeyError(key)
 
-        if index is None:
-            self._close_index(_i)
+            self.index.execute('DELETE FROM entry WHERE key = ?', (skey,))
+            self._release(row[0])
 
-        return keys
+    def keys(self):
+        return [pickle.loads(str(row[0]))
+                for row in self.index.execute('SELECT key_pickle FROM entry')]
 
-    def linkto(self, key, target, index=None):
+    def linkto(self, key, target):
         """Create a link between the cached object and the target"""
-        _i = self._open_index() if index is None else index
-
-        md5, filename = self.__getitem__(key, index=_i)
+        md5, filename = self.__getitem__(key)
         if filename != target:
             pass
             # print 'Warning. The target name (%s) is different from the original name (%s)' % (target, filename)
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        os.link(cache_fn, target)
-
-        if index is None:
-            self._close_index(_i)
+        os.link(self._cache_fn(md5), target)
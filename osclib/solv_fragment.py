@@ -0,0 +1,188 @@
+import errno
+import marshal
+import os
+import rpm
+import solv
+import tempfile
+
+from osclib.binary_store import binary_store_populated
+from osclib.binary_store import STORE_DIR
+from osclib.memoize import CACHEDIR
+
+# Each mirrored binary is converted into a solv fragment once and stored under
+# the name given by bs_mirrorfull, which contains the header checksum.
+SOLV_FRAGMENT_DIR = os.path.join(CACHEDIR, 'solv-fragments')
+
+
+class MirrorCorrupt(Exception):
+    """Raised when a mirror contains binaries that cannot be read.
+
+    The binaries are removed beforehand, so mirroring again downloads them.
+
+    """
+
+
+def binary_remove(rpm_file):
+    """Remove binary from the mirror and the store."""
+    name = os.path.basename(rpm_file)
+    for path in (rpm_file, os.path.join(STORE_DIR, name[:2], name)):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def solv_build(solv_file, directory):
+    """Write solv file for the binaries in directory.
+
+    Only binaries not seen before are read and the fragments of all binaries
+    are then merged like mergesolv does. Returns the number of binaries and
+    the number of those read.
+
+    """
+    pool = solv.Pool()
+    fragments = []
+    built = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.rpm'):
+            continue
+        fragment = os.path.join(SOLV_FRAGMENT_DIR, name[:2], name + '.solv')
+        if not os.path.exists(fragment):
+            solv_fragment(pool, os.path.join(directory, name), fragment)
+            built += 1
+        fragments.append((name, fragment))
+
+    repo = pool.add_repo(os.path.basename(solv_file))
+    for name, fragment in fragments:
+        if not repo.add_solv(fragment):
+            # Rebuild an unreadable fragment once.
+            solv_fragment(pool, os.path.join(directory, name), fragment)
+            built += 1
+            if not repo.add_solv(fragment):
+                raise Exception('failed to add solv fragment {}'.format(fragment))
+    repo.internalize()
+    solv_write(repo, solv_file)
+    return len(fragments), built
+
+
+def solv_build_directory(directory, rebuild=False):
+    """Solv file for a mirrored directory rebuilt whenever the mirror changed.
+
+    Binaries added or removed by bs_mirrorfull change the modification time
+    of the directory.
+
+    """
+    solv_file = directory.rstrip('/') + '.solv'
+    if rebuild or not os.path.exists(solv_file) or os.path.getmtime(directory) > os.path.getmtime(solv_file):
+        solv_build(solv_file, directory)
+    return solv_file
+
+
+def solv_fragment(pool, rpm_file, fragment):
+    """Write solv fragment for a single binary."""
+    repo = pool.add_repo(os.path.basename(rpm_file))
+    if not repo.add_rpm(rpm_file, solv.Repo.REPO_REUSE_REPODATA | solv.Repo.REPO_NO_INTERNALIZE):
+        repo.free(True)
+        binary_remove(rpm_file)
+        raise MirrorCorrupt('failed to read {}'.format(rpm_file))
+    repo.internalize()
+    solv_write(repo, fragment)
+    repo.free(True)
+
+
+def solv_write(repo, filename):
+    fd, filename_tmp = temporary_file(filename)
+    os.close(fd)
+    f = solv.xfopen(filename_tmp, 'w')
+    if not repo.write(f):
+        raise Exception('failed to write {}'.format(filename))
+    f.flush()
+    f.close()
+    os.rename(filename_tmp, filename)
+
+
+def solv_fragment_files(rpm_file):
+    """Details of the files in a binary not carried by solv data.
+
+    Returns a dictionary of (mode, flags, owner, link target, digest) keyed by
+    path. The details are read from the binary when first needed and stored
+    next to its solv fragment.
+
+    """
+    name = os.path.basename(rpm_file)
+    filename = os.path.join(SOLV_FRAGMENT_DIR, name[:2], name + '.files')
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            return marshal.load(f)
+
+    ts = rpm.TransactionSet()
+    ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+    try:
+        fd = os.open(rpm_file, os.O_RDONLY)
+    except OSError as e:
+        # Missing if the mirror changed since the solv file was built.
+        if e.errno != errno.ENOENT:
+            raise
+        raise MirrorCorrupt('missing binary {}'.format(rpm_file))
+    try:
+        header = ts.hdrFromFdno(fd)
+    except rpm.error:
+        binary_remove(rpm_file)
+        raise MirrorCorrupt('failed to read {}'.format(rpm_file))
+    finally:
+        os.close(fd)
+
+    files = {}
+    for path, mode, flags, user, group, target, digest in zip(
+            header[rpm.RPMTAG_FILENAMES], header[rpm.RPMTAG_FILEMODES],
+            header[rpm.RPMTAG_FILEFLAGS], header[rpm.RPMTAG_FILEUSERNAME],
+            header[rpm.RPMTAG_FILEGROUPNAME], header[rpm.RPMTAG_FILELINKTOS],
+            header[rpm.RPMTAG_FILEDIGESTS]):
+        # Modes are signed 16-bit values in some rpm versions.
+        files[path] = (mode & 0xffff, flags, '{}:{}'.format(user, group), target, digest)
+
+    fd, filename_tmp = temporary_file(filename)
+    with os.fdopen(fd, 'wb') as f:
+        marshal.dump(files, f)
+    os.rename(filename_tmp, filename)
+    return files
+
+
+def temporary_file(filename):
+    """Create a temporary file to be renamed to filename once written.
+
+    The name is unique since repo_checker and pkglistgen share the fragments
+    and may write the same one at the same time. Renaming avoids partial files.
+
+    """
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            # Another process may have created it meanwhile.
+            if e.errno != errno.EEXIST:
+                raise
+    return tempfile.mkstemp(prefix='.', dir=dirname)
+
+
+def solv_fragment_gc():
+    """Remove solv fragments of binaries no longer in the binary store.
+
+    Nothing is removed while the store holds no binaries, as when it is on
+    another filesystem than the mirrors and bs_mirrorfull does not store them.
+
+    """
+    if not os.path.isdir(SOLV_FRAGMENT_DIR) or not binary_store_populated():
+        return
+
+    for prefix in os.listdir(SOLV_FRAGMENT_DIR):
+        directory = os.path.join(SOLV_FRAGMENT_DIR, prefix)
+        for name in os.listdir(directory):
+            if name.startswith('.'):
+                # Temporary file being written.
+                continue
+            # Both the .solv and .files of a binary are named after it.
+            if not os.path.exists(os.path.join(STORE_DIR, prefix, os.path.splitext(name)[0])):
+                os.unlink(os.path.join(directory, name))
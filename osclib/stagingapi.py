@@ -48,6 +48,7 @@ from osc.core import show_project_sourceinfo
 from osc.core import streamfile
 
 from osclib.cache import Cache
+from osclib.cache import http_GET_root
 from osclib.core import devel_project_get
 from osclib.core import project_list_prefix
 from osclib.core import source_file_load
@@ -1381,7 +1382,7 @@ class StagingAPI(object):
     def get_flag_in_prj(self, project, flag='build', repository=None, arch=None):
         """Return the flag value in a project."""
         url = self.makeurl(['source', project, '_meta'])
-        root = ET.parse(http_GET(url)).getroot()
+        root = http_GET_root(url, ET.fromstring)
         section = root.find(flag)
         for status in section:
             is_repository = status.get('repository', None) == repository
@@ -27,9 +27,12 @@ from __future__ import print_function
 import copy
 from lxml import etree as ET
 from collections import namedtuple
+from collections import OrderedDict
 import sys
 import cmdln
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import urllib2
 import filecmp
 from osc.core import checkout_package
@@ -39,6 +42,7 @@ from osc.core import Package
 from osc.core import show_results_meta
 from osc.core import undelete_package
 from osc import conf
+from osclib.binary_store import binary_store_gc
 from osclib.conf import Config, str2bool
 from osclib.stagingapi import StagingAPI
 from osclib.util import project_list_family
@@ -46,7 +50,6 @@ from osclib.util import project_list_family_prior
 from xdg.BaseDirectory import save_cache_path
 import glob
 import hashlib
-import io
 import solv
 from pprint import pprint, pformat
 import os
@@ -56,17 +59,22 @@ import re
 import yaml
 import requests
 import urlparse
-import gzip
 import tempfile
 import traceback
 import random
 import shutil
 import string
+import threading
+import time
 
 import ToolBase
 
 # share header cache with repochecker
 from osclib.memoize import CACHEDIR
+from osclib.mirror import mirror_parallel
+from osclib.mirror import MirrorTarget
+from osclib.solv_fragment import solv_build
+from osclib.solv_fragment import solv_fragment_gc
 
 logger = logging.getLogger()
 
@@ -74,6 +82,20 @@ SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 ARCHITECTURES = ['x86_64', 'ppc64le', 's390x', 'aarch64']
 DEFAULT_REPOS = ("openSUSE:Factory/standard")
 PRODUCT_SERVICE = '/usr/lib/obs/service/create_single_product'
+# Number of repositories fetched at once by solv_cache_update().
+SOLV_DUMP_WORKERS = 4
+
+SolveResult = namedtuple('SolveResult', ('solved', 'srcpkgs', 'recommends', 'suggested',
+                                         'not_found', 'unresolvable'))
+
+# PkgListGen instance inherited by solve_modules() worker processes.
+_solve_tool = None
+
+
+def _solve_arch(task):
+    groupname, arch = task
+    return _solve_tool.groups[groupname].solve_arch(
+        arch, _solve_tool.ignore_recommended, _solve_tool.include_suggested)
 
 
 class Group(object):
@@ -168,8 +190,12 @@ class Group(object):
             self.ignore(g)
         self.ignored.add(without)
 
-    def solve(self, ignore_recommended=False, include_suggested=False):
-        """ base: list of base groups or None """
+    def solve(self, ignore_recommended=False, include_suggested=False, results=None):
+        """ base: list of base groups or None
+
+        results optionally provides the solve_arch() result per arch when
+        those were computed elsewhere, see PkgListGen.solve_modules().
+        """
 
         solved = dict()
         for arch in self.architectures:
@@ -179,101 +205,24 @@ class Group(object):
         self.recommends = dict()
         self.suggested = dict()
         for arch in self.architectures:
-            pool = self.pkglist._prepare_pool(arch)
-            # pool.set_debuglevel(10)
-            suggested = []
-
-            # packages resulting from explicit recommended expansion
-            extra = []
-
-            def solve_one_package(n, group):
-                jobs = list(self.pkglist.lockjobs[arch])
-                sel = pool.select(str(n), solv.Selection.SELECTION_NAME)
-                if sel.isempty():
-                    logger.debug('{}.{}: package {} not found'.format(self.name, arch, n))
-                    self.not_found.setdefault(n, set()).add(arch)
-                    return
-                else:
-                    if n in self.expand_recommended:
-                        for s in sel.solvables():
-                            for dep in s.lookup_deparray(solv.SOLVABLE_RECOMMENDS):
-                                # only add recommends that exist as packages
-                                rec = pool.select(dep.str(), solv.Selection.SELECTION_NAME)
-                                if not rec.isempty():
-                                    extra.append([dep.str(), group + ":recommended:" + n])
-
-                    jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
-
-                locked = self.locked | self.pkglist.unwanted
-                for l in locked:
-                    sel = pool.select(str(l), solv.Selection.SELECTION_NAME)
-                    if sel.isempty():
-                        # if we can't find it, it probably is not as important
-                        logger.debug('{}.{}: locked package {} not found'.format(self.name, arch, l))
-                    else:
-                        jobs += sel.jobs(solv.Job.SOLVER_LOCK)
-
-                for s in self.silents:
-                    sel = pool.select(str(s), solv.Selection.SELECTION_NAME | solv.Selection.SELECTION_FLAT)
-                    if sel.isempty():
-                        logger.warn('{}.{}: silent package {} not found'.format(self.name, arch, s))
-                    else:
-                        jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
-
-                solver = pool.Solver()
-                if ignore_recommended:
-                    solver.set_flag(solver.SOLVER_FLAG_IGNORE_RECOMMENDED, 1)
-
-                problems = solver.solve(jobs)
-                if problems:
-                    for problem in problems:
-                        msg = 'unresolvable: %s.%s: %s', self.name, arch, problem
-                        if self.pkglist.ignore_broken:
-                            logger.debug(msg)
-                        else:
-                            logger.debug(msg)
-                        self.unresolvable[arch][n] = str(problem)
-                    return
-
-                if hasattr(solver, 'get_recommended'):
-                    for s in solver.get_recommended():
-                        if s.name in locked:
-                            continue
-                        self.recommends.setdefault(s.name, group + ':' + n)
-                    for s in solver.get_suggested():
-                        suggested.append([s.name, group + ':suggested:' + n])
-                        self.suggested.setdefault(s.name, group + ':' + n)
-                else:
-                    logger.warn('newer libsolv needed for recommends!')
-
-                trans = solver.transaction()
-                if trans.isempty():
-                    logger.error('%s.%s: nothing to do', self.name, arch)
-                    return
-
-                for s in trans.newsolvables():
-                    solved[arch].setdefault(s.name, group + ':' + n)
-                    reason, rule = solver.describe_decision(s)
-                    if None:
-                        print(self.name, s.name, reason, rule.info().problemstr())
-                    # don't ask me why, but that's how it seems to work
-                    if s.lookup_void(solv.SOLVABLE_SOURCENAME):
-                        src = s.name
-                    else:
-                        src = s.lookup_str(solv.SOLVABLE_SOURCENAME)
-                    self.srcpkgs[src] = group + ':' + s.name
-
-            for n, group in self.packages[arch]:
-                solve_one_package(n, group)
-
-            if include_suggested:
-                seen = set()
-                while suggested:
-                    n, group = suggested.pop()
-                    if n in seen:
-                        continue
-                    seen.add(n)
-                    solve_one_package(n, group)
+            if results:
+                result = results[arch]
+            else:
+                result = self.solve_arch(arch, ignore_recommended, include_suggested)
+
+            # Replay in the order recorded to end up with identical dicts.
+            for name, reason in result.solved.items():
+                solved[arch].setdefault(name, reason)
+            for src, reason in result.srcpkgs.items():
+                self.srcpkgs[src] = reason
+            for name, reason in result.recommends.items():
+                self.recommends.setdefault(name, reason)
+            for name, reason in result.suggested.items():
+                self.suggested.setdefault(name, reason)
+            for name in result.not_found:
+                self.not_found.setdefault(name, set()).add(arch)
+            for name, problem in result.unresolvable.items():
+                self.unresolvable[arch][name] = problem
 
         common = None
         # compute common packages across all architectures
@@ -295,6 +244,240 @@ class Group(object):
         self.solved_packages = solved
         self.solved = True
 
+    def solve_arch(self, arch, ignore_recommended=False, include_suggested=False):
+        """Solve packages of arch without modifying the group.
+
+        The result keeps the order in which entries were found so that it can
+        be merged into the group by solve() as if it was solved in place.
+        """
+        result = SolveResult(OrderedDict(), OrderedDict(), OrderedDict(),
+                             OrderedDict(), OrderedDict(), OrderedDict())
+        pool = self.pkglist._prepare_pool(arch)
+        # pool.set_debuglevel(10)
+        suggested = []
+
+        # packages resulting from explicit recommended expansion
+        extra = []
+
+        # Jobs shared by all packages.
+        locked = self.locked | self.pkglist.unwanted
+        jobs_lock = []
+        for l in locked:
+            sel = self.pkglist._select(arch, str(l), solv.Selection.SELECTION_NAME)
+            if sel.isempty():
+                # if we can't find it, it probably is not as important
+                logger.debug('{}.{}: locked package {} not found'.format(self.name, arch, l))
+            else:
+                jobs_lock += sel.jobs(solv.Job.SOLVER_LOCK)
+
+        jobs_silent = []
+        for s in self.silents:
+            sel = self.pkglist._select(arch, str(s), solv.Selection.SELECTION_NAME | solv.Selection.SELECTION_FLAT)
+            if sel.isempty():
+                logger.warn('{}.{}: silent package {} not found'.format(self.name, arch, s))
+            else:
+                jobs_silent += sel.jobs(solv.Job.SOLVER_INSTALL)
+
+        def select_package(n, group):
+            sel = self.pkglist._select(arch, str(n), solv.Selection.SELECTION_NAME)
+            if sel.isempty():
+                logger.debug('{}.{}: package {} not found'.format(self.name, arch, n))
+                result.not_found[n] = True
+                return None
+
+            if n in self.expand_recommended:
+                for s in sel.solvables():
+                    for dep in s.lookup_deparray(solv.SOLVABLE_RECOMMENDS):
+                        # only add recommends that exist as packages
+                        rec = pool.select(dep.str(), solv.Selection.SELECTION_NAME)
+                        if not rec.isempty():
+                            extra.append([dep.str(), group + ":recommended:" + n])
+
+            return sel
+
+        def solver_create():
+            solver = pool.Solver()
+            if ignore_recommended:
+                solver.set_flag(solver.SOLVER_FLAG_IGNORE_RECOMMENDED, 1)
+            return solver
+
+        def add_solved(s, group, n):
+            result.solved.setdefault(s.name, group + ':' + n)
+            # don't ask me why, but that's how it seems to work
+            if s.lookup_void(solv.SOLVABLE_SOURCENAME):
+                src = s.name
+            else:
+                src = s.lookup_str(solv.SOLVABLE_SOURCENAME)
+            result.srcpkgs[src] = group + ':' + s.name
+
+        def solve_one_package(n, group):
+            sel = select_package(n, group)
+            if sel is None:
+                return
+
+            jobs = list(self.pkglist.lockjobs[arch])
+            jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
+            jobs += jobs_lock
+            jobs += jobs_silent
+
+            solver = solver_create()
+            problems = solver.solve(jobs)
+            if problems:
+                for problem in problems:
+                    msg = 'unresolvable: %s.%s: %s', self.name, arch, problem
+                    if self.pkglist.ignore_broken:
+                        logger.debug(msg)
+                    else:
+                        logger.debug(msg)
+                    result.unresolvable[n] = str(problem)
+                return
+
+            if hasattr(solver, 'get_recommended'):
+                for s in solver.get_recommended():
+                    if s.name in locked:
+                        continue
+                    result.recommends.setdefault(s.name, group + ':' + n)
+                for s in solver.get_suggested():
+                    suggested.append([s.name, group + ':suggested:' + n])
+                    result.suggested.setdefault(s.name, group + ':' + n)
+            else:
+                logger.warn('newer libsolv needed for recommends!')
+
+            trans = solver.transaction()
+            if trans.isempty():
+                logger.error('%s.%s: nothing to do', self.name, arch)
+                return
+
+            for s in trans.newsolvables():
+                add_solved(s, group, n)
+                reason, rule = solver.describe_decision(s)
+                if None:
+                    print(self.name, s.name, reason, rule.info().problemstr())
+
+        def solve_batch(packages):
+            """Solve all packages in one solver run.
+
+            Each solvable is attributed to the first package whose dependency
+            closure within the transaction contains it, which is the package
+            that pulled it in when solving packages one by one. Returns False
+            if there are problems, which are left to solve_one_package() to
+            report per package.
+            """
+            selected = []
+            jobs = list(self.pkglist.lockjobs[arch])
+            for n, group in packages:
+                sel = select_package(n, group)
+                if sel is not None:
+                    selected.append((n, group, sel))
+                    jobs += sel.jobs(solv.Job.SOLVER_INSTALL)
+            jobs += jobs_lock
+            jobs += jobs_silent
+
+            if not len(selected):
+                return True
+
+            solver = solver_create()
+            if solver.solve(jobs):
+                logger.debug('%s.%s: batch unresolvable, solving per package', self.name, arch)
+                result.not_found.clear()
+                return False
+
+            trans = solver.transaction()
+            if trans.isempty():
+                logger.error('%s.%s: nothing to do', self.name, arch)
+                return True
+
+            installed = {s.id: s for s in trans.newsolvables()}
+            edges = closure_edges(installed, ignore_recommended)
+            roots_silent = []
+            for job in jobs_silent:
+                roots_silent += [s.id for s in job.solvables() if s.id in installed]
+
+            owner = OrderedDict()
+            for n, group, sel in selected:
+                roots = [s.id for s in sel.solvables() if s.id in installed] + roots_silent
+                for sid in closure(roots, edges):
+                    owner.setdefault(sid, (group, n))
+
+            # Anything not reachable, for example through rich dependencies,
+            # goes to the first package as it is part of each transaction.
+            n, group, _ = selected[0]
+            for sid in installed:
+                owner.setdefault(sid, (group, n))
+
+            for sid, (group, n) in owner.items():
+                add_solved(installed[sid], group, n)
+
+            if hasattr(solver, 'get_recommended'):
+                for s in solver.get_recommended():
+                    if s.name in locked:
+                        continue
+                    group, n = dependency_owner(s, solv.SOLVABLE_RECOMMENDS, installed, owner)
+                    result.recommends.setdefault(s.name, group + ':' + n)
+                for s in solver.get_suggested():
+                    group, n = dependency_owner(s, solv.SOLVABLE_SUGGESTS, installed, owner)
+                    suggested.append([s.name, group + ':suggested:' + n])
+                    result.suggested.setdefault(s.name, group + ':' + n)
+            else:
+                logger.warn('newer libsolv needed for recommends!')
+
+            return True
+
+        def closure_edges(installed, ignore_recommended):
+            """Dependency edges between the installed solvables."""
+            keys = [solv.SOLVABLE_REQUIRES, solv.SOLVABLE_PREREQUIRES]
+            if not ignore_recommended:
+                keys.append(solv.SOLVABLE_RECOMMENDS)
+
+            edges = {}
+            for sid, s in installed.items():
+                for key in keys:
+                    for dep in s.lookup_deparray(key):
+                        for p in pool.whatprovides(dep):
+                            if p.id in installed:
+                                edges.setdefault(sid, []).append(p.id)
+
+                # Supplements pull in s once what it supplements is installed.
+                for dep in s.lookup_deparray(solv.SOLVABLE_SUPPLEMENTS):
+                    for p in pool.whatprovides(dep):
+                        if p.id in installed:
+                            edges.setdefault(p.id, []).append(sid)
+            return edges
+
+        def closure(roots, edges):
+            seen = OrderedDict()
+            todo = list(roots)
+            while todo:
+                sid = todo.pop(0)
+                if sid in seen:
+                    continue
+                seen[sid] = True
+                todo.extend(edges.get(sid, []))
+            return seen.keys()
+
+        def dependency_owner(s, key, installed, owner):
+            """Owner of the first installed solvable with dependency key on s."""
+            for sid, group_package in owner.items():
+                for dep in installed[sid].lookup_deparray(key):
+                    if s.id in [p.id for p in pool.whatprovides(dep)]:
+                        return group_package
+            return owner.values()[0]
+
+        if not self.pkglist.solve_batch or not solve_batch(self.packages[arch]):
+            for n, group in self.packages[arch]:
+                solve_one_package(n, group)
+
+        if include_suggested:
+            seen = set()
+            while suggested:
+                n, group = suggested.pop()
+                if n in seen:
+                    continue
+                seen.add(n)
+                solve_one_package(n, group)
+
+        return result
+
     def check_dups(self, modules, overlap):
         if not overlap:
             return
@@ -420,6 +603,9 @@ class PkgListGen(ToolBase.ToolBase):
         self.input_dir = '.'
         self.output_dir = '.'
         self.lockjobs = dict()
+        self.pools = dict()
+        self.selections = dict()
+        self.solve_batch = False
         self.ignore_broken = False
         self.ignore_recommended = False
         self.include_suggested = False
@@ -525,6 +711,54 @@ class PkgListGen(ToolBase.ToolBase):
         for e in excludes:
             g.ignore(self.groups[e])
 
+    def solve_modules(self, modules, jobs=1):
+        """Solve list of (groupname, includes, excludes) like solve_module().
+
+        With more than one job each group and arch is solved in a pool of
+        worker processes. Solving neither depends on the solved state of other
+        groups nor changes the inherited packages, so all groups inherit first
+        and ignore their excludes last, in the original order, which produces
+        the same result as solving one module after the other.
+        """
+        if jobs <= 1:
+            for groupname, includes, excludes in modules:
+                self.solve_module(groupname, includes, excludes)
+            return
+
+        for groupname, includes, excludes in modules:
+            g = self.groups[groupname]
+            for i in includes:
+                g.inherit(self.groups[i])
+
+        # Prepare pools before forking so workers need not load them again.
+        for arch in self.architectures:
+            self._prepare_pool(arch)
+
+        tasks = []
+        for groupname, _, _ in modules:
+            for arch in self.groups[groupname].architectures:
+                tasks.append((groupname, arch))
+
+        global _solve_tool
+        _solve_tool = self
+        workers = multiprocessing.Pool(jobs)
+        try:
+            results = workers.map(_solve_arch, tasks)
+        finally:
+            workers.close()
+            workers.join()
+            _solve_tool = None
+
+        results_group = {}
+        for (groupname, arch), result in zip(tasks, results):
+            results_group.setdefault(groupname, {})[arch] = result
+
+        for groupname, includes, excludes in modules:
+            g = self.groups[groupname]
+            g.solve(self.ignore_recommended, self.include_suggested, results_group[groupname])
+            for e in excludes:
+                g.ignore(self.groups[e])
+
     def _check_supplements(self):
         tocheck = set()
         for arch in self.architectures:
@@ -550,6 +784,15 @@ class PkgListGen(ToolBase.ToolBase):
             logger.warn('package %s has supplements but is not grouped', p)
 
     def _prepare_pool(self, arch):
+        """Prepare the pool for arch once per run along with the lockjobs for
+        binaries provided by more than one repository.
+
+        The pool must not be modified by callers since it is shared.
+        """
+        if arch in self.pools:
+            return self.pools[arch]
+
+        start = time.time()
         pool = solv.Pool()
         pool.setarch(arch)
 
@@ -578,8 +821,19 @@ class PkgListGen(ToolBase.ToolBase):
         else:
             logger.warn('libsolv missing set_namespaceproviders()')
 
+        logger.info('prepared pool for %s in %.2fs (%d locks)',
+                    arch, time.time() - start, len(self.lockjobs[arch]))
+        self.pools[arch] = pool
         return pool
 
+    def _select(self, arch, name, flags):
+        """Selection of name in the pool for arch cached along with it."""
+        selections = self.selections.setdefault(arch, dict())
+        key = (name, flags)
+        if key not in selections:
+            selections[key] = self._prepare_pool(arch).select(name, flags)
+        return selections[key]
+
     # parse file and merge all groups
     def _parse_unneeded(self, filename):
         filename = os.path.join(self.input_dir, filename)
@@ -646,6 +900,16 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
 
     def __init__(self, *args, **kwargs):
         ToolBase.CommandLineInterface.__init__(self, args, kwargs)
+        self.session_local = threading.local()
+
+    @property
+    def session(self):
+        # Reuse connections for the several requests made per repository, but
+        # within a thread since sessions are not safe to share between threads
+        # like the workers of solv_cache_update().
+        if not hasattr(self.session_local, 'session'):
+            self.session_local.session = requests.Session()
+        return self.session_local.session
 
     def get_optparser(self):
         parser = ToolBase.CommandLineInterface.get_optparser(self)
@@ -720,40 +984,35 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         ${cmd_option_list}
         """
 
-        # only there to parse the repos
-        bs_mirrorfull = os.path.join(SCRIPT_PATH, 'bs_mirrorfull')
-        global_update = False
+        targets = []
         for prp in self.tool.repos:
             project, repo = prp.split('/')
             for arch in self.tool.architectures:
-                # TODO: refactor to common function with repo_checker.py
                 d = os.path.join(CACHEDIR, project, repo, arch)
-                if not os.path.exists(d):
-                    os.makedirs(d)
-
-                logger.debug('updating %s', d)
-                args = [bs_mirrorfull]
-                args.append('--nodebug')
-                args.append('{}/public/build/{}/{}/{}'.format(self.tool.apiurl, project, repo, arch))
-                args.append(d)
-                p = subprocess.Popen(args, stdout=subprocess.PIPE)
-                repo_update = False
-                for line in p.stdout:
-                    logger.info(line.rstrip())
-                    global_update = True
-                    repo_update = True
-
-                solv_file = os.path.join(CACHEDIR, 'repo-{}-{}-{}.solv'.format(project, repo, arch))
-                if os.path.exists(solv_file) and not repo_update:
-                    continue
-                files = [os.path.join(d, f)
-                         for f in os.listdir(d) if f.endswith('.rpm')]
-                fh = open(solv_file, 'w')
-                p = subprocess.Popen(
-                    ['rpms2solv', '-m', '-', '-0'], stdin=subprocess.PIPE, stdout=fh)
-                p.communicate('\0'.join(files))
-                p.wait()
-                fh.close()
+                targets.append(MirrorTarget(project, repo, arch, d))
+
+        # Mirror all repositories concurrently before generating solv files.
+        results = mirror_parallel(self.tool.apiurl, targets, logger)
+        failed = ['/'.join(target[:3]) for target in targets if not results[target].success]
+        if len(failed):
+            raise Exception('failed to mirror {}'.format(', '.join(failed)))
+
+        global_update = False
+        for target in targets:
+            project, repo, arch, d = target
+            repo_update = bool(results[target].output)
+            global_update = global_update or repo_update
+
+            solv_file = os.path.join(CACHEDIR, 'repo-{}-{}-{}.solv'.format(project, repo, arch))
+            if os.path.exists(solv_file) and not repo_update:
+                continue
+            binaries, built = solv_build(solv_file, d)
+            logger.debug('%s: %d binaries, %d read', solv_file, binaries, built)
+
+        count, size = binary_store_gc()
+        if count:
+            logger.info('removed %d unused binaries (%d bytes) from store', count, size)
+        solv_fragment_gc()
         return global_update
 
     def update_merge(self, nonfree):
@@ -935,13 +1194,18 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         ${cmd_option_list}
         """
 
+        return self.dump_solv(baseurl, self.options.output_dir, opts.overwrite)
+
+    def dump_solv(self, baseurl, output_dir, overwrite):
+        """Dump solv of the repository at baseurl into output_dir or stdout."""
         name = None
+        repo_style = None
         ofh = sys.stdout
-        if self.options.output_dir:
+        if output_dir:
             build, repo_style = self.dump_solv_build(baseurl)
-            name = os.path.join(self.options.output_dir, '{}.solv'.format(build))
+            name = os.path.join(output_dir, '{}.solv'.format(build))
             # For update repo name never changes so always update.
-            if not opts.overwrite and repo_style != 'update' and os.path.exists(name):
+            if not overwrite and repo_style != 'update' and os.path.exists(name):
                 logger.info("%s exists", name)
                 return name
 
@@ -951,7 +1215,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         repo = pool.add_repo(''.join(random.choice(string.letters) for _ in range(5)))
         path_prefix = 'suse/' if name and repo_style == 'build' else ''
         url = urlparse.urljoin(baseurl, path_prefix + 'repodata/repomd.xml')
-        repomd = requests.get(url)
+        repomd = self.session.get(url)
         ns = {'r': 'http://linux.duke.edu/metadata/repo'}
         root = ET.fromstring(repomd.content)
         primary_element = root.find('.//r:data[@type="primary"]', ns)
@@ -960,8 +1224,8 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
 
         # No build information in update repo to use repomd checksum in name.
         if repo_style == 'update':
-            name = os.path.join(self.options.output_dir, '{}::{}.solv'.format(build, sha256_expected))
-            if not opts.overwrite and os.path.exists(name):
+            name = os.path.join(output_dir, '{}::{}.solv'.format(build, sha256_expected))
+            if not overwrite and os.path.exists(name):
                 logger.info("%s exists", name)
                 return name
 
@@ -969,7 +1233,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             # Pre-release builds only make sense for non-update repos and once
             # releases then only relevant for next product which does not
             # consider pre-release from previous version.
-            for old_solv in glob.glob(os.path.join(self.options.output_dir, '{}::*.solv'.format(build))):
+            for old_solv in glob.glob(os.path.join(output_dir, '{}::*.solv'.format(build))):
                 os.remove(old_solv)
 
         f = tempfile.TemporaryFile()
@@ -977,27 +1241,42 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
         f.flush()
         os.lseek(f.fileno(), 0, os.SEEK_SET)
         repo.add_repomdxml(f, 0)
+        f.close()
+
+        # Spool the compressed primary to disk while hashing so that memory
+        # use does not depend on the size of the repository. Decompression is
+        # left to libsolv which reads the file incrementally.
         url = urlparse.urljoin(baseurl, path_prefix + location)
-        with requests.get(url, stream=True) as primary:
-            sha256 = hashlib.sha256(primary.content).hexdigest()
-            if sha256 != sha256_expected:
-                raise Exception('checksums do not match {} != {}'.format(sha256, sha256_expected))
-
-            content = gzip.GzipFile(fileobj=io.BytesIO(primary.content))
-            os.lseek(f.fileno(), 0, os.SEEK_SET)
-            f.write(content.read())
-            f.flush()
-            os.lseek(f.fileno(), 0, os.SEEK_SET)
-            repo.add_rpmmd(f, None, 0)
-            repo.create_stubs()
+        f = tempfile.TemporaryFile()
+        sha256 = hashlib.sha256()
+        with self.session.get(url, stream=True) as primary:
+            primary.raise_for_status()
+            for chunk in primary.iter_content(chunk_size=1024 * 1024):
+                sha256.update(chunk)
+                f.write(chunk)
+        f.flush()
+
+        sha256 = sha256.hexdigest()
+        if sha256 != sha256_expected:
+            raise Exception('checksums do not match {} != {}'.format(sha256, sha256_expected))
+
+        os.lseek(f.fileno(), 0, os.SEEK_SET)
+        # The file name only serves to detect the compression.
+        primary_file = solv.xfopen_fd(os.path.basename(location), os.dup(f.fileno()))
+        repo.add_rpmmd(primary_file, None, 0)
+        primary_file.close()
+        f.close()
+        repo.create_stubs()
 
+        if name is not None:
             ofh = open(name + '.new', 'w')
-            repo.write(ofh)
+        repo.write(ofh)
 
         if name is not None:
             # Only update file if overwrite or different.
             ofh.flush()  # Ensure entirely written before comparing.
-            if not opts.overwrite and os.path.exists(name) and filecmp.cmp(name + '.new', name, shallow=False):
+            ofh.close()
+            if not overwrite and os.path.exists(name) and filecmp.cmp(name + '.new', name, shallow=False):
                 logger.debug('file identical, skip dumping')
                 os.remove(name + '.new')
             else:
@@ -1011,7 +1290,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             return 'update-' + os.path.basename(os.path.normpath(baseurl)), 'update'
 
         url = urlparse.urljoin(baseurl, 'media.1/media')
-        with requests.get(url) as media:
+        with self.session.get(url) as media:
             for i, line in enumerate(media.iter_lines()):
                 if i != 1:
                     continue
@@ -1021,7 +1300,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             return name, 'media'
 
         url = urlparse.urljoin(baseurl, 'media.1/build')
-        with requests.get(url) as build:
+        with self.session.get(url) as build:
             name = build.content.strip()
 
         if name is not None and '-Build' in name:
@@ -1034,6 +1313,8 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
     @cmdln.option('--include-suggested', action='store_true', help='include suggested packges also')
     @cmdln.option('--locale', action='append', help='locales to inclues')
     @cmdln.option('--locales-from', metavar='FILE', help='get supported locales from product file FILE')
+    @cmdln.option('-j', '--jobs', type=int, default=1, help='number of processes solving groups in parallel')
+    @cmdln.option('--batch', action='store_true', help='solve the packages of a group at once instead of one by one')
     def do_solve(self, subcmd, opts):
         """${cmd_name}: Solve groups
 
@@ -1053,6 +1334,8 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             self.tool.ignore_broken = True
         if opts.ignore_recommended:
             self.tool.ignore_recommended = True
+        if opts.batch:
+            self.tool.solve_batch = True
         if opts.include_suggested:
             if opts.ignore_recommended:
                 raise cmdln.CmdlnUserError("--ignore-recommended and --include-suggested don't work together")
@@ -1066,6 +1349,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
                 self.tool.locales |= set([lang.text for lang in root.findall(".//linguas/language")])
 
         modules = []
+        solve = []
         # the yml parser makes an array out of everything, so
         # we loop a bit more than what we support
         for group in self.tool.output:
@@ -1073,11 +1357,13 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             settings = group[groupname]
             includes = settings.get('includes', [])
             excludes = settings.get('excludes', [])
-            self.tool.solve_module(groupname, includes, excludes)
+            solve.append((groupname, includes, excludes))
             g = self.tool.groups[groupname]
             g.conflicts = settings.get('conflicts', [])
             modules.append(g)
 
+        self.tool.solve_modules(solve, opts.jobs)
+
         # not defined for openSUSE
         overlap = self.tool.groups.get('overlap')
         for module in modules:
@@ -1104,6 +1390,8 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
     @cmdln.option('-f', '--force', action='store_true', help='continue even if build is in progress')
     @cmdln.option('-p', '--project', help='target project')
     @cmdln.option('-s', '--scope', default='all', help='scope on which to operate ({})'.format(', '.join(SCOPES)))
+    @cmdln.option('-j', '--jobs', type=int, default=1, help='number of processes solving groups in parallel')
+    @cmdln.option('--batch', action='store_true', help='solve the packages of a group at once instead of one by one')
     def do_update_and_solve(self, subcmd, opts):
         """${cmd_name}: update and solve for given scope
 
@@ -1343,6 +1631,7 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
             # Include projects from a different family if desired.
             project_family.extend(project_list_family(apiurl, family_include))
 
+        dumps = []
         for project in project_family:
             config = Config(project)
             project_config = conf.config[project]
@@ -1361,25 +1650,35 @@ class CommandLineInterface(ToolBase.CommandLineInterface):
                 if baseurl_update:
                     urls.append(urlparse.urljoin(baseurl_update, 'non-oss/'))
 
-            names = []
-            for url in urls:
-                project_display = project
-                if 'update' in url:
-                    project_display += ':Update'
-                print('-> do_dump_solv for {}/{}'.format(
-                    project_display, os.path.basename(os.path.normpath(url))))
-                logger.debug(url)
+            output_dir = os.path.join(cache_dir_solv, project)
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
 
-                self.options.output_dir = os.path.join(cache_dir_solv, project)
-                if not os.path.exists(self.options.output_dir):
-                    os.makedirs(self.options.output_dir)
+            dumps.append((project, output_dir, urls))
 
-                opts.overwrite = False
-                names.append(self.do_dump_solv('dump_solv', opts, url))
+        def dump(args):
+            project, output_dir, url = args
+            project_display = project
+            if 'update' in url:
+                project_display += ':Update'
+            print('-> do_dump_solv for {}/{}'.format(
+                project_display, os.path.basename(os.path.normpath(url))))
+            logger.debug(url)
 
-            if not len(names):
-                logger.warning('no solv files were dumped for {}'.format(project))
-                continue
+            return self.dump_solv(url, output_dir, False)
+
+        # Fetch all repositories concurrently, but merge in order.
+        tasks = [(dump_project, dump_dir, url)
+                 for dump_project, dump_dir, dump_urls in dumps for url in dump_urls]
+        workers = ThreadPool(SOLV_DUMP_WORKERS)
+        try:
+            names_all = dict(zip(tasks, workers.map(dump, tasks)))
+        finally:
+            workers.close()
+            workers.join()
+
+        for project, output_dir, urls in dumps:
+            names = [names_all[(project, output_dir, url)] for url in urls]
 
             # Merge nonfree solv with free solv or copy free solv as merged.
             merged = names[0].replace('.solv', '.merged.solv')
@@ -6,14 +6,13 @@ import cmdln
 from collections import namedtuple
 import hashlib
 from lxml import etree as ET
+import multiprocessing
 import os
 from osc.core import show_results_meta
-import pipes
 import re
-import subprocess
 import sys
-import tempfile
 
+from osclib.binary_store import binary_store_gc
 from osclib.comments import CommentAPI
 from osclib.core import binary_list
 from osclib.core import depends_on
@@ -23,14 +22,28 @@ from osclib.core import package_binary_list
 from osclib.core import request_staged
 from osclib.core import target_archs
 from osclib.cycle import CycleDetector
+from osclib.install_check import install_check
+from osclib.install_check import InstallCheckPool
+from osclib.install_check import InstallSection
 from osclib.memoize import CACHEDIR
+from osclib.mirror import mirror_parallel
+from osclib.mirror import MirrorTarget
+from osclib.solv_fragment import MirrorCorrupt
+from osclib.solv_fragment import solv_fragment_gc
 
 import ReviewBot
 
-SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 CheckResult = namedtuple('CheckResult', ('success', 'comment'))
 INSTALL_REGEX = r"^(?:can't install (.*?)|found conflict of (.*?) with (.*?)):$"
-InstallSection = namedtuple('InstallSection', ('binaries', 'text'))
+
+# RepoChecker instance inherited by groups_check() worker processes.
+_group_checker = None
+
+
+def _group_check(task):
+    project, group = task
+    _group_checker.group = group
+    return _group_checker.group_check(project, group)
 
 class RepoChecker(ReviewBot.ReviewBot):
     def __init__(self, *args, **kwargs):
@@ -43,8 +56,13 @@ class RepoChecker(ReviewBot.ReviewBot):
 
         # RepoChecker options.
         self.skip_cycle = False
+        self.cycle_incremental = False
         self.force = False
         self.limit_group = None
+        self.jobs = 1
+
+        # Target project pools kept across groups by (project, arch).
+        self.install_check_pools = {}
 
     def repository_published(self, project):
         root = ET.fromstringlist(show_results_meta(
@@ -69,6 +87,7 @@ class RepoChecker(ReviewBot.ReviewBot):
                 return
 
         comment = [build]
+        self.mirror_all([(project, arch) for arch in self.target_archs(project)])
         for arch in self.target_archs(project):
             directory_project = self.mirror(project, arch)
 
@@ -140,6 +159,11 @@ class RepoChecker(ReviewBot.ReviewBot):
         self.group = None
         self.mirrored = set()
 
+        count, size = binary_store_gc()
+        if count:
+            self.logger.info('removed {} unused binaries ({} bytes) from store'.format(count, size))
+        solv_fragment_gc()
+
         # Stores parsed install_check() results grouped by package.
         self.package_results = {}
 
@@ -230,6 +254,11 @@ class RepoChecker(ReviewBot.ReviewBot):
         self.logger.debug('requests: {} skipped, {} queued'.format(
             count_before - len(self.requests), len(self.requests)))
 
+        # Results of groups checked ahead of ensure_group().
+        self.group_results = {}
+        if self.jobs > 1 and len(self.groups) > 1:
+            self.groups_check()
+
     def ensure_group(self, request, action):
         project = action.tgt_project
         group = self.requests_map[int(request.reqid)]
@@ -240,20 +269,72 @@ class RepoChecker(ReviewBot.ReviewBot):
 
         self.logger.info('group {}'.format(group))
         self.group = group
-        self.group_pass = True
+        if group in self.group_results:
+            # Already checked by groups_check().
+            self.group_pass, comment = self.group_results.pop(group)
+        else:
+            self.group_pass, comment = self.group_check(project, group)
 
-        comment = []
-        for arch in self.target_archs(project):
-            stagings = []
-            directories = []
-            ignore = set()
+        info_extra = {'build': self.groups_build[group]}
+        if not self.group_pass:
+            # Some checks in group did not pass, post comment.
+            # Avoid identical comments with different build hash during target
+            # project build phase. Once published update regardless.
+            published = self.repository_published(project)
+            self.comment_write(state='seen', result='failed', project=group,
+                               message='\n'.join(comment).strip(), identical=True,
+                               info_extra=info_extra, info_extra_identical=published)
+        else:
+            # Post passed comment only if previous failed comment.
+            text = 'Previously reported problems have been resolved.'
+            self.comment_write(state='done', result='passed', project=group,
+                               message=text, identical=True, only_replace=True,
+                               info_extra=info_extra)
+
+        return self.group_pass
 
+    def group_stagings(self, project, group):
+        """Determine the stagings of group available for each arch of project."""
+        stagings_arch = {}
+        for arch in self.target_archs(project):
+            stagings_arch[arch] = []
             for staging in self.staging_api(project).staging_walk(group):
                 if arch not in self.target_archs(staging):
                     self.logger.debug('{}/{} not available'.format(staging, arch))
                     continue
 
-                stagings.append(staging)
+                stagings_arch[arch].append(staging)
+
+        return stagings_arch
+
+    def group_mirror_targets(self, project, stagings_arch):
+        targets = []
+        for arch in self.target_archs(project):
+            if len(stagings_arch[arch]):
+                targets.append((project, arch))
+                targets.extend((staging, arch) for staging in stagings_arch[arch])
+        return targets
+
+    def group_check(self, project, group):
+        """Perform the checks for each arch of group.
+
+        Returns whether all checks passed and the comment lines describing
+        the failures.
+
+        """
+        stagings_arch = self.group_stagings(project, group)
+
+        # Mirror all repositories involved up front since they are independent.
+        self.mirror_all(self.group_mirror_targets(project, stagings_arch))
+
+        group_pass = True
+        comment = []
+        for arch in self.target_archs(project):
+            stagings = stagings_arch[arch]
+            directories = []
+            ignore = set()
+
+            for staging in stagings:
                 directories.append(self.mirror(staging, arch))
                 ignore.update(self.ignore_from_staging(project, staging, arch))
 
@@ -273,26 +354,77 @@ class RepoChecker(ReviewBot.ReviewBot):
 
             if not all(result.success for _, result in results.items()):
                 # Not all checks passed, build comment.
-                self.group_pass = False
+                group_pass = False
                 self.result_comment(arch, results, comment)
 
-        info_extra = {'build': self.groups_build[group]}
-        if not self.group_pass:
-            # Some checks in group did not pass, post comment.
-            # Avoid identical comments with different build hash during target
-            # project build phase. Once published update regardless.
-            published = self.repository_published(project)
-            self.comment_write(state='seen', result='failed', project=group,
-                               message='\n'.join(comment).strip(), identical=True,
-                               info_extra=info_extra, info_extra_identical=published)
-        else:
-            # Post passed comment only if previous failed comment.
-            text = 'Previously reported problems have been resolved.'
-            self.comment_write(state='done', result='passed', project=group,
-                               message=text, identical=True, only_replace=True,
-                               info_extra=info_extra)
+        return group_pass, comment
 
-        return self.group_pass
+    def groups_check(self):
+        """Check all groups in a pool of worker processes.
+
+        Everything shared between groups, the mirrors, the target project
+        install check pools with all stagings layered and cycle graphs, is
+        prepared before forking to be inherited by the workers. Each worker
+        process checks one group at a time, so the group state is isolated,
+        while comments and reviews are left to ensure_group() to be written
+        one after the other. Groups whose check failed are left out of the
+        results to be checked again by ensure_group(), after the mirrors are
+        reset in case of corruption.
+
+        """
+        tasks = []
+        targets = []
+        stagings = {}
+        for group, requests in sorted(self.groups.items()):
+            project = requests[0].actions[0].tgt_project
+            tasks.append((project, group))
+            stagings[group] = self.group_stagings(project, group)
+            targets.extend(self.group_mirror_targets(project, stagings[group]))
+        self.mirror_all(targets)
+
+        layered = {}
+        for project, group in tasks:
+            for arch, stagings_arch in stagings[group].items():
+                if not len(stagings_arch):
+                    continue
+
+                layered.setdefault((project, arch), []).extend(
+                    self.mirror(staging, arch) for staging in stagings_arch)
+                if not self.skip_cycle:
+                    CycleDetector(self.staging_api(project))._get_project_graph(project, 'standard', arch)
+
+        # Layer the stagings of all groups so the provides are only built once.
+        for (project, arch), directories in layered.items():
+            try:
+                self.install_check_pool(project, arch, self.mirror(project, arch)).add(directories)
+            except MirrorCorrupt as e:
+                self.mirror_reset(e)
+                self.install_check_pool(project, arch, self.mirror(project, arch)).add(directories)
+
+        self.logger.info('checking {} groups using {} jobs'.format(len(tasks), self.jobs))
+
+        global _group_checker
+        _group_checker = self
+        workers = multiprocessing.Pool(min(self.jobs, len(tasks)))
+        corrupt = None
+        try:
+            pending = [(task, workers.apply_async(_group_check, (task,))) for task in tasks]
+            workers.close()
+            for (_, group), result in pending:
+                try:
+                    self.group_results[group] = result.get()
+                except MirrorCorrupt as e:
+                    corrupt = e
+                except Exception:
+                    self.logger.exception('group {} check failed'.format(group))
+        finally:
+            workers.terminate()
+            workers.join()
+            _group_checker = None
+
+        if corrupt:
+            # Workers leave the reset to the parent since the mirrors are shared.
+            self.mirror_reset(corrupt)
 
     def target_archs(self, project):
         archs = target_archs(self.apiurl, project)
@@ -307,27 +439,37 @@ class RepoChecker(ReviewBot.ReviewBot):
         return sorted(archs, reverse=True)
 
     def mirror(self, project, arch):
-        """Call bs_mirrorfull script to mirror packages."""
-        directory = os.path.join(CACHEDIR, project, 'standard', arch)
-        if (project, arch) in self.mirrored:
-            # Only mirror once per request batch.
-            return directory
+        """Mirror packages of project and arch unless already mirrored."""
+        self.mirror_all([(project, arch)])
+        return os.path.join(CACHEDIR, project, 'standard', arch)
+
+    def mirror_reset(self, e):
+        """Mirror everything again after corrupt binaries were removed."""
+        self.logger.warn('mirror cache reset due to corruption: {}'.format(e))
+        targets = sorted(self.mirrored)
+        self.mirrored = set()
+        self.mirror_all(targets)
 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+    def mirror_all(self, targets):
+        """Mirror list of (project, arch) concurrently."""
+        targets_mirror = {}
+        for project, arch in targets:
+            # Only mirror once per request batch.
+            if (project, arch) not in self.mirrored:
+                directory = os.path.join(CACHEDIR, project, 'standard', arch)
+                targets_mirror[MirrorTarget(project, 'standard', arch, directory)] = (project, arch)
 
-        script = os.path.join(SCRIPT_PATH, 'bs_mirrorfull')
-        path = '/'.join((project, 'standard', arch))
-        url = '{}/public/build/{}'.format(self.apiurl, path)
-        parts = ['LC_ALL=C', 'perl', script, '--nodebug', url, directory]
-        parts = [pipes.quote(part) for part in parts]
+        results = mirror_parallel(self.apiurl, sorted(targets_mirror), self.logger)
 
-        self.logger.info('mirroring {}'.format(path))
-        if os.system(' '.join(parts)):
-            raise Exception('failed to mirror {}'.format(path))
+        failed = []
+        for target, result in results.items():
+            if result.success:
+                self.mirrored.add(targets_mirror[target])
+            else:
+                failed.append('/'.join(target[:3]))
 
-        self.mirrored.add((project, arch))
-        return directory
+        if len(failed):
+            raise Exception('failed to mirror {}'.format(', '.join(sorted(failed))))
 
     def ignore_from_staging(self, project, staging, arch):
         """Determine the target project binaries to ingore in favor of staging."""
@@ -352,54 +494,56 @@ class RepoChecker(ReviewBot.ReviewBot):
     def install_check(self, project, directories, arch, ignore=[], whitelist=[], parse=False):
         self.logger.info('install check: start')
 
-        with tempfile.NamedTemporaryFile() as ignore_file:
-            # Print ignored rpms on separate lines in ignore file.
-            for item in ignore:
-                ignore_file.write(item + '\n')
-            ignore_file.flush()
-
-            directory_project = directories.pop(0) if len(directories) > 1 else None
+        directory_project = directories.pop(0) if len(directories) > 1 else None
+        try:
+            sections = self.install_check_sections(project, directories, directory_project, arch, ignore, whitelist)
+        except MirrorCorrupt as e:
+            if _group_checker is self:
+                # Within a groups_check() worker which leaves the reset to the parent.
+                raise
 
-            # Invoke repo_checker.pl to perform an install check.
-            script = os.path.join(SCRIPT_PATH, 'repo_checker.pl')
-            parts = ['LC_ALL=C', 'perl', script, arch, ','.join(directories),
-                     '-f', ignore_file.name, '-w', ','.join(whitelist)]
-            if directory_project:
-                parts.extend(['-r', directory_project])
+            self.mirror_reset(e)
+            sections = self.install_check_sections(project, directories, directory_project, arch, ignore, whitelist)
 
-            parts = [pipes.quote(part) for part in parts]
-            p = subprocess.Popen(' '.join(parts), shell=True,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE, close_fds=True)
-            stdout, stderr = p.communicate()
-
-        if p.returncode:
+        if len(sections):
             self.logger.info('install check: failed')
-            if p.returncode == 126:
-                self.logger.warn('mirror cache reset due to corruption')
-                self.mirrored = set()
-            elif parse:
-                # Parse output for later consumption for posting comments.
-                sections = self.install_check_parse(stdout)
+            if parse:
+                # Keep sections for later consumption for posting comments.
                 self.install_check_sections_group(parse, arch, sections)
 
             # Format output as markdown comment.
-            parts = []
-
-            stdout = stdout.strip()
-            if stdout:
-                parts.append('<pre>\n' + stdout + '\n' + '</pre>\n')
-            stderr = stderr.strip()
-            if stderr:
-                parts.append('<pre>\n' + stderr + '\n' + '</pre>\n')
-
+            text = ''.join(section.text for section in sections).strip()
             header = '### [install check & file conflicts](/package/view_file/{}:Staging/dashboard/repo_checker)\n\n'.format(project)
-            return CheckResult(False, header + ('\n' + ('-' * 80) + '\n\n').join(parts))
-
+            return CheckResult(False, header + '<pre>\n' + text + '\n' + '</pre>\n')
 
         self.logger.info('install check: passed')
         return CheckResult(True, None)
 
+    def install_check_sections(self, project, directories, directory_project, arch, ignore, whitelist):
+        if directory_project:
+            pool = self.install_check_pool(project, arch, directory_project)
+            return pool.check(directories, ignore, whitelist)
+
+        return install_check(arch, directories, whitelist=whitelist)
+
+    def install_check_pool(self, project, arch, directory):
+        """Target project pool reused until the project build state changes."""
+        build = ET.fromstringlist(show_results_meta(
+            self.apiurl, project, multibuild=True, repository=['standard'])).get('state')
+        # Include the mirror modification time since it may lag behind.
+        state = (build, os.path.getmtime(directory))
+
+        cached = self.install_check_pools.get((project, arch))
+        if cached and cached[0] == state:
+            return cached[1]
+
+        self.logger.info('install check: loading {}/{}'.format(project, arch))
+        # Drop the previous pool before loading the new one.
+        self.install_check_pools.pop((project, arch), None)
+        pool = InstallCheckPool(arch, directory)
+        self.install_check_pools[(project, arch)] = (state, pool)
+        return pool
+
     def install_check_sections_group(self, project, arch, sections):
         _, binary_map = package_binary_list(self.apiurl, project, 'standard', arch)
 
@@ -450,7 +594,7 @@ class RepoChecker(ReviewBot.ReviewBot):
         for staging in stagings:
             first = True
             for index, (cycle, new_edges, new_packages) in enumerate(
-                cycle_detector.cycles(staging, arch=arch), start=1):
+                cycle_detector.cycles(staging, arch=arch, incremental=self.cycle_incremental), start=1):
                 if not new_packages:
                     continue
 
@@ -618,8 +762,12 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
         parser = ReviewBot.CommandLineInterface.get_optparser(self)
 
         parser.add_option('--skip-cycle', action='store_true', help='skip cycle check')
+        parser.add_option('--cycle-incremental', action='store_true',
+                          help='check cycles of the staging packages overlaid onto the project graph')
         parser.add_option('--force', action='store_true', help='force review even if project is not ready')
         parser.add_option('--limit-group', metavar='GROUP', help='only review requests in specific group')
+        parser.add_option('-j', '--jobs', type='int', default=1, metavar='JOBS',
+                          help='number of staging groups to check in parallel')
 
         return parser
 
@@ -628,9 +776,11 @@ class CommandLineInterface(ReviewBot.CommandLineInterface):
 
         if self.options.skip_cycle:
             bot.skip_cycle = self.options.skip_cycle
+        bot.cycle_incremental = self.options.cycle_incremental
 
         bot.force = self.options.force
         bot.limit_group = self.options.limit_group
+        bot.jobs = self.options.jobs
 
         return bot
 
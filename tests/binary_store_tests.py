@@ -0,0 +1,70 @@
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from osclib.binary_store import binary_store_gc
+from osclib.binary_store import binary_store_populated
+
+
+class TestBinaryStore(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.directory = tempfile.mkdtemp()
+        self.store = os.path.join(self.directory, 'store')
+        self.mirror = os.path.join(self.directory, 'mirror')
+        os.makedirs(os.path.join(self.store, 'ab'))
+        os.makedirs(os.path.join(self.store, 'cd'))
+        os.makedirs(self.mirror)
+
+        for name in ('ab01-a.rpm', 'cd01-b.rpm'):
+            with open(os.path.join(self.store, name[:2], name), 'w') as f:
+                f.write(name)
+        os.link(os.path.join(self.store, 'ab', 'ab01-a.rpm'), os.path.join(self.mirror, 'ab01-a.rpm'))
+        # Lock file created by bs_mirrorfull.
+        open(os.path.join(self.store, '.lock'), 'w').close()
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(self.directory)
+
+    def test_gc(self):
+        self.assertEqual(binary_store_gc(self.store), (1, len('cd01-b.rpm')))
+        self.assertTrue(os.path.exists(os.path.join(self.store, 'ab', 'ab01-a.rpm')))
+        self.assertFalse(os.path.exists(os.path.join(self.store, 'cd')))
+
+        os.unlink(os.path.join(self.mirror, 'ab01-a.rpm'))
+        self.assertEqual(binary_store_gc(self.store), (1, len('ab01-a.rpm')))
+        self.assertEqual(os.listdir(self.store), ['.lock'])
+
+    def test_missing(self):
+        self.assertEqual(binary_store_gc(os.path.join(self.directory, 'missing')), (0, 0))
+
+    def test_populated(self):
+        self.assertTrue(binary_store_populated(self.store))
+        self.assertFalse(binary_store_populated(os.path.join(self.directory, 'missing')))
+
+        # Empty prefix directory left by bs_mirrorfull failing to store.
+        shutil.rmtree(self.store)
+        os.makedirs(os.path.join(self.store, 'ab'))
+        self.assertFalse(binary_store_populated(self.store))
+
+    def test_lock(self):
+        results = []
+        with open(os.path.join(self.store, '.lock'), 'w') as lock:
+            # Lock held by bs_mirrorfull populating the store.
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            thread = threading.Thread(target=lambda: results.append(binary_store_gc(self.store)))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self.assertTrue(os.path.exists(os.path.join(self.store, 'cd')))
+
+        thread.join()
+        self.assertEqual(results, [(1, len('cd01-b.rpm'))])
+
+
+if __name__ == '__main__':
+    unittest.main()
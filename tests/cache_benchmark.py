@@ -0,0 +1,83 @@
+"""
+Compare url pattern matching and latest_updated parsing in osclib.cache against
+the previous linear implementation using a recorded url corpus.
+
+Usage: python -m tests.cache_benchmark [corpus] [iterations]
+
+A corpus can be recorded by running any tool with --debug and extracting the
+urls from the CACHE_* lines printed to stderr.
+"""
+
+from __future__ import print_function
+
+import datetime
+import os
+import re
+import sys
+import timeit
+import urllib
+
+from osclib.cache import Cache
+from osclib.cache import CacheMatcher
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'fixtures', 'benchmark', 'cache-urls.txt')
+
+# Additional patterns registered by metrics.py.
+PATTERNS_METRICS = {
+    '/search/request': sys.maxint,
+    '/source/[^/]+/dashboard/_history': sys.maxint,
+    '/source/[^/]+/dashboard/[^/]+\?rev=.*': sys.maxint,
+}
+
+
+def match_linear(patterns, path):
+    """Previous Cache.match() implementation."""
+    for pattern in patterns:
+        match = pattern.match(path)
+        if match:
+            return (pattern.pattern,
+                    match.group(1) if len(match.groups()) > 0 else None)
+    return (False, None)
+
+
+def main(corpus, iterations):
+    with open(corpus) as f:
+        paths = [Cache.spliturl(urllib.unquote(line.strip()))[1] for line in f if line.strip()]
+
+    patterns = dict(Cache.PATTERNS)
+    patterns.update(PATTERNS_METRICS)
+    compiled = [re.compile(pattern) for pattern in patterns]
+    matcher = CacheMatcher(patterns)
+
+    for path in paths:
+        assert match_linear(compiled, path) == matcher.match(path), path
+
+    print('{:,} urls, {:,} patterns, {} iterations'.format(len(paths), len(patterns), iterations))
+
+    linear = timeit.timeit(lambda: [match_linear(compiled, path) for path in paths], number=iterations)
+    dispatch = timeit.timeit(lambda: [matcher.match(path) for path in paths], number=iterations)
+    print('match linear:     {:.3f}s'.format(linear))
+    print('match dispatch:   {:.3f}s ({:.1f}x)'.format(dispatch, linear / dispatch))
+
+    # Each url with project context evaluates the latest_updated timestamp.
+    timestamps = ['2018-03-{:02}T10:00:00Z'.format(day) for day in range(1, 29)]
+    lookups = [timestamps[i % len(timestamps)] for i in range(len(paths))]
+    parse = timeit.timeit(
+        lambda: [datetime.datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ') for t in lookups],
+        number=iterations)
+
+    def parse_memoized():
+        for t in lookups:
+            if t not in Cache.last_updated_parsed:
+                Cache.last_updated_parsed[t] = datetime.datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ')
+            Cache.last_updated_parsed[t]
+
+    memoized = timeit.timeit(parse_memoized, number=iterations)
+    print('strptime:         {:.3f}s'.format(parse))
+    print('strptime memoized {:.3f}s ({:.1f}x)'.format(memoized, parse / memoized))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else CORPUS,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,297 @@
+import os
+import re
+import shutil
+from StringIO import StringIO
+import time
+import unittest
+
+from mock import MagicMock
+from multiprocessing.pool import ThreadPool
+from mock import patch
+
+from osclib.cache import Cache
+from osclib.cache import CacheBackendFile
+from osclib.cache import CacheBackendSQLite
+from osclib.cache import CacheMatcher
+from osclib.cache import CacheMemory
+
+
+CACHE_DIR = '/tmp/osrt-cache-test'
+URL = 'https://api.example.com/source/openSUSE:Factory/_meta'
+URL_OTHER = 'https://api.example.com/source/openSUSE:Factory:Staging:A/_meta'
+
+
+class CacheBackendChecks(object):
+    def setUp(self):
+        """Initialize the environment."""
+        self.backend = self.BACKEND(CACHE_DIR)
+
+    def tearDown(self):
+        """Clean the environment."""
+        self.backend.close()
+        if os.path.exists(CACHE_DIR):
+            shutil.rmtree(CACHE_DIR)
+
+    def test_save_load(self):
+        self.assertIsNone(self.backend.mtime(URL, 'openSUSE:Factory'))
+        self.assertIsNone(self.backend.project_mtime(URL, 'openSUSE:Factory'))
+
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertIsNotNone(self.backend.mtime(URL, 'openSUSE:Factory'))
+        self.assertIsNotNone(self.backend.project_mtime(URL, 'openSUSE:Factory'))
+        self.assertEqual(self.backend.load(URL, 'openSUSE:Factory').read(), '<project/>\n')
+
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project name="a"/>\n')
+        self.assertEqual(self.backend.load(URL, 'openSUSE:Factory').read(), '<project name="a"/>\n')
+
+    def test_validators(self):
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertEqual(self.backend.validators(URL, 'openSUSE:Factory'), {})
+
+        validators = {'ETag': 'W/"abc"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n', validators)
+        self.assertEqual(self.backend.validators(URL, 'openSUSE:Factory'), validators)
+
+        mtime = self.backend.mtime(URL, 'openSUSE:Factory')
+        time.sleep(0.01)
+        self.backend.touch(URL, 'openSUSE:Factory')
+        self.assertGreater(self.backend.mtime(URL, 'openSUSE:Factory'), mtime)
+        self.assertEqual(self.backend.load(URL, 'openSUSE:Factory').read(), '<project/>\n')
+
+        self.assertTrue(self.backend.remove(URL, 'openSUSE:Factory'))
+        self.assertEqual(self.backend.validators(URL, 'openSUSE:Factory'), {})
+
+    def test_remove(self):
+        self.assertFalse(self.backend.remove(URL, 'openSUSE:Factory'))
+
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertTrue(self.backend.remove(URL, 'openSUSE:Factory'))
+        self.assertIsNone(self.backend.mtime(URL, 'openSUSE:Factory'))
+
+    def test_remove_project(self):
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.backend.save(URL_OTHER, 'openSUSE:Factory:Staging:A', '/source/([^/]+)/_meta$', '<project/>\n')
+
+        self.assertTrue(self.backend.remove_project('https://api.example.com', 'openSUSE:Factory'))
+        self.assertFalse(self.backend.remove_project('https://api.example.com', 'openSUSE:Factory'))
+        self.assertIsNone(self.backend.mtime(URL, 'openSUSE:Factory'))
+        self.assertIsNotNone(self.backend.mtime(URL_OTHER, 'openSUSE:Factory:Staging:A'))
+
+
+class TestCacheBackendFile(CacheBackendChecks, unittest.TestCase):
+    BACKEND = CacheBackendFile
+
+    def test_threads(self):
+        # Saving concurrently into a new project directory must not fail.
+        urls = ['{}?{}'.format(URL, i) for i in range(16)]
+        pool = ThreadPool(8)
+        try:
+            pool.map(lambda url: self.backend.save(url, 'openSUSE:Factory', '', url, {'ETag': url}), urls)
+        finally:
+            pool.close()
+            pool.join()
+
+        for url in urls:
+            self.assertEqual(self.backend.load(url, 'openSUSE:Factory').read(), url)
+        self.assertEqual(len(os.listdir(self.backend.path(URL, 'openSUSE:Factory'))), 2 * len(urls))
+
+    def test_project_mtime(self):
+        # Only new entries refresh the project, not replacing existing ones.
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        mtime = time.time() - 60
+        os.utime(self.backend.path(URL, 'openSUSE:Factory'), (mtime, mtime))
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project name="a"/>\n',
+                          {'ETag': 'W/"abc"'})
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertEqual(self.backend.project_mtime(URL, 'openSUSE:Factory'), mtime)
+
+        self.backend.save(URL + '?rev=1', 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertGreater(self.backend.project_mtime(URL, 'openSUSE:Factory'), mtime)
+
+
+class TestCacheBackendSQLite(CacheBackendChecks, unittest.TestCase):
+    BACKEND = CacheBackendSQLite
+
+    def test_single_file(self):
+        self.backend.save(URL, 'openSUSE:Factory', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.backend.save(URL_OTHER, 'openSUSE:Factory:Staging:A', '/source/([^/]+)/_meta$', '<project/>\n')
+        self.assertEqual(set(os.listdir(CACHE_DIR)) - set(['cache.db-wal', 'cache.db-shm']),
+                         set(['cache.db']))
+
+    def test_fork(self):
+        connection = self.backend.connection()
+        self.assertIs(self.backend.connection(), connection)
+
+        # A forked process opens its own connection.
+        with patch('osclib.cache.os.getpid', MagicMock(return_value=-1)):
+            self.assertIsNot(self.backend.connection(), connection)
+
+
+class TestCacheMemory(unittest.TestCase):
+    def test_get_put(self):
+        memory = CacheMemory(100)
+        self.assertIsNone(memory.get(URL, 60))
+        memory.put(URL, 'openSUSE:Factory', time.time(), 'a' * 10)
+        self.assertEqual(memory.get(URL, 60), 'a' * 10)
+        self.assertEqual((memory.hits, memory.misses), (1, 1))
+
+        # Expired entries are dropped.
+        memory.put(URL, 'openSUSE:Factory', time.time() - 120, 'a' * 10)
+        self.assertIsNone(memory.get(URL, 60))
+        self.assertEqual(memory.size, 0)
+
+    def test_evict(self):
+        memory = CacheMemory(100)
+        memory.put(URL, 'openSUSE:Factory', time.time(), 'a' * 40)
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', time.time(), 'b' * 40)
+        memory.get(URL, 60)
+        memory.put(URL + '?other', 'openSUSE:Factory', time.time(), 'c' * 40)
+        self.assertEqual(memory.size, 80)
+        self.assertIsNone(memory.get(URL_OTHER, 60))
+        self.assertEqual(memory.get(URL, 60), 'a' * 40)
+
+        # Too large to be kept at all.
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', time.time(), 'b' * 101)
+        self.assertIsNone(memory.get(URL_OTHER, 60))
+
+    def test_size_max(self):
+        memory = CacheMemory(100)
+        memory.put(URL, 'openSUSE:Factory', time.time(), 'a' * 40)
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', time.time(), 'b' * 40)
+
+        # Lowering the limit evicts immediately.
+        memory.size_max = 50
+        self.assertEqual(memory.size, 40)
+        self.assertIsNone(memory.get(URL, 60))
+        self.assertEqual(memory.get(URL_OTHER, 60), 'b' * 40)
+
+    def test_root(self):
+        memory = CacheMemory(100)
+        parse = MagicMock(side_effect=lambda text: [text])
+        data = MagicMock()
+        data.read.return_value = '<a/>'
+
+        # Without an entry the data is parsed every time.
+        self.assertEqual(memory.root(URL, parse, data), ['<a/>'])
+        self.assertEqual(memory.root(URL, parse, data), ['<a/>'])
+        self.assertEqual(parse.call_count, 2)
+
+        memory.put(URL, 'openSUSE:Factory', time.time(), '<b/>')
+        root = memory.root(URL, parse, data)
+        self.assertEqual(root, ['<b/>'])
+        self.assertIs(memory.root(URL, parse, data), root)
+        self.assertEqual(parse.call_count, 3)
+        self.assertEqual(memory.size, 8)
+
+        # Roots are dropped along with the entry.
+        memory.remove(URL)
+        self.assertEqual(memory.size, 0)
+        self.assertEqual(memory.roots, {})
+
+    def test_remove_project(self):
+        memory = CacheMemory(100)
+        memory.put(URL, 'openSUSE:Factory', time.time(), 'a')
+        memory.put(URL_OTHER, 'openSUSE:Factory:Staging:A', time.time(), 'b')
+        memory.remove_project('https://api.example.com', 'openSUSE:Factory')
+        self.assertIsNone(memory.get(URL, 60))
+        self.assertEqual(memory.get(URL_OTHER, 60), 'b')
+
+
+class TestCacheSrcmd5(unittest.TestCase):
+    APIURL = 'https://api.example.com'
+    LISTING = APIURL + '/source/openSUSE:Factory:Staging/dashboard'
+    FILE = LISTING + '/config'
+    PROJECT = 'openSUSE:Factory:Staging'
+
+    def setUp(self):
+        """Initialize the environment."""
+        self.cache_dir = Cache.CACHE_DIR
+        Cache.CACHE_DIR = CACHE_DIR
+        Cache.matcher = CacheMatcher(Cache.PATTERNS)
+        Cache.memory.clear()
+        # Avoid expiring the project based on the remote latest updated.
+        Cache.last_updated[self.APIURL] = {'__oldest': '2000-01-01T00:00:00Z'}
+        self.config = patch.dict('osclib.cache.conf.config', {'debug': False})
+        self.config.start()
+
+    def tearDown(self):
+        """Clean the environment."""
+        Cache.delete_all()
+        Cache.CACHE_DIR = self.cache_dir
+        del Cache.last_updated[self.APIURL]
+        self.config.stop()
+
+    def listing(self, srcmd5):
+        Cache.put(self.LISTING, StringIO(
+            '<directory name="dashboard" srcmd5="{}"><entry name="config"/></directory>'.format(srcmd5)))
+
+    def expire(self, url):
+        mtime = time.time() - 2 * Cache.TTL_LONG
+        os.utime(Cache.backend().path(url, self.PROJECT, include_file=True), (mtime, mtime))
+        Cache.memory.clear()
+
+    def test_srcmd5(self):
+        self.listing('abc')
+        Cache.put(self.FILE, StringIO('a=1\n'))
+        self.assertEqual(Cache.backend().validators(self.LISTING, self.PROJECT), {'srcmd5': 'abc'})
+        self.assertEqual(Cache.backend().validators(self.FILE, self.PROJECT), {'srcmd5': 'abc'})
+        self.assertEqual(Cache.conditional_headers(self.FILE), {})
+
+        # An expired file is valid while the listing has the same srcmd5.
+        self.expire(self.FILE)
+        revalidated_count = Cache.revalidated_count
+        self.assertEqual(Cache.get(self.FILE).read(), 'a=1\n')
+        self.assertEqual(Cache.revalidated_count, revalidated_count + 1)
+
+        self.expire(self.FILE)
+        self.listing('def')
+        self.assertIsNone(Cache.get(self.FILE))
+
+        # Unless the listing itself has expired.
+        Cache.put(self.FILE, StringIO('a=2\n'))
+        self.expire(self.FILE)
+        self.expire(self.LISTING)
+        self.assertIsNone(Cache.get(self.FILE))
+
+
+class TestCacheMatcher(unittest.TestCase):
+    PATHS = [
+        '/source',
+        '/source/openSUSE:Factory',
+        '/source/openSUSE:Factory?view=info',
+        '/source/openSUSE:Factory/_meta',
+        '/source/openSUSE:Factory/gcc7/_meta',
+        '/source/openSUSE:Factory:Staging/dashboard/config?rev=12',
+        '/build/openSUSE:Factory/_result',
+        '/build/openSUSE:Factory/standard/x86_64/_builddepinfo',
+        '/build/openSUSE:Factory:Staging:A/standard/x86_64/_builddepinfo',
+        '/group/factory-staging',
+        '/request/123?cmd=changestate&newstate=accepted',
+        "/search/package?match=[@project='openSUSE:Factory']",
+        '/statistics/latest_updated',
+        '/comments/project/openSUSE:Factory',
+    ]
+
+    def assertMatchesLinear(self, patterns):
+        matcher = CacheMatcher(patterns)
+        for path in self.PATHS:
+            expected = (False, None)
+            for pattern in patterns:
+                match = re.match(pattern, path)
+                if match:
+                    expected = (pattern, match.group(1) if len(match.groups()) > 0 else None)
+                    break
+
+            self.assertEqual(matcher.match(path), expected, path)
+
+    def test_default(self):
+        self.assertMatchesLinear(list(Cache.PATTERNS))
+
+    def test_wildcard(self):
+        # Patterns as used by obs_clone.py.
+        self.assertMatchesLinear(['/source/[^/]+/[^/]+/[^/]+?rev', '.*'])
+        self.assertMatchesLinear(['/group/[^/?]+$', '/(?:source|build)/([^/]+)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Compare the recursive Tarjan implementation previously used by Graph.cycles()
+against the iterative implementation over the CSR form of the graph.
+
+Usage: python -m tests.cycle_benchmark [_builddepinfo]
+
+The _builddepinfo of a project can be recorded using:
+
+    osc api /build/openSUSE:Factory/standard/x86_64/_builddepinfo > builddepinfo.xml
+
+Without one a random graph of similar size to Factory is generated.
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from osclib.cycle import CycleDetector
+from osclib.cycle import Graph
+from osclib.cycle import Package
+
+
+def cycles_recursive(graph):
+    """Tarjan implementation previously used by Graph.cycles()."""
+    index = [0]
+    path = []
+    cycles = []
+
+    v_index = {}
+    v_lowlink = {}
+
+    def scc(node, v):
+        v_index[v], v_lowlink[v] = index[0], index[0]
+        index[0] += 1
+        path.append(node)
+
+        for succ in graph.adj.get(node, []):
+            w = graph[succ]
+            if w not in v_index:
+                scc(succ, w)
+                v_lowlink[v] = min(v_lowlink[v], v_lowlink[w])
+            elif succ in path:
+                v_lowlink[v] = min(v_lowlink[v], v_index[w])
+
+        if v_index[v] == v_lowlink[v]:
+            i = path.index(node)
+            path[:], cycle = path[:i], frozenset(path[i:])
+            if len(cycle) > 1:
+                cycles.append(cycle)
+
+    for node in sorted(graph):
+        v = graph[node]
+        if not getattr(v, 'index', 0):
+            scc(node, v)
+    return frozenset(cycles)
+
+
+def random_graph(size=15000, degree=12, back=0.002):
+    """Mostly acyclic graph with a few back edges creating cycles."""
+    generator = random.Random(size)
+    graph = Graph()
+    graph.add_nodes_from((i, Package(pkg=i)) for i in range(size))
+    for i in range(1, size):
+        graph.add_edges_from((i, generator.randrange(i)) for _ in range(degree))
+        if generator.random() < back:
+            graph.add_edge(generator.randrange(i), i)
+    return graph
+
+
+def measure(function, graph):
+    start = time.time()
+    try:
+        result = function(graph)
+    except RuntimeError as e:
+        result = e
+    return time.time() - start, result
+
+
+def main(filename=None):
+    if filename:
+        with open(filename) as f:
+            graph = CycleDetector(None)._get_builddepinfo_graph(None, None, None, f.read())
+    else:
+        graph = random_graph()
+
+    edges = sum(len(adj) for adj in graph.adj.values())
+    print('{:,} nodes, {:,} edges'.format(len(graph), edges))
+
+    # Deep dependency chains need a larger recursion limit.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), len(graph) + 100))
+
+    recursive, expected = measure(cycles_recursive, graph)
+    print('recursive: {:.3f}s'.format(recursive))
+
+    iterative, result = measure(Graph.cycles, graph)
+    print('iterative: {:.3f}s ({:.1f}x)'.format(iterative, recursive / iterative))
+
+    print('{} cycles, {} largest, results {}'.format(
+        len(result), max([len(cycle) for cycle in result] or [0]),
+        'match' if result == expected else 'DIFFER'))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,210 @@
+from array import array
+import random
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+from mock import patch
+
+from osclib.cycle import CycleDetector
+from osclib.cycle import Graph
+from osclib.cycle import strongly_connected_components
+
+
+PACKAGE = '<package name="{0}"><source>{0}</source>{1}{2}</package>'
+
+
+def builddepinfo(packages, subpkgs={}):
+    """Build a _builddepinfo document from a dictionary of package dependencies.
+
+    Packages provide a subpackage of the same name unless listed in subpkgs.
+
+    """
+    return '<builddepinfo>{}</builddepinfo>'.format(''.join(
+        PACKAGE.format(name,
+                       ''.join('<subpkg>{}</subpkg>'.format(s) for s in subpkgs.get(name, [name])),
+                       ''.join('<pkgdep>{}</pkgdep>'.format(d) for d in deps))
+        for name, deps in sorted(packages.items())))
+
+
+PROJECT = builddepinfo({'a': ['b'], 'b': ['a'], 'c': ['a']})
+STAGING = builddepinfo({'a': ['b'], 'b': ['a'], 'c': ['d'], 'd': ['c']})
+
+
+class TestGraph(unittest.TestCase):
+    def test_dump_load(self):
+        graph = Graph()
+        graph.add_nodes_from((name, None) for name in 'abc')
+        graph.add_edges_from([('a', 'b'), ('b', 'a'), ('c', 'a')])
+
+        graph.subpkgs = {'a': 'a', 'b': 'b', 'c': 'c'}
+        graph.deps = {'a': set(['b']), 'b': set(['a']), 'c': set(['a'])}
+
+        compact = graph.dump()
+        self.assertEqual(compact[:2], (['a', 'b', 'c'], [(1,), (0,), (0,)]))
+
+        loaded = Graph.load(*compact)
+        self.assertEqual(loaded.adj, graph.adj)
+        self.assertEqual(loaded.subpkgs, graph.subpkgs)
+        self.assertEqual(loaded.deps, graph.deps)
+        self.assertEqual(loaded.cycles(), frozenset([frozenset(['a', 'b'])]))
+
+    def test_cycles_deep(self):
+        # Deeper than the recursion limit.
+        graph = Graph()
+        graph.add_nodes_from((i, None) for i in range(5000))
+        graph.add_edges_from((i, i + 1) for i in range(4999))
+        self.assertEqual(graph.cycles(), frozenset())
+
+        graph.add_edge(4999, 0)
+        graph.add_edge(4999, 4999)
+        self.assertEqual(graph.cycles(), frozenset([frozenset(range(5000))]))
+        self.assertEqual(graph.cycles(nodes=[4999]), graph.cycles())
+
+    def test_strongly_connected_components(self):
+        # 0 -> 1 -> 2 -> 0, 1 -> 3 -> 4 -> 3, 5 -> 5
+        offsets = array('i', [0, 1, 3, 4, 5, 6, 7])
+        targets = array('i', [1, 2, 3, 0, 4, 3, 5])
+        components = list(strongly_connected_components(offsets, targets, range(6)))
+        self.assertEqual(sorted(sorted(c) for c in components), [[0, 1, 2], [3, 4], [5]])
+        self.assertEqual(list(strongly_connected_components(offsets, targets, [3])), [[4, 3]])
+
+
+class TestCycleDetector(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.directory = tempfile.mkdtemp()
+        self.patcher = patch('osclib.cycle.GRAPH_CACHEDIR', self.directory)
+        self.patcher.start()
+        CycleDetector._project_graphs.clear()
+
+    def tearDown(self):
+        """Clean the environment."""
+        self.patcher.stop()
+        CycleDetector._project_graphs.clear()
+        shutil.rmtree(self.directory)
+
+    def detector(self, project=PROJECT, build_state='1'):
+        detector = CycleDetector(MagicMock(project='openSUSE:Factory'))
+        detector._build_state = MagicMock(return_value=build_state)
+        detector._builddepinfo = MagicMock(side_effect=lambda p, repository, arch:
+                                           project if p == 'openSUSE:Factory' else STAGING)
+        return detector
+
+    def project_graph(self, detector):
+        return detector._get_project_graph('openSUSE:Factory', 'standard', 'x86_64')
+
+    def test_cycles(self):
+        cycles = list(self.detector().cycles('openSUSE:Factory:Staging:A'))
+        self.assertEqual(cycles, [(frozenset(['c', 'd']), [('c', 'd'), ('d', 'c')], True)])
+
+    def test_cycles_modes(self):
+        # Both modes given the same staging _builddepinfo as by repo_checker.
+        detector = self.detector()
+        self.assertEqual(list(detector.cycles('openSUSE:Factory:Staging:A', incremental=True)),
+                         list(detector.cycles('openSUSE:Factory:Staging:A')))
+
+    def test_overlay_unchanged(self):
+        detector = self.detector()
+        project_graph, _ = self.project_graph(detector)
+        packages = detector._builddepinfo_packages(STAGING)
+        graph, affected = detector._overlay_graph(project_graph, packages)
+        # The a and b packages are identical to those of the project.
+        self.assertEqual(affected, set(['c', 'd']))
+        self.assertIs(graph.adj['a'], project_graph.adj['a'])
+
+    def test_cycles_incremental(self):
+        project = {'a': ['b'], 'b': ['a'], 'c': ['a'], 'e': ['f'], 'f': ['e', 'g'], 'g': ['e'],
+                   'h': ['lib'], 'i': ['h'], 'lib': [], 'x': ['y'], 'y': ['x']}
+        delta = {
+            # New cycle with a project package.
+            'c': ['d'], 'd': ['c'],
+            # Broken project cycle leaving a smaller one.
+            'g': [],
+            # Subpackage moved to a package depending on h.
+            'lib': [], 'j': ['i'],
+            # Unchanged project cycle.
+            'x': ['y'],
+        }
+        subpkgs = {'lib': [], 'j': ['j', 'lib']}
+        full = dict(project, **delta)
+
+        detector = self.detector()
+        detector._builddepinfo.side_effect = lambda p, repository, arch: {
+            'openSUSE:Factory': builddepinfo(project),
+            'full': builddepinfo(full, subpkgs),
+            'delta': builddepinfo(delta, subpkgs),
+        }[p]
+
+        expected = sorted(detector.cycles('full'), key=lambda cycle: sorted(cycle[0]))
+        self.assertEqual([sorted(cycle[0]) for cycle in expected],
+                         [['c', 'd'], ['e', 'f'], ['h', 'i', 'j']])
+        self.assertEqual(sorted(detector.cycles('delta', incremental=True),
+                                key=lambda cycle: sorted(cycle[0])), expected)
+
+    def test_cycles_incremental_random(self):
+        # Compare against a full run for changes made to random graphs.
+        for seed in range(20):
+            generator = random.Random(seed)
+            names = ['p{}'.format(i) for i in range(30)]
+            project = dict((name, generator.sample(names, 2)) for name in names)
+            delta = dict((name, generator.sample(names, generator.randrange(3)))
+                         for name in generator.sample(names, 5))
+            full = dict(project, **delta)
+
+            CycleDetector._project_graphs.clear()
+            detector = self.detector(build_state=str(seed))
+            detector._builddepinfo.side_effect = lambda p, repository, arch: {
+                'openSUSE:Factory': builddepinfo(project),
+                'full': builddepinfo(full),
+                'delta': builddepinfo(delta),
+            }[p]
+
+            key = lambda cycle: sorted(cycle[0])
+            self.assertEqual(sorted(detector.cycles('delta', incremental=True), key=key),
+                             sorted(detector.cycles('full'), key=key), 'seed {}'.format(seed))
+
+    def test_project_graph_cached(self):
+        with patch.object(Graph, 'cycles', autospec=True, side_effect=Graph.cycles) as cycles:
+            graph, project_cycles = self.project_graph(self.detector())
+            self.assertEqual(project_cycles, frozenset([frozenset(['a', 'b'])]))
+            self.assertEqual(cycles.call_count, 1)
+
+            # Reused within the process by other detectors without fetching.
+            detector = self.detector()
+            self.assertIs(self.project_graph(detector)[0], graph)
+            self.assertFalse(detector._builddepinfo.called)
+
+            # Loaded from disk by later runs without fetching.
+            CycleDetector._project_graphs.clear()
+            detector = self.detector()
+            loaded, loaded_cycles = self.project_graph(detector)
+            self.assertEqual(loaded.adj, graph.adj)
+            self.assertEqual(loaded_cycles, project_cycles)
+            self.assertEqual(cycles.call_count, 1)
+            self.assertFalse(detector._builddepinfo.called)
+
+            # Another build state with the same dependencies is fetched, but
+            # not parsed again.
+            detector = self.detector(build_state='2')
+            loaded, loaded_cycles = self.project_graph(detector)
+            self.assertEqual(loaded_cycles, project_cycles)
+            self.assertEqual(cycles.call_count, 1)
+            self.assertTrue(detector._builddepinfo.called)
+
+            # A different state is parsed again.
+            graph, project_cycles = self.project_graph(
+                self.detector(builddepinfo({'a': ['b'], 'b': []}), build_state='3'))
+            self.assertEqual(project_cycles, frozenset())
+            self.assertEqual(cycles.call_count, 2)
+
+            # Unknown build states always fetch.
+            CycleDetector._project_graphs.clear()
+            detector = self.detector(build_state=None)
+            self.project_graph(detector)
+            self.project_graph(detector)
+            self.assertEqual(detector._builddepinfo.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
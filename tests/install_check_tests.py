@@ -0,0 +1,146 @@
+import os
+import stat
+import unittest
+
+import solv
+
+from osclib.install_check import file_conflicts
+from osclib.install_check import RPMFILE_GHOST
+from osclib.install_check import uninstallable
+
+
+DIRECTORY = (stat.S_IFDIR | 0o755, 0, 'root:root', '', '')
+# Ghosts are packaged without permissions or with them depending on rpm.
+GHOST = (stat.S_IFREG, RPMFILE_GHOST, 'root:root', '', '')
+GHOST_PERMISSIONS = (stat.S_IFREG | 0o644, RPMFILE_GHOST, 'root:root', '', '')
+
+
+def regular(digest):
+    return (stat.S_IFREG | 0o644, 0, 'root:root', '', digest)
+
+
+def symlink(target):
+    return (stat.S_IFLNK | 0o777, 0, 'root:root', target, '')
+
+
+def pool_build(binaries, dependencies={}):
+    """Build a pool from a dictionary of file details keyed by binary name.
+
+    Binaries provide their name and have the requires and conflicts listed in
+    dependencies.
+
+    """
+    pool = solv.Pool()
+    pool.setarch('x86_64')
+    repo = pool.add_repo('test')
+    data = repo.add_repodata()
+    solvables = {}
+    for name, files in sorted(binaries.items()):
+        s = repo.add_solvable()
+        s.name = name
+        s.evr = '1-1'
+        s.arch = 'x86_64'
+        s.add_provides(pool.Dep(name))
+        requires, conflicts = dependencies.get(name, ([], []))
+        for dep in requires:
+            s.add_requires(pool.Dep(dep))
+        for dep in conflicts:
+            s.add_conflicts(pool.Dep(dep))
+        for path in sorted(files):
+            data.add_dirstr(s.id, solv.SOLVABLE_FILELIST,
+                            data.str2dir(os.path.dirname(path)), os.path.basename(path))
+        solvables[name] = s
+    data.internalize()
+    pool.createwhatprovides()
+    return pool, solvables
+
+
+class TestUninstallable(unittest.TestCase):
+    def test_uninstallable(self):
+        binaries = dict((name, {}) for name in 'abcdef')
+        dependencies = {
+            'a': (['missing'], []),
+            # Installable, but not together with d.
+            'b': (['c'], ['d']),
+            'd': ([], ['b']),
+            'e': (['a'], []),
+        }
+        pool, solvables = pool_build(binaries, dependencies)
+        sections = uninstallable(pool, [solvables[name] for name in sorted(solvables)])
+        self.assertEqual([section.binaries for section in sections], [['a-1-1.x86_64'], ['e-1-1.x86_64']])
+
+        # Binaries left out by locks are not used to install others.
+        jobs = [pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_LOCK, solvables['c'].id)]
+        sections = uninstallable(pool, [solvables['b'], solvables['d']], jobs)
+        self.assertEqual([section.binaries for section in sections], [['b-1-1.x86_64']])
+
+
+class TestFileConflicts(unittest.TestCase):
+    def file_conflicts(self, binaries, targets):
+        pool, solvables = pool_build(binaries)
+        sections = file_conflicts(pool, solvables.values(), [solvables[name] for name in targets],
+                                  lambda s: binaries[s.name])
+        return [section.text for section in sections]
+
+    def test_shared_directory_ghost(self):
+        binaries = {
+            'a': {
+                '/usr/share/shared': DIRECTORY,
+                '/usr/share/shared/a': regular('a'),
+                '/var/log/shared.log': GHOST,
+            },
+            'b': {
+                '/usr/share/shared': DIRECTORY,
+                '/usr/share/shared/b': regular('b'),
+                '/var/log/shared.log': GHOST_PERMISSIONS,
+            },
+            # Only containing files below the shared directory.
+            'c': {
+                '/usr/share/shared/c/c': regular('c'),
+            },
+        }
+        self.assertEqual(self.file_conflicts(binaries, ['a', 'b', 'c']), [])
+
+    def test_identical(self):
+        binaries = {
+            'a': {
+                '/etc/shared.conf': regular('shared'),
+                '/usr/bin/shared': symlink('shared-1'),
+            },
+            'b': {
+                '/etc/shared.conf': regular('shared'),
+                '/usr/bin/shared': symlink('shared-1'),
+            },
+        }
+        self.assertEqual(self.file_conflicts(binaries, ['a']), [])
+
+        binaries['b']['/etc/shared.conf'] = regular('modified')
+        binaries['b']['/usr/bin/shared'] = symlink('shared-2')
+        self.assertEqual(self.file_conflicts(binaries, ['a']), [
+            'found conflict of a-1-1.x86_64 with b-1-1.x86_64:\n'
+            '  - /etc/shared.conf\n'
+            '  - /usr/bin/shared\n'])
+
+    def test_implicit_directory(self):
+        binaries = {
+            'a': {
+                '/usr/share/shared/a': regular('a'),
+            },
+            'b': {
+                '/usr/share/shared': regular('b'),
+            },
+        }
+        expected = [
+            'found conflict of a-1-1.x86_64 with b-1-1.x86_64:\n'
+            '  - /usr/share/shared [mode mismatch: -644 root:root, d755 root:root]\n']
+        self.assertEqual(self.file_conflicts(binaries, ['a']), expected)
+        self.assertEqual(self.file_conflicts(binaries, ['b']), expected)
+
+    def test_targets(self):
+        binaries = {
+            'a': {'/usr/bin/a': regular('a')},
+            'b': {'/usr/bin/shared': regular('b')},
+            'c': {'/usr/bin/shared': regular('c')},
+        }
+        self.assertEqual(self.file_conflicts(binaries, ['a']), [])
+        self.assertEqual(len(self.file_conflicts(binaries, ['a', 'b'])), 1)
@@ -0,0 +1,56 @@
+"""
+Compare calls per second of persistent memoize caches opened on every call
+against caches kept open for the lifetime of the process (keep_open).
+
+Usage: python -m tests.memoize_benchmark [keys] [calls]
+
+Each run performs the given number of calls spread over the given number of
+distinct keys, the first call for a key being a miss and later calls hits,
+similar to cached_GET() being called while looping over packages.
+"""
+
+from __future__ import print_function
+
+import shutil
+import sys
+import tempfile
+import time
+
+import osclib.memoize
+from osclib.memoize import memoize
+from osclib.memoize import memoize_flush
+
+
+def run(directory, keys, calls, **kwargs):
+    # Start from an empty cache for each run.
+    osclib.memoize.CACHEDIR = tempfile.mkdtemp(dir=directory)
+
+    @memoize(**kwargs)
+    def cached(key):
+        return 'x' * 1024
+
+    start = time.time()
+    for i in range(calls):
+        cached(i % keys)
+    memoize_flush()
+    return time.time() - start
+
+
+def main(keys, calls):
+    directory = tempfile.mkdtemp()
+    try:
+        print('{:,} keys, {:,} calls'.format(keys, calls))
+
+        per_call = run(directory, keys, calls)
+        print('open per call: {:.3f}s ({:,.0f} calls/s)'.format(per_call, calls / per_call))
+
+        keep_open = run(directory, keys, calls, keep_open=True)
+        print('keep open:     {:.3f}s ({:,.0f} calls/s, {:.1f}x)'.format(
+            keep_open, calls / keep_open, per_call / keep_open))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
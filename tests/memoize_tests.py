@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+from mock import patch
+
+import osclib.memoize
+from osclib.memoize import memoize
+from osclib.memoize import memoize_flush
+from osclib.memoize import MemoizeStore
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.cachedir = osclib.memoize.CACHEDIR
+        osclib.memoize.CACHEDIR = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(osclib.memoize.CACHEDIR)
+        osclib.memoize.CACHEDIR = self.cachedir
+
+    def test_persistent(self):
+        @memoize()
+        def func(a, b=None):
+            self.calls.append(a)
+            return [a, b]
+
+        self.assertEqual(func('a', b={'x': 1, 'y': 2}), ['a', {'x': 1, 'y': 2}])
+        self.assertEqual(func('a', b={'y': 2, 'x': 1}), ['a', {'x': 1, 'y': 2}])
+        self.assertEqual(func('b'), ['b', None])
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertTrue(os.path.exists(os.path.join(osclib.memoize.CACHEDIR, 'func.sqlite')))
+
+    def test_ttl(self):
+        @memoize(ttl=-1)
+        def func(a):
+            self.calls.append(a)
+            return a
+
+        func('a')
+        func('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_invalidate(self):
+        class Example(object):
+            @memoize(add_invalidate=True)
+            def method(_self, a):
+                self.calls.append(a)
+                return a
+
+        example = Example()
+        example.method('a')
+        example.method('a')
+        self.assertEqual(self.calls, ['a'])
+
+        example._invalidate_all()
+        example.method('a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_keep_open(self):
+        @memoize(keep_open=True)
+        def func(a):
+            self.calls.append(a)
+            return a
+
+        func('a')
+        func('a')
+        self.assertEqual(self.calls, ['a'])
+
+        # Writes are only visible to other handles once flushed.
+        filename = os.path.join(osclib.memoize.CACHEDIR, 'func.sqlite')
+        store = MemoizeStore(filename, 10, 4, 60)
+        store.open()
+        self.assertEqual(len(store), 0)
+        memoize_flush()
+        self.assertEqual(len(store), 1)
+        store.close()
+
+        memoize.stores.pop().close()
+
+
+class TestMemoizeStore(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.directory = tempfile.mkdtemp()
+        self.store = MemoizeStore(os.path.join(self.directory, 'store.sqlite'), 10, 4, 60)
+        self.store.open()
+
+    def tearDown(self):
+        """Clean the environment."""
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_items(self):
+        self.assertFalse('a' in self.store)
+        self.store['a'] = (100.0, {'value': 1})
+        self.assertTrue('a' in self.store)
+        self.assertEqual(self.store['a'], (100.0, {'value': 1}))
+        del self.store['a']
+        self.assertFalse('a' in self.store)
+        self.assertRaises(KeyError, self.store.__getitem__, 'a')
+
+    def test_clean(self):
+        for i in range(9):
+            self.store[str(i)] = (1000.0 + i, i)
+        self.assertEqual(len(self.store), 9)
+
+        # Reaching the limit removes the oldest entries.
+        self.store['9'] = (1009.0, 9)
+        self.assertEqual(len(self.store), 6)
+        self.assertFalse('3' in self.store)
+        self.assertTrue('4' in self.store)
+
+        # Expired entries are removed upon insertion.
+        self.store['10'] = (1064.5, 10)
+        self.assertEqual(len(self.store), 6)
+        self.assertFalse('4' in self.store)
+        self.assertTrue('10' in self.store)
+
+    def test_count(self):
+        for i in range(3):
+            self.store[str(i)] = (1000.0 + i, i)
+        self.assertEqual(self.store.count, 3)
+
+        # The count is kept without counting the entries again.
+        with patch.object(MemoizeStore, '__len__', MagicMock(return_value=0)):
+            self.store['3'] = (1003.0, 3)
+            del self.store['0']
+        self.assertEqual(self.store.count, 3)
+        self.assertEqual(len(self.store), 3)
+
+    def test_fork(self):
+        self.store['a'] = (1000.0, 'a')
+        connection = self.store.connection
+
+        # A forked process opens its own connection.
+        with patch('osclib.memoize.os.getpid', MagicMock(return_value=-1)):
+            self.assertTrue('a' in self.store)
+            self.assertIsNot(self.store.connection, connection)
+
+    def test_fork_batch(self):
+        self.store.batch = True
+        self.store['a'] = (1000.0, 'a')
+
+        # Pending writes are left to the parent instead of every child.
+        with patch('osclib.memoize.os.getpid', MagicMock(return_value=-1)):
+            self.store.flush()
+            self.assertEqual(self.store.pending, {})
+            self.assertEqual(len(self.store), 0)
+
+    def test_batch(self):
+        self.store.batch = True
+        self.store['a'] = (1000.0, 'a')
+        self.assertTrue('a' in self.store)
+        self.assertEqual(self.store['a'], (1000.0, 'a'))
+        self.assertEqual(len(self.store), 0)
+
+        self.store.flush()
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.pending, {})
+
+        # Flushed once nclean writes are pending.
+        for i in range(4):
+            self.store[str(i)] = (1001.0 + i, i)
+        self.assertEqual(len(self.store), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
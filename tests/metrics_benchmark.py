@@ -0,0 +1,223 @@
+"""
+Compare generating request points from an lxml tree queried by XPath with
+dates parsed by dateutil, as previously done by metrics.ingest_requests(),
+against generating them from records produced by the streaming parser.
+
+Usage: python -m tests.metrics_benchmark [search result] [requests]
+
+A search result can be recorded using:
+
+    osc api "/search/request?match=action/target/@project='openSUSE:Factory'&withfullhistory=1&limit=1000" > search.xml
+
+Without one tests/fixtures/benchmark/search-request.xml is used. The requests
+of the search result are repeated until the given number of requests is
+reached.
+"""
+
+from __future__ import print_function
+
+import copy
+from dateutil.parser import parse as date_parse
+import io
+from lxml import etree as ET
+import os
+import sys
+import time
+
+import metrics
+from metrics import Point
+from osclib.stagingapi import StagingAPI
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'benchmark', 'search-request.xml')
+
+
+def ingest_request_xpath(api, project, request, points):
+    """Point generation previously used by ingest_requests()."""
+    def point(measurement, fields, datetime, tags={}, delta=False):
+        points.append(Point(measurement, tags, fields, metrics.timestamp(datetime), delta))
+
+    created_at = date_parse(request.find('history').get('when'))
+    final_at = date_parse(request.find('state').get('when'))
+    final_at_history = date_parse(request.find('history[last()]').get('when'))
+    if final_at_history > final_at:
+        final_at = final_at_history
+
+    point('total', {'backlog': 1, 'open': 1}, created_at, {'event': 'create'}, True)
+    point('total', {'backlog': -1, 'open': -1}, final_at, {'event': 'close'}, True)
+
+    request_tags = {}
+    request_fields = {
+        'total': (final_at - created_at).total_seconds(),
+        'staged_count': len(request.findall('review[@by_group="factory-staging"]/history')),
+    }
+
+    staged_first_review = request.xpath('review[contains(@by_project, "{}:Staging:")]'.format(project))
+    if len(staged_first_review):
+        by_project = staged_first_review[0].get('by_project')
+        request_tags['type'] = 'adi' if api.is_adi_project(by_project) else 'letter'
+        if project.startswith('openSUSE:Factory'):
+            splitter_whitelist = 'B C D E F G H I J'.split()
+            if splitter_whitelist:
+                short = api.extract_staging_short(by_project)
+                request_tags['whitelisted'] = short in splitter_whitelist
+        else:
+            request_tags['whitelisted'] = request_tags['type'] == 'letter'
+
+    ready_to_accept = request.xpath('review[contains(@by_project, "{}:Staging:adi:") and @state="accepted"]/history[comment[text() = "ready to accept"]]/@when'.format(project))
+    if len(ready_to_accept):
+        ready_to_accept = date_parse(ready_to_accept[0])
+        request_fields['ready'] = (final_at - ready_to_accept).total_seconds()
+        point('ready', {'count': 1}, ready_to_accept, delta=True)
+        point('ready', {'count': -1}, final_at, delta=True)
+
+    staged_first = request.xpath('review[@by_group="factory-staging"]/history/@when')
+    if len(staged_first):
+        staged_first = date_parse(staged_first[0])
+        request_fields['staged_first'] = (staged_first - created_at).total_seconds()
+        point('request_staged_first', {'value': request_fields['staged_first']}, staged_first, request_tags)
+
+    point('request', request_fields, final_at, request_tags)
+
+    for number, review in enumerate(
+        request.xpath('review[contains(@by_project, "{}:Staging:")]'.format(project)), start=1):
+        staged_at = date_parse(review.get('when'))
+
+        project_type = 'adi' if api.is_adi_project(review.get('by_project')) else 'letter'
+        short = api.extract_staging_short(review.get('by_project'))
+        point('staging', {'count': 1}, staged_at,
+              {'id': short, 'type': project_type, 'event': 'select'}, True)
+        point('total', {'backlog': -1, 'staged': 1}, staged_at, {'event': 'select'}, True)
+
+        who = who_workaround_xpath(request, review)
+        review_tags = {'event': 'select', 'user': who, 'number': number}
+        review_tags.update(request_tags)
+        point('user', {'count': 1}, staged_at, review_tags)
+
+        history = review.find('history')
+        if history is not None:
+            unselected_at = date_parse(history.get('when'))
+        else:
+            unselected_at = final_at
+
+        point('staging', {'count': -1}, unselected_at,
+              {'id': short, 'type': project_type, 'event': 'unselect'}, True)
+        point('total', {'backlog': 1, 'staged': -1}, unselected_at, {'event': 'unselect'}, True)
+
+    for review in request.xpath('review[not(contains(@by_project, "{}:Staging:"))]'.format(project)):
+        tags = {
+            'state': review.get('state'),
+        }
+
+        opened_at = date_parse(review.get('when'))
+        history = review.find('history')
+        if history is not None:
+            completed_at = date_parse(history.get('when'))
+            tags['who_completed'] = history.get('who')
+        else:
+            completed_at = final_at
+
+        tags['key'] = []
+        tags['type'] = []
+        for name, value in sorted(review.items(), reverse=True):
+            if name.startswith('by_'):
+                tags[name] = value
+                tags['key'].append(value)
+                tags['type'].append(name[3:])
+        tags['type'] = '_'.join(tags['type'])
+
+        point('review', {'open_for': (completed_at - opened_at).total_seconds()}, completed_at, tags)
+        point('review_count', {'count':  1}, opened_at, tags, True)
+        point('review_count', {'count': -1}, completed_at, tags, True)
+
+    found = []
+    for set_priority in request.xpath('history[description[contains(text(), "Request got a new priority:")]]'):
+        parts = set_priority.find('description').text.rsplit(' ', 3)
+        priority_previous = parts[1]
+        priority = parts[3]
+        if priority == priority_previous:
+            continue
+
+        changed_at = date_parse(set_priority.get('when'))
+        if priority_previous != 'moderate':
+            point('priority', {'count': -1}, changed_at, {'level': priority_previous}, True)
+        if priority != 'moderate':
+            point('priority', {'count': 1}, changed_at, {'level': priority}, True)
+            found.append(priority)
+
+    priority = request.find('priority')
+    if priority is not None and priority.text != 'moderate':
+        if priority.text in found:
+            point('priority', {'count': -1}, final_at, {'level': priority.text}, True)
+
+
+def who_workaround_xpath(request, review, relax=False):
+    who = review.get('who')
+    when = review.get('when')
+    if relax:
+        when = when[:-2]
+
+    who_real = request.xpath(
+        'history[contains(@when, "{}") and comment[contains(text(), "{}")]]/@who'.format(
+            when, review.get('by_project')))
+    if len(who_real):
+        who = who_real[0]
+    elif not relax:
+        return who_workaround_xpath(request, review, True)
+
+    return who
+
+
+def search_result(filename, count):
+    """Repeat the requests in filename to form a result of count requests."""
+    requests = ET.parse(filename).getroot().findall('request')
+    collection = ET.Element('collection', matches=str(count))
+    for i in range(count):
+        request = copy.deepcopy(requests[i % len(requests)])
+        request.set('id', str(1000000 + i))
+        collection.append(request)
+    return ET.tostring(collection)
+
+
+def run_xpath(api, project, data):
+    points = []
+    for request in ET.fromstring(data).findall('request'):
+        if request.find('action').get('type') in ('submit', 'delete'):
+            ingest_request_xpath(api, project, request, points)
+    return points
+
+
+def run_records(api, project, data):
+    metrics.points = []
+    _, records = metrics.request_records_parse(io.BytesIO(data))
+    for request in records:
+        if request.type in ('submit', 'delete'):
+            metrics.ingest_request(api, project, request)
+    return metrics.points
+
+
+def measure(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def main(filename=FIXTURE, count=20000):
+    project = 'openSUSE:Factory'
+    api = StagingAPI.__new__(StagingAPI)
+    api.cstaging = project + ':Staging'
+    metrics.who_workaround_swap = metrics.who_workaround_miss = 0
+
+    data = search_result(filename, int(count))
+    print('{:,} requests, {:,} bytes'.format(int(count), len(data)))
+
+    xpath, expected = measure(run_xpath, api, project, data)
+    print('xpath:   {:.3f}s'.format(xpath))
+
+    records, result = measure(run_records, api, project, data)
+    print('records: {:.3f}s ({:.1f}x)'.format(records, xpath / records))
+
+    print('{:,} points, results {}'.format(len(result), 'match' if result == expected else 'DIFFER'))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
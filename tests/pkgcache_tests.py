@@ -19,8 +19,8 @@ import shutil
 import unittest
 
 from mock import MagicMock
+from mock import patch
 
-import osclib.pkgcache
 from osclib.pkgcache import PkgCache
 
 
@@ -84,24 +84,40 @@ class TestPkgCache(unittest.TestCase):
         self.cache[('file_a', 1)] = '/tmp/file_a'
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
         self.cache[('file_a', 2)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
         self.cache[('file_a', 3)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/c7'), ['f33375edf32d8fb62d4b505c74519a'])
 
         del self.cache[('file_a', 2)]
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
 
         del self.cache[('file_a', 1)]
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
 
         del self.cache[('file_a', 3)]
         self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+
+    def test_replace(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_a', 1)] = '/tmp/file_b'
+        self.assertEqual(self.cache[('file_a', 1)], ('a7004efbb89078ebcc8f21d55354e2f3', 'file_b'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+
+        del self.cache[('file_a', 1)]
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7'))
+        self.assertRaises(KeyError, self.cache.__delitem__, ('file_a', 1))
+
+    def test_orphan(self):
+        # File linked by an insertion interrupted before the content row.
+        os.makedirs('/tmp/cache/pkgcache/c7')
+        with open('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a', 'w') as f:
+            f.write('partial')
+
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.assertEqual(open('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a').read(), 'file_a\n')
+
+        del self.cache[('file_a', 1)]
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
 
     def test_linkto(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
@@ -119,13 +135,16 @@ class TestPkgCache(unittest.TestCase):
         self.cache[('file_b', 1)] = '/tmp/file_b'
         self.cache[('file_c', 1)] = '/tmp/file_c'
 
-        osclib.pkgcache.time.time = MagicMock(return_value=3)
-        self.cache._clean_cache(ttl=2)
+        with patch('osclib.pkgcache.time.time', MagicMock(return_value=3)):
+            self.cache._clean_cache(ttl=2)
         self.assertFalse(('file_a', 1) in self.cache)
         self.assertFalse(('file_a', 2) in self.cache)
         self.assertTrue(('file_a', 3) in self.cache)
         self.assertFalse(('file_b', 1) in self.cache)
         self.assertFalse(('file_c', 1) in self.cache)
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/22'))
 
 if __name__ == '__main__':
     unittest.main()
@@ -88,7 +88,7 @@ class UpdateCrawler(object):
                 packages.add(title[3:].split(' ')[0])
         return sorted(packages)
 
-    @memoize()
+    @memoize(keep_open=True)
     def _cached_GET(self, url):
         return self.retried_GET(url).read()
 